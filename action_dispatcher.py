@@ -2,6 +2,7 @@ import os
 import requests
 import json
 from dotenv import load_dotenv
+from knowledge_store import HttpKnowledgeStore
 
 # 環境変数の読み込み
 load_dotenv()
@@ -10,10 +11,14 @@ class ActionDispatcher:
     """
     AIの判断を物理操作（Slack/kintone/Knowledge）へ変換する。
     Ver 3.8.0: オンデマンドなナレッジ注入（ingest_knowledge）を追加。
+    Ver 3.9: サーバーからはジョブキュー（job_queue.py）経由で呼ばれる。再試行しても結果が変わらない
+    エラーは "retryable": False を返す。
+    knowledge_store: ingest_knowledge の書き込み先。未指定時は AXIOM_API_BASE への HTTP（リモート運用向け）。
     """
-    def __init__(self):
+    def __init__(self, knowledge_store=None):
         self.axiom_api_base = os.getenv("AXIOM_API_BASE", "http://localhost:5001/api")
         self.axiom_token = os.getenv("AXIOM_TOKEN", "axiom-secure-2026")
+        self.knowledge_store = knowledge_store or HttpKnowledgeStore(self.axiom_api_base, self.axiom_token)
 
         # kintone 設定
         self.kintone_domain = os.getenv("KINTONE_DOMAIN")
@@ -45,7 +50,7 @@ class ActionDispatcher:
                 return self._slack_api_post(params)
             if cmd == "kintone_update":
                 return self._kintone_api_update(params)
-            return {"status": "error", "error": f"Unknown command: {cmd}"}
+            return {"status": "error", "error": f"Unknown command: {cmd}", "retryable": False}
         except Exception as e:
             print(f"❌ [Dispatcher Error] {e}")
             return {"status": "exception", "details": str(e)}
@@ -54,28 +59,21 @@ class ActionDispatcher:
         """
         AIが抽出したURLと情報を Axiom のナレッジベースへ自律的に書き戻す
         """
-        url = f"{self.axiom_api_base}/ingest"
-        headers = {"Authorization": f"Bearer {self.axiom_token}", "Content-Type": "application/json"}
         doc = {
             "title": params.get("title", "新規依頼資料"),
             "url": params.get("url", ""),
             "ingested_at": params.get("ingested_at", "now"),
             "source": params.get("source", "Human Request via Chat")
         }
-        payload = {"category": "on_demand_docs", "payload": [doc]}
-        try:
-            res = requests.post(url, headers=headers, json=payload, timeout=10)
-            if res.status_code == 200:
-                print(f"🧠 [Self-Evolution] New Knowledge Integrated: {doc.get('title')}")
-                return {"status": "success"}
-            return {"status": "error", "error": res.text}
-        except Exception as e:
-            return {"status": "error", "error": str(e)}
+        res = self.knowledge_store.ingest("on_demand_docs", [doc])
+        if res.get("status") == "success":
+            print(f"🧠 [Self-Evolution] New Knowledge Integrated: {doc.get('title')}")
+        return res
 
     def _slack_api_post(self, params):
         """Slack chat.postMessage API"""
         if not self.slack_token:
-            return {"status": "error", "error": "Token missing"}
+            return {"status": "error", "error": "Token missing", "retryable": False}
         url = "https://slack.com/api/chat.postMessage"
         headers = {"Authorization": f"Bearer {self.slack_token}", "Content-Type": "application/json"}
         channel = params.get("channel") or self.default_channel
@@ -90,7 +88,10 @@ class ActionDispatcher:
             ]
         }
         res = requests.post(url, headers=headers, json=payload, timeout=10).json()
-        return {"status": "success"} if res.get("ok") else {"status": "error", "error": res.get("error")}
+        if res.get("ok"):
+            return {"status": "success"}
+        # channel_not_found / invalid_auth などは再試行しても通らない（ratelimited のみ再試行）
+        return {"status": "error", "error": res.get("error"), "retryable": res.get("error") == "ratelimited"}
 
     def _kintone_api_update(self, params):
         """
@@ -99,11 +100,11 @@ class ActionDispatcher:
         """
         if not all([self.kintone_domain, self.kintone_token, self.kintone_app_id]):
             print("⚠️ [kintone] 構成情報が不足しています。実効をスキップします。")
-            return {"status": "error", "error": "Config missing"}
+            return {"status": "error", "error": "Config missing", "retryable": False}
 
         record_id = params.get("record_id")
         if not record_id:
-            return {"status": "error", "error": "No record_id provided"}
+            return {"status": "error", "error": "No record_id provided", "retryable": False}
 
         url = f"https://{self.kintone_domain}/k/v1/record.json"
         headers = {
@@ -132,7 +133,9 @@ class ActionDispatcher:
                 except Exception:
                     error_info = res.text
                 print(f"❌ [kintone API Error] {error_info}")
-                return {"status": "error", "error": error_info}
+                # 4xx（429 以外）は入力・権限の問題なので再試行しない
+                return {"status": "error", "error": error_info,
+                        "retryable": res.status_code == 429 or res.status_code >= 500}
         except Exception as e:
             return {"status": "connection_error", "details": str(e)}
 
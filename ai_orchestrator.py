@@ -22,7 +22,9 @@ def main():
     # 観測エージェントをインポートしてテスト送信
     try:
         from observer_bot import observe_and_send
-        ok = observe_and_send("orchestrator", {"event": "orchestrator_started"})
+        from axiom_client import get_client
+        observe_and_send("orchestrator", {"event": "orchestrator_started"})
+        ok = get_client().flush(timeout=10)
         print("Central Brain 疎通:", "OK" if ok else "NG")
     except Exception as e:
         print("observer_bot 連携:", e)
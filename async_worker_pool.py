@@ -0,0 +1,103 @@
+"""
+Async Worker Pool - 常駐イベントループ上で Gemini 呼び出しを並行実行する。
+Flask のワーカースレッドは結果待ちのみを行い、LLM の I/O は単一ループに集約される。
+"""
+import asyncio
+import threading
+
+
+class PoolSaturated(Exception):
+    """同時実行数 + キュー深さの上限に達し、リクエストを受け付けられない。"""
+
+
+class AsyncWorkerPool:
+    """
+    常駐イベントループ（専用スレッド）と、同時実行数・待ち行列の上限を持つ実行プール。
+    - max_concurrency: 同時に走らせるコルーチン数（Semaphore）
+    - max_queue: 実行枠の空き待ちを許す件数。超過分は PoolSaturated で即時拒否（429）
+    """
+    def __init__(self, max_concurrency=8, max_queue=32, name="axiom-async-loop"):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self._name = name
+        self._loop = None
+        self._thread = None
+        self._sem = None
+        self._admitted = 0
+        self._lock = threading.Lock()
+        self._started = threading.Event()
+
+    # --- ループ管理 ---
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._started.clear()
+            self._thread = threading.Thread(target=self._run_loop, name=self._name, daemon=True)
+            self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+        self._started.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        if self._loop and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    @property
+    def loop(self):
+        self.start()
+        return self._loop
+
+    # --- 受付制御 ---
+    def _admit(self, weight=1):
+        with self._lock:
+            if self._admitted + weight > self.max_concurrency + self.max_queue:
+                raise PoolSaturated(f"in-flight {self._admitted} / limit {self.max_concurrency + self.max_queue}")
+            self._admitted += weight
+
+    def _release(self, weight=1):
+        with self._lock:
+            self._admitted -= weight
+
+    async def _gated(self, coro):
+        async with self._sem:
+            return await coro
+
+    def submit(self, coro, gated=True):
+        """
+        コルーチンをループへ投入し concurrent.futures.Future を返す。
+        gated=False は内部で個別に gate() を取るバッチ用（枠の二重取得によるデッドロック防止）。
+        """
+        self.start()
+        try:
+            self._admit()
+        except PoolSaturated:
+            coro.close()
+            raise
+        fut = asyncio.run_coroutine_threadsafe(self._gated(coro) if gated else coro, self._loop)
+        fut.add_done_callback(lambda _f: self._release())
+        return fut
+
+    def run(self, coro, timeout=None, gated=True):
+        """submit して結果を待つ（Flask ハンドラ用）。"""
+        return self.submit(coro, gated=gated).result(timeout=timeout)
+
+    def gate(self):
+        """ループ内から同時実行枠を取得するための Semaphore（async with で使用）。"""
+        self.start()
+        return self._sem
+
+    def stats(self):
+        with self._lock:
+            admitted = self._admitted
+        return {
+            "in_flight": min(admitted, self.max_concurrency),
+            "queued": max(0, admitted - self.max_concurrency),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
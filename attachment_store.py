@@ -0,0 +1,205 @@
+"""
+Attachment Store - 添付ファイルの内容アドレス型ストア（SHA-256）。
+/api/attachments へのアップロードを一時ファイルへ逐次書き込みながらハッシュし、root/<id 先頭 2 文字>/<id> に置く。
+同じ内容は 1 つの blob にまとまり、メッセージは attachments: [{"id": ...}] で参照する。
+モデルへ渡す前に大きな画像を縮小・再圧縮した版（<id>.model）を 1 回だけ作り、
+Gemini Files API にアップロードしたファイル（uri・有効期限）を id ごとに覚えて、同じ内容の再送をなくす。
+縮小には Pillow を使う（未導入なら原本のまま渡す）。
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Content-Type がない / octet-stream のときに先頭バイトから推定する
+_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+)
+# 有効期限がこれより近い Files API のファイルは使わずにアップロードし直す
+REMOTE_MARGIN_SEC = 600
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+def _sniff(head):
+    for magic, mime in _MAGIC:
+        if head.startswith(magic):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class AttachmentStore:
+    """
+    - put_stream(stream, mime, name) / put_bytes(data, mime, name): 保存してメタデータ（id・mime・size 等）を返す
+    - get(id): メタデータ、なければ None（id は 64 桁の 16 進数のみ受け付ける）
+    - model_file(id): モデルへ渡す (パス, mime)。max_side を超える / recompress_bytes を超える画像は縮小版
+    - remote(id) / remember_remote(id, uri, mime, expires): Files API のアップロード済みファイル
+    メタデータは blob の隣の <id>.json に置き、プロセスを再起動しても縮小版・アップロード済みファイルを使い回す。
+    """
+    def __init__(self, root, max_bytes=20 * 1024 * 1024, max_side=1600, recompress_bytes=1024 * 1024, jpeg_quality=85):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self.recompress_bytes = recompress_bytes
+        self.jpeg_quality = jpeg_quality
+        self._tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        self._meta = {}  # id -> メタデータ（読んだ分だけ）
+        self._lock = threading.Lock()
+        self._pil_missing = False
+        self.counters = {"stored": 0, "deduplicated": 0, "downscaled": 0, "remote_reused": 0, "remote_uploaded": 0}
+
+    def _path(self, blob_id, suffix=""):
+        return os.path.join(self.root, blob_id[:2], blob_id + suffix)
+
+    def _write_meta(self, blob_id, meta):
+        path = self._path(blob_id, ".json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self._meta[blob_id] = meta
+
+    def _update_meta(self, blob_id, **fields):
+        with self._lock:
+            meta = dict(self.get(blob_id) or {})
+            meta.update(fields)
+            self._write_meta(blob_id, meta)
+            return meta
+
+    def get(self, blob_id):
+        if not isinstance(blob_id, str) or not _ID_PATTERN.match(blob_id):
+            return None
+        meta = self._meta.get(blob_id)
+        if meta is not None:
+            return meta
+        try:
+            with open(self._path(blob_id, ".json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._meta[blob_id] = meta
+        return meta
+
+    def path(self, blob_id):
+        return self._path(blob_id) if self.get(blob_id) else None
+
+    def put_stream(self, stream, mime=None, name=None, chunk_size=64 * 1024):
+        """stream を chunk_size ずつ読み、ハッシュしながら一時ファイルへ書く（全体をメモリに載せない）。"""
+        digest, size, head = hashlib.sha256(), 0, b""
+        fd, tmp = tempfile.mkstemp(dir=self._tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise AttachmentTooLarge(f"attachment exceeds {self.max_bytes} bytes")
+                    if len(head) < 16:
+                        head += chunk[:16]
+                    digest.update(chunk)
+                    f.write(chunk)
+            if not size:
+                raise ValueError("empty attachment")
+            blob_id = digest.hexdigest()
+            mime = (mime or "").split(";")[0].strip().lower()
+            if not mime or mime == "application/octet-stream":
+                mime = _sniff(head)
+            with self._lock:
+                existing = self.get(blob_id)
+                if existing is not None and os.path.exists(self._path(blob_id)):
+                    os.remove(tmp)
+                    self.counters["deduplicated"] += 1
+                    return {**existing, "deduplicated": True}
+                os.makedirs(os.path.dirname(self._path(blob_id)), exist_ok=True)
+                os.replace(tmp, self._path(blob_id))
+                meta = {"id": blob_id, "mime": mime, "size": size, "name": name or "", "created": time.time()}
+                self._write_meta(blob_id, meta)
+                self.counters["stored"] += 1
+                return {**meta, "deduplicated": False}
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def put_bytes(self, data, mime=None, name=None):
+        return self.put_stream(io.BytesIO(data), mime, name)
+
+    def _downscale(self, blob_id, meta):
+        """縮小・再圧縮した版を <id>.model に書き、そのメタデータを返す。原本のままでよければ {}。"""
+        if meta["mime"] not in ("image/png", "image/jpeg", "image/webp") or self.max_side <= 0:
+            return {}
+        try:
+            from PIL import Image
+        except ImportError:
+            if not self._pil_missing:
+                self._pil_missing = True
+                print("⚠️ [Attachments] Pillow not installed, images are sent without downscaling")
+            return {}
+        try:
+            with Image.open(self._path(blob_id)) as img:
+                if max(img.size) <= self.max_side and meta["size"] <= self.recompress_bytes:
+                    return {}
+                img.thumbnail((self.max_side, self.max_side))
+                out = io.BytesIO()
+                if img.mode in ("RGBA", "LA", "P"):
+                    img.save(out, format="PNG", optimize=True)
+                    mime = "image/png"
+                else:
+                    img.convert("RGB").save(out, format="JPEG", quality=self.jpeg_quality, optimize=True)
+                    mime = "image/jpeg"
+        except Exception as e:
+            print(f"⚠️ [Attachments] Downscale failed for {blob_id[:12]}: {e}")
+            return {}
+        data = out.getvalue()
+        if len(data) >= meta["size"]:
+            return {}
+        with open(self._path(blob_id, ".model"), "wb") as f:
+            f.write(data)
+        self.counters["downscaled"] += 1
+        return {"mime": mime, "size": len(data), "side": self.max_side}
+
+    def model_file(self, blob_id):
+        """モデルへ渡す (パス, mime)。縮小版は初回に作ってメタデータに記録する。"""
+        meta = self.get(blob_id)
+        if meta is None:
+            return None
+        variant = meta.get("model")
+        if variant is None or (variant and variant.get("side") != self.max_side):
+            variant = self._downscale(blob_id, meta)
+            meta = self._update_meta(blob_id, model=variant)
+        if variant:
+            return self._path(blob_id, ".model"), variant["mime"]
+        return self._path(blob_id), meta["mime"]
+
+    def remote(self, blob_id):
+        """有効期限内の Files API ファイル (uri, mime)、なければ None。"""
+        handle = (self.get(blob_id) or {}).get("remote")
+        if not handle:
+            return None
+        if handle.get("expires") and handle["expires"] - REMOTE_MARGIN_SEC < time.time():
+            return None
+        self.counters["remote_reused"] += 1
+        return handle["uri"], handle["mime"]
+
+    def remember_remote(self, blob_id, uri, mime, expires=None):
+        self.counters["remote_uploaded"] += 1
+        self._update_meta(blob_id, remote={"uri": uri, "mime": mime, "expires": expires})
+
+    def stats(self):
+        return dict(self.counters)
@@ -0,0 +1,359 @@
+"""
+Axiom Client - エージェント共通の Central Brain 送信ライブラリ。
+接続を使い回す Session、メモリ上のリングバッファ、件数/時間でのバッチ送信（/api/logs/batch）、
+指数バックオフ再送、サーバー不達時のディスク退避（spool）を提供する。
+"""
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CENTRAL_BRAIN_URL = os.getenv("CENTRAL_BRAIN_URL", "http://localhost:5000/api/logs")
+AXIOM_TOKEN = os.getenv("AXIOM_TOKEN", "axiom-secure-2026")
+
+# 再送しても結果が変わらないステータス（ペイロード不正など）は破棄する
+_RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+# バッチ API がない送信先（mock_backend.py など）: 1 件ずつ /api/logs へ送る
+_NO_BATCH_STATUS = {404, 405}
+# spool の 1 行。項目単位で失敗して再送待ちになったものは試行回数を付けて包む（それ以外は従来どおりペイロードそのもの）
+_RETRY_KEY = "_axiom_retry"
+
+
+def default_spool_path(agent=None):
+    """エージェントごとの spool（既定はスクリプト名）。AXIOM_CLIENT_SPOOL で明示指定もできる。"""
+    if os.getenv("AXIOM_CLIENT_SPOOL"):
+        return os.getenv("AXIOM_CLIENT_SPOOL")
+    agent = agent or os.path.splitext(os.path.basename(sys.argv[0] or ""))[0] or "default"
+    return f"axiom_client_spool.{re.sub(r'[^0-9A-Za-z_.-]+', '_', agent)}.jsonl"
+
+
+class AxiomClient:
+    """
+    - send(payload): バッファに積むだけで即座に戻る。batch_size 件 or flush_interval 秒で送信。
+      サーバー不達のバックオフ中・バッファ溢れで spool へ退避した場合は False（後で再送はする）
+    - post(payload): 1 件を同期送信して decision を含む応答 JSON を返す（失敗時 None）。
+      失敗時の last_post_reached が False なら一度もサーバーに届いていない（send で再送しても二重登録にならない）
+    - flush(timeout): バッファ（と spool）を送り切るまで待つ。送り切れたら True
+    - on_drop(payload, reason): 再送しても通らず破棄した項目の通知（既定はログ出力のみ。stats["dropped"] にも数える）
+    バッファが max_buffer を超えた分と、再送上限に達したバッチは spool_path（JSONL）へ退避し、
+    疎通回復後に古い順から再送する。バッチ応答で項目単位に失敗したものも spool へ戻し、max_retries 回まで再送する。
+    バッチ API が 404 / 405 の送信先には 1 件ずつ logs_url へ送る。spool の壊れた行（途中で切れた末尾など）は読み飛ばす。
+    spool_path の既定は agent（省略時はスクリプト名）ごとの別ファイル（同じ spool を複数プロセスで共有しないこと）。
+    """
+    def __init__(self, logs_url=CENTRAL_BRAIN_URL, token=AXIOM_TOKEN, batch_size=20, flush_interval=2.0,
+                 max_buffer=5000, spool_path=None, max_retries=4,
+                 backoff_base=0.5, backoff_max=30.0, timeout=120, agent=None, on_drop=None):
+        self.logs_url = logs_url.rstrip("/")
+        self.batch_url = f"{self.logs_url}/batch"
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.max_buffer = max(1, int(max_buffer))
+        self.spool_path = spool_path or default_spool_path(agent)
+        self.spool_offset_path = f"{self.spool_path}.offset"
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.on_drop = on_drop
+        self.batch_supported = True
+        self.last_post_reached = False
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._spool_lock = threading.RLock()  # spool・offset ファイルの読み書きはすべてこのロックの中で行う
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._retry_at = 0.0  # 疎通断のバックオフ中はこの時刻まで送信しない
+        self._failures = 0
+        self.stats = {"sent": 0, "spooled": 0, "dropped": 0, "batches": 0}
+        self._thread = threading.Thread(target=self._run, name="axiom-client-flush", daemon=True)
+        self._thread.start()
+
+    # --- 公開 API ---
+    def send(self, payload):
+        with self._lock:
+            self._buffer.append(payload)
+            overflow = []
+            while len(self._buffer) > self.max_buffer:
+                overflow.append(self._buffer.popleft())
+            size = len(self._buffer)
+        if overflow:
+            self._spool(overflow)
+        if size >= self.batch_size:
+            self._wake.set()
+        return not overflow and time.monotonic() >= self._retry_at
+
+    def post(self, payload):
+        """1 件を同期送信（応答の decision が必要なエージェント用）。"""
+        self.last_post_reached = False
+        for attempt in range(self.max_retries + 1):
+            try:
+                r = self.session.post(self.logs_url, json=payload, timeout=self.timeout)
+                self.last_post_reached = True
+                if r.status_code == 200:
+                    return r.json()
+                if r.status_code not in _RETRYABLE_STATUS:
+                    print(f"[Axiom Client] 送信エラー: {r.status_code} {r.text[:200]}")
+                    return None
+            except requests.RequestException as e:
+                # 接続できなかった場合以外（応答待ちのタイムアウト等）はサーバーが受理済みの可能性がある
+                if not isinstance(e, requests.ConnectionError):
+                    self.last_post_reached = True
+                print(f"[Axiom Client] 接続エラー: {e}")
+            if attempt < self.max_retries:
+                time.sleep(self._backoff(attempt))
+        return None
+
+    def flush(self, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        self._retry_at = 0.0
+        while time.monotonic() < deadline:
+            settled = self.stats["sent"] + self.stats["dropped"]
+            if not self._flush_once():
+                return False
+            with self._lock:
+                empty = not self._buffer
+            if empty and not self._spool_pending():
+                return True
+            if self.stats["sent"] + self.stats["dropped"] == settled:
+                time.sleep(0.1)  # 進まなかった（他スレッドが送信中など）: 空回りしない
+        return False
+
+    def close(self, timeout=10.0):
+        self._stopped.set()
+        self._wake.set()
+        ok = self.flush(timeout=timeout)
+        if not ok:
+            with self._lock:
+                rest = list(self._buffer)
+                self._buffer.clear()
+            self._spool(rest)
+        return ok
+
+    # --- 送信ループ ---
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(timeout=self.flush_interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            if time.monotonic() < self._retry_at:
+                continue
+            try:
+                self._flush_once()
+            except Exception as e:
+                print(f"[Axiom Client] flush エラー: {e}")
+
+    def _flush_once(self):
+        """spool（古いもの）→ バッファの順で 1 バッチ送信。送信成功または送るものなしで True。"""
+        with self._send_lock:
+            spooled, next_offset = self._read_spool(self.batch_size)
+            if spooled:
+                rest = self._post_batch(spooled)
+                if len(rest) == len(spooled):
+                    return False  # 何も届いていない: spool はそのまま
+                self._commit_spool(next_offset)
+                self._spool_entries(rest)  # 1 件ずつ送って途中で止まった残り
+                return not rest
+            if next_offset:
+                self._commit_spool(next_offset)  # 壊れた行だけだった
+            with self._lock:
+                batch = [(self._buffer.popleft(), 0) for _ in range(min(self.batch_size, len(self._buffer)))]
+            if not batch:
+                return True
+            rest = self._post_batch(batch)
+            self._spool_entries(rest)
+            return not rest
+
+    def _settle_results(self, entries, response):
+        """バッチ応答の results を見て、項目単位で失敗したものを試行回数を増やして spool へ戻す。"""
+        try:
+            results = response.json().get("results")
+        except ValueError:
+            results = None
+        if not isinstance(results, list) or len(results) != len(entries):
+            self.stats["sent"] += len(entries)
+            return
+        retry = []
+        for (payload, attempts), result in zip(entries, results):
+            if isinstance(result, dict) and result.get("status") == "Error":
+                if isinstance(payload, dict) and attempts < self.max_retries:
+                    retry.append((payload, attempts + 1))
+                else:
+                    self._drop(payload, f"項目破棄: {str(result.get('error'))[:200]}")
+            else:
+                self.stats["sent"] += 1
+        if retry:
+            print(f"[Axiom Client] {len(retry)} 件が処理エラー、spool から再送します")
+            self._spool_entries(retry)
+
+    def _drop(self, payload, reason):
+        print(f"[Axiom Client] {reason}")
+        self.stats["dropped"] += 1
+        if self.on_drop:
+            try:
+                self.on_drop(payload, reason)
+            except Exception as e:
+                print(f"[Axiom Client] on_drop エラー: {e}")
+
+    def _post_batch(self, entries):
+        """
+        entries: [(payload, 項目の試行回数)]。届かなかった（spool へ戻すべき）entries を返す（全件届いた・破棄したなら []）。
+        バッチ API がない送信先（404 / 405）では以後 1 件ずつ送る。
+        """
+        if not self.batch_supported:
+            return self._post_items(entries)
+        batch = [payload for payload, _attempts in entries]
+        for attempt in range(self.max_retries + 1):
+            try:
+                r = self.session.post(self.batch_url, json={"items": batch}, timeout=self.timeout)
+                if r.status_code == 200:
+                    self.stats["batches"] += 1
+                    self._failures = 0
+                    self._settle_results(entries, r)
+                    return []
+                if r.status_code in _NO_BATCH_STATUS:
+                    print(f"[Axiom Client] {self.batch_url} が {r.status_code}: 1 件ずつ {self.logs_url} へ送ります")
+                    self.batch_supported = False
+                    return self._post_items(entries)
+                if r.status_code not in _RETRYABLE_STATUS:
+                    # 再送しても通らない: 破棄して後続を詰まらせない
+                    for payload in batch:
+                        self._drop(payload, f"バッチ破棄: {r.status_code} {r.text[:200]}")
+                    return []
+            except requests.RequestException as e:
+                print(f"[Axiom Client] 接続エラー: {e}")
+            if attempt < self.max_retries:
+                time.sleep(self._backoff(attempt))
+        self._backed_off()
+        return list(entries)
+
+    def _post_items(self, entries):
+        """1 件ずつ logs_url へ送る。疎通断で止まったら、その項目以降を返す。"""
+        for i, (payload, _attempts) in enumerate(entries):
+            for attempt in range(self.max_retries + 1):
+                try:
+                    r = self.session.post(self.logs_url, json=payload, timeout=self.timeout)
+                    if r.status_code == 200:
+                        self.stats["sent"] += 1
+                        break
+                    if r.status_code in _NO_BATCH_STATUS:
+                        # logs_url 自体がない（設定誤り）: 破棄せず spool に残す
+                        print(f"[Axiom Client] 送信先がありません: {r.status_code} {self.logs_url}")
+                        self._backed_off()
+                        return list(entries[i:])
+                    if r.status_code not in _RETRYABLE_STATUS:
+                        self._drop(payload, f"項目破棄: {r.status_code} {r.text[:200]}")
+                        break
+                except requests.RequestException as e:
+                    print(f"[Axiom Client] 接続エラー: {e}")
+                if attempt < self.max_retries:
+                    time.sleep(self._backoff(attempt))
+            else:
+                self._backed_off()
+                return list(entries[i:])
+        self._failures = 0
+        return []
+
+    def _backed_off(self):
+        self._failures += 1
+        self._retry_at = time.monotonic() + self._backoff(self._failures + self.max_retries)
+
+    def _backoff(self, attempt):
+        return min(self.backoff_max, self.backoff_base * (2 ** attempt))
+
+    # --- ディスク退避（spool） ---
+    def _spool(self, items):
+        self._spool_entries([(item, 0) for item in items])
+
+    def _spool_entries(self, entries):
+        if not entries:
+            return
+        lines = [json.dumps({_RETRY_KEY: attempts, "payload": payload} if attempts else payload, ensure_ascii=False) + "\n"
+                 for payload, attempts in entries]
+        with self._spool_lock:
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+        self.stats["spooled"] += len(entries)
+
+    def _spool_offset(self):
+        try:
+            with open(self.spool_offset_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _spool_pending(self):
+        with self._spool_lock:
+            return os.path.exists(self.spool_path) and os.path.getsize(self.spool_path) > self._spool_offset()
+
+    def _read_spool(self, limit):
+        """
+        未送信の先頭から最大 limit 件の [(payload, 試行回数)] と、読み終えた位置（読み進めていなければ 0）。
+        JSON として読めない行（書き込み途中で切れた末尾など）は読み飛ばし、位置は進める。
+        """
+        with self._spool_lock:
+            if not self._spool_pending():
+                return [], 0
+            entries = []
+            with open(self.spool_path, "rb") as f:
+                f.seek(self._spool_offset())
+                while len(entries) < limit:
+                    line = f.readline()
+                    if not line:
+                        break
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        print(f"[Axiom Client] spool の壊れた行を破棄: {line[:80]!r}")
+                        self.stats["dropped"] += 1
+                        continue
+                    if isinstance(item, dict) and _RETRY_KEY in item:
+                        entries.append((item.get("payload"), int(item[_RETRY_KEY])))
+                    else:
+                        entries.append((item, 0))
+                return entries, f.tell()
+
+    def _commit_spool(self, offset):
+        """送信済み位置を記録。読み切ったら spool を削除（追記と同じロック内で判定するので、その間の追記は消えない）。"""
+        with self._spool_lock:
+            if offset >= os.path.getsize(self.spool_path):
+                os.remove(self.spool_path)
+                if os.path.exists(self.spool_offset_path):
+                    os.remove(self.spool_offset_path)
+                return
+            with open(self.spool_offset_path, "w", encoding="utf-8") as f:
+                f.write(str(offset))
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_client(agent=None):
+    """プロセス共通のクライアント（終了時に送り切れなかった分は agent ごとの spool へ）。"""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = AxiomClient(agent=agent)
+            atexit.register(_default_client.close)
+        return _default_client
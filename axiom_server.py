@@ -1,22 +1,42 @@
+import time
+
+_MODULE_T0 = time.perf_counter()  # Ver 3.9: 起動時間の内訳計測の起点
+
 import base64
 import json
 import os
 import atexit
 import asyncio
 import re
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+import concurrent.futures
+import itertools
+import queue
+import threading
+from contextlib import contextmanager
+from collections import deque
+from datetime import datetime
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-from google import genai
-from google.genai import types
 from dotenv import load_dotenv
-
-try:
-    from action_dispatcher import ActionDispatcher
-    dispatcher = ActionDispatcher()
-except Exception as e:
-    dispatcher = None
-    print(f"⚠️ [Warning] ActionDispatcher failed to load: {e}")
+from async_worker_pool import AsyncWorkerPool, PoolSaturated
+from persistence_engine import PersistenceEngine
+from sqlite_state import SqliteStateBackend
+from knowledge_index import KnowledgeIndex
+from protocol_store import ProtocolStore
+from decision_index import DecisionIndex
+from tiered_store import TieredDecisionStore, SegmentColdTier, ExternalColdTier
+from context_cache import ContextCacheManager
+from stream_extractor import InstructionStreamExtractor, IncrementalUrlIsolator
+from fast_path import FastPathResponder
+from event_bus import EventBus
+from traffic_replay import RECORDED_PATHS, TrafficRecorder
+from attachment_store import AttachmentStore, AttachmentTooLarge
+from thread_store import ThreadStore
+import metrics
+from metrics import span
+from prompt_budget import FragmentCache, PromptBudget
+from knowledge_store import LocalKnowledgeStore, row_hash
+from job_queue import ActionJobQueue, DEFAULT_TARGET_LIMITS, idempotency_key
 
 load_dotenv(verbose=True)
 
@@ -28,75 +48,572 @@ CACHE_FILE = "axiom_context_v2_3.json"
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 API_ACCESS_TOKEN = os.getenv("AXIOM_TOKEN", "axiom-secure-2026")
 MODEL_ID = "gemini-2.0-flash"
+# Ver 3.9: 非同期実行プール（LLM 同時実行数・待ち行列・応答待ちタイムアウト）
+LLM_CONCURRENCY = int(os.getenv("AXIOM_LLM_CONCURRENCY", "8"))
+LLM_QUEUE_DEPTH = int(os.getenv("AXIOM_LLM_QUEUE_DEPTH", "32"))
+LLM_TIMEOUT_SEC = float(os.getenv("AXIOM_LLM_TIMEOUT", "120"))
+# Ver 3.9: /api/logs/batch の 1 バッチ内同時実行数・最大件数・応答待ち秒数
+BATCH_CONCURRENCY = int(os.getenv("AXIOM_BATCH_CONCURRENCY", "4"))
+BATCH_MAX_ITEMS = int(os.getenv("AXIOM_BATCH_MAX_ITEMS", "500"))
+BATCH_TIMEOUT_SEC = float(os.getenv("AXIOM_BATCH_TIMEOUT", "900"))
+# Ver 3.9: 組織情報は全文ではなく検索上位 k 件のみをプロンプトへ
+RETRIEVAL_TOP_K = int(os.getenv("AXIOM_RETRIEVAL_TOP_K", "12"))
+# Ver 3.9: プロンプトのトークン予算（概算）。SYSTEM は on_demand_docs・Drive Index（キャッシュ対象）、
+# INPUT は関連プロトコル・組織情報（スレッド文脈と本文は必ず載せ、残りで詰める）
+SYSTEM_PROMPT_BUDGET = int(os.getenv("AXIOM_SYSTEM_PROMPT_BUDGET", "8000"))
+INPUT_PROMPT_BUDGET = int(os.getenv("AXIOM_PROMPT_BUDGET", "6000"))
+# Ver 3.9: 定型メッセージ・直近の重複質問は LLM を通さず即答
+FAST_PATH_ENABLED = os.getenv("AXIOM_FAST_PATH", "1") != "0"
+# Ver 3.9: 外部アクション（Slack / kintone / ingest）は永続ジョブキュー経由で非同期実行
+JOBS_DB = os.getenv("AXIOM_JOBS_DB", "axiom_jobs.db")
+JOBS_MAX_ATTEMPTS = int(os.getenv("AXIOM_JOBS_MAX_ATTEMPTS", "5"))
+# 同じ発言からの同一コマンドを 1 回にまとめる秒数（クライアントの再送対策。後日の同じ発言は改めて実行する）と、完了ジョブの保持時間
+JOBS_DEDUPE_WINDOW = float(os.getenv("AXIOM_JOBS_DEDUPE_WINDOW", "600"))
+JOBS_RETENTION_HOURS = float(os.getenv("AXIOM_JOBS_RETENTION_HOURS", "72"))
+# Ver 3.9: 状態の保存先。file = JSON スナップショット + WAL（単一プロセス）、sqlite = 複数プロセスで共有
+STATE_BACKEND = os.getenv("AXIOM_STATE_BACKEND", "file")
+STATE_DB = os.getenv("AXIOM_STATE_DB", "axiom_state.db")
+# Ver 3.9: decision はメモリに直近 N 件のみ。それ以前はディスク（file: セグメント / sqlite: decisions テーブル）から遅延読み込み
+HOT_DECISIONS = int(os.getenv("AXIOM_HOT_DECISIONS", "2000"))
+DECISION_SEGMENT_DIR = os.getenv("AXIOM_DECISION_DIR", "axiom_decisions")
+
+# Ver 3.9: 起動を速くするため Gemini SDK・ActionDispatcher は初回利用時（またはバックグラウンドの起動処理）で読み込む。
+# 0 にすると従来どおり状態の読み込みと初期化を終えてから待ち受けを開始する
+LAZY_START = os.getenv("AXIOM_LAZY_START", "1") != "0"
+# 起動処理中に届いたリクエストを待たせる上限秒数（超えたら 503）
+STARTUP_WAIT_SEC = float(os.getenv("AXIOM_STARTUP_WAIT", "30"))
+# Ver 3.9: オフライン計測用。遅延指定（例: "lognormal:0.8,0.5"）を与えると Gemini の代わりに fake_gemini を使う
+FAKE_GEMINI = os.getenv("AXIOM_FAKE_GEMINI", "")
+# Ver 3.9: 受信した /api/logs・/api/ingest を時刻付きで記録するファイル（traffic_replay.py で再送できる。空なら記録しない）
+RECORD_FILE = os.getenv("AXIOM_RECORD_FILE", "")
+# Ver 3.9: 添付は /api/attachments へアップロードし、メッセージからは id（SHA-256）で参照する
+ATTACHMENT_DIR = os.getenv("AXIOM_ATTACHMENT_DIR", "axiom_attachments")
+ATTACHMENT_MAX_BYTES = int(float(os.getenv("AXIOM_ATTACHMENT_MAX_MB", "20")) * 1024 * 1024)
+# /api/attachments 1 リクエストの上限（1 回 10 ファイルまで + multipart の余白）。Content-Length で本文を読む前に断る
+ATTACHMENT_REQUEST_MAX_BYTES = ATTACHMENT_MAX_BYTES * 10 + 1024 * 1024
+# モデルへ渡す画像の長辺の上限（超える画像・1MB を超える画像は縮小・再圧縮した版を渡す。0 で無効）
+ATTACHMENT_MAX_SIDE = int(os.getenv("AXIOM_ATTACHMENT_MAX_SIDE", "1600"))
+# これより大きい添付は Gemini Files API に 1 回だけアップロードし、以降は同じ内容なら uri で参照する
+ATTACHMENT_INLINE_BYTES = int(os.getenv("AXIOM_ATTACHMENT_INLINE_KB", "256")) * 1024
+# Ver 3.9: スレッド文脈はサーバーが parentId ごとに保持（保持するスレッド数の上限・1 スレッドで原文のまま載せる件数）
+THREAD_MAX = int(os.getenv("AXIOM_THREAD_MAX", "5000"))
+THREAD_MESSAGES = int(os.getenv("AXIOM_THREAD_MESSAGES", "10"))
+STARTUP_TIMINGS = {}  # フェーズ名 → ミリ秒（/readyz と起動ログで報告）
+
 
-if GEMINI_API_KEY:
+@contextmanager
+def _startup_phase(name):
+    t0 = time.perf_counter()
     try:
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        print(f"🚀 Axiom OS Ver 3.8.6: PERSISTENCE & THREADING (Port {PORT})")
-    except Exception as e:
-        client = None
-        print(f"❌ API Client Init Error: {e}")
-else:
-    client = None
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = round((time.perf_counter() - t0) * 1000, 1)
+
+
+client = None  # get_client() が初回に生成（テスト等で差し替える場合は直接代入）
+_client_checked = False
+_genai_types = None
+_lazy_init_lock = threading.Lock()
+
+if not GEMINI_API_KEY and not FAKE_GEMINI:
     print("⚠️ WARNING: GEMINI_API_KEY not found in .env")
 
+
+def get_client():
+    """Gemini クライアント（SDK の import を含め初回呼び出し時に 1 回だけ初期化）。"""
+    global client, _client_checked
+    if client is None and not _client_checked:
+        with _lazy_init_lock:
+            if client is None and not _client_checked:
+                _client_checked = True
+                if FAKE_GEMINI:
+                    from fake_gemini import FakeGeminiClient
+                    client = FakeGeminiClient(latency=FAKE_GEMINI)
+                    print(f"🧪 [Gemini] Using offline fake client (latency {FAKE_GEMINI})")
+                elif GEMINI_API_KEY:
+                    try:
+                        with _startup_phase("genai_client"):
+                            from google import genai
+                            client = genai.Client(api_key=GEMINI_API_KEY)
+                        print(f"🚀 Axiom OS Ver 3.8.6: PERSISTENCE & THREADING (Port {PORT})")
+                    except Exception as e:
+                        print(f"❌ API Client Init Error: {e}")
+    return client
+
+
+def _types():
+    global _genai_types
+    if _genai_types is None:
+        from google.genai import types
+        _genai_types = types
+    return _genai_types
+
 # --- 知能状態管理 (Ver 3.8.0: DRIVE_INDEX / on_demand_docs) ---
 ORGANIZATIONAL_CONTEXT = {"agencies": {}, "workflows": {}, "rules": {}, "experts": [], "metadata": {}, "on_demand_docs": []}
-axiom_intelligence_storage = []
-EXTRACTED_PROTOCOLS = []
+if STATE_BACKEND == "sqlite":
+    _decision_cold = ExternalColdTier(lambda pos: persistence.get_decision(pos),
+                                      lambda begin, end: persistence.iter_decisions(begin, end))
+else:
+    _decision_cold = SegmentColdTier(DECISION_SEGMENT_DIR,
+                                     segment_records=int(os.getenv("AXIOM_DECISION_SEGMENT", "10000")))
+axiom_intelligence_storage = TieredDecisionStore(HOT_DECISIONS, _decision_cold)
+# Ver 3.9: 近似重複をまとめて出現回数で持つ（EXTRACTED_PROTOCOLS は protocol_store.entries そのもの）
+# SQLite バックエンドでは id が行 id なので、復元時に旧形式の重複をまとめて採番し直すことはしない
+protocol_store = ProtocolStore(threshold=float(os.getenv("AXIOM_PROTOCOL_SIMILARITY", "0.9")),
+                               compact=STATE_BACKEND != "sqlite")
+EXTRACTED_PROTOCOLS = protocol_store.entries
 KNOWLEDGE_GAPS = []  # AIが答えられなかった「欠損知識」のリスト
 DRIVE_INDEX = []  # Google Drive 連携で取得したファイル一覧
-cached_content_name = None
-cache_expire_time = None
 execution_counter = 0
+knowledge_version = 0  # ingest / プロトコル追加・出現ごとに加算（回答キャッシュの版キー）
+# Ver 3.9: カテゴリ単位の版（ingest したカテゴリだけ上がる）。Drive Index は "google_drive"、プロトコルは "protocols"
+# 値は全カテゴリ共通の連番から取る（状態の読み直しで版が巻き戻って古い断片と一致しないように）
+CATEGORY_VERSIONS = {}
+_version_seq = itertools.count(1)
+fragment_cache = FragmentCache()  # 組織情報・プロトコルの JSON 断片を (カテゴリ, 版) ごとに保持
+_row_hash_cache = {}  # category → (カテゴリの版, {key: row_hash})。/api/ingest/hashes 用
+pending_gap_count = 0  # Dashboard 用に増分で維持（毎回 KNOWLEDGE_GAPS を走査しない）
+# Ver 3.9: /api/axiom-bi 差分配信用の変更ジャーナル（(revision, op, data) を直近 N 件保持）
+CHANGE_JOURNAL = deque(maxlen=int(os.getenv("AXIOM_CHANGE_JOURNAL", "2000")))
+journal_base = 0  # ジャーナルで差分を返せる最古の revision（これより古い since は全量を返す）
+# Ver 3.9: ダッシュボードへのプッシュ配信（/api/events の SSE 購読者へファンアウト）
+event_bus = EventBus(max_queue=int(os.getenv("AXIOM_EVENT_QUEUE", "256")))
+EVENT_HEARTBEAT_SEC = 15
+# 組織情報（agencies / rules / workflows / on_demand_docs ...）の検索索引。ingest ごとに差分更新
+knowledge_index = KnowledgeIndex()
+# Ver 3.9: decision 履歴の二次索引（/api/history の絞り込み・スレッドの読み込み用）。decision 追記ごとに差分更新
+# SQLite に置き、起動時は全件を読み直さない（sqlite バックエンドでは状態 DB の行を SqliteStateBackend が書く）
+if STATE_BACKEND == "sqlite":
+    decision_index = DecisionIndex(STATE_DB, writable=False)
+else:
+    decision_index = DecisionIndex(os.path.join(DECISION_SEGMENT_DIR, "index.db"))
 
+# Ver 3.9: 安定部分（指示・on_demand_docs・Drive）の内容ハッシュ単位で Context Cache を管理
+context_cache = ContextCacheManager(
+    get_client, MODEL_ID,
+    ttl_sec=int(os.getenv("AXIOM_CACHE_TTL", "3600")),
+    max_entries=int(os.getenv("AXIOM_CACHE_MAX_VERSIONS", "4")),
+    display_prefix="axiom_v39_ctx",
+)
 
-def save_cache():
-    data = {
+fast_path = FastPathResponder(max_entries=int(os.getenv("AXIOM_ANSWER_CACHE_SIZE", "512")))
+
+# 全リクエストで共有する常駐イベントループ（Gemini 非同期クライアント用）
+worker_pool = AsyncWorkerPool(max_concurrency=LLM_CONCURRENCY, max_queue=LLM_QUEUE_DEPTH)
+traffic_recorder = TrafficRecorder(RECORD_FILE) if RECORD_FILE else None
+thread_store = ThreadStore(max_threads=THREAD_MAX, max_messages=THREAD_MESSAGES, loader=lambda pid: _load_thread(pid))
+attachment_store = AttachmentStore(ATTACHMENT_DIR, max_bytes=ATTACHMENT_MAX_BYTES, max_side=ATTACHMENT_MAX_SIDE)
+
+# Ver 3.9: 段階別の計測。/metrics（Prometheus テキスト形式）で公開し、
+# リクエストヘッダー X-Axiom-Trace: 1（または AXIOM_TRACE_HEADER=1）で応答ヘッダーにも内訳を付ける
+TRACE_HEADER_ALWAYS = os.getenv("AXIOM_TRACE_HEADER", "0") == "1"
+HTTP_SECONDS = metrics.registry.histogram("axiom_http_request_seconds", "HTTP request latency", ("endpoint", "status"))
+DECISIONS_TOTAL = metrics.registry.counter("axiom_decisions_total", "Decisions produced by path", ("path",))
+FALLBACKS_TOTAL = metrics.registry.counter("axiom_instruction_fallback_total", "Empty or raw-JSON instructions replaced by a canned reply")
+ANALYSIS_ERRORS = metrics.registry.counter("axiom_analysis_errors_total", "LLM call or analysis failures")
+JSON_PARSE_FAILURES = metrics.registry.counter("axiom_json_parse_failures_total", "Model outputs whose JSON block failed to parse")
+DISPATCH_TOTAL = metrics.registry.counter("axiom_dispatch_total", "Dispatcher commands by outcome", ("command", "outcome"))
+PROMPT_CHARS = metrics.registry.histogram("axiom_prompt_chars", "Prompt size in characters", ("part",), metrics.SIZE_BUCKETS)
+PROMPT_TOKENS = metrics.registry.histogram("axiom_prompt_tokens_estimate", "Estimated prompt tokens", ("part",), metrics.SIZE_BUCKETS)
+PROMPT_SECTION_TOKENS = metrics.registry.histogram("axiom_prompt_section_tokens", "Estimated tokens per prompt section",
+                                                   ("section",), metrics.SIZE_BUCKETS)
+PROMPT_DROPPED = metrics.registry.counter("axiom_prompt_dropped_items_total", "Items left out of the prompt", ("section", "reason"))
+metrics.registry.gauge("axiom_context_cache", "Context cache counters", lambda: context_cache.stats(), label="stat")
+metrics.registry.gauge("axiom_threads", "Server-side thread store", lambda: thread_store.stats(), label="stat")
+metrics.registry.gauge("axiom_attachments", "Attachment store counters", lambda: attachment_store.stats(), label="stat")
+metrics.registry.gauge("axiom_prompt_fragments", "Prompt fragment cache counters", lambda: fragment_cache.stats(), label="stat")
+metrics.registry.gauge("axiom_fast_path", "Fast path counters", lambda: fast_path.stats(), label="stat")
+metrics.registry.gauge("axiom_worker_pool", "LLM worker pool state", lambda: worker_pool.stats(), label="stat")
+metrics.registry.gauge("axiom_jobs", "Action jobs by status", lambda: job_queue.counts() if job_queue else {}, label="status")
+metrics.registry.gauge("axiom_event_subscribers", "Connected /api/events clients", lambda: len(event_bus))
+metrics.registry.gauge("axiom_state", "Intelligence state sizes", lambda: _summary_stats(), label="key")
+
+
+def _bump_version(*categories):
+    for category in categories:
+        CATEGORY_VERSIONS[category] = next(_version_seq)
+
+
+def _merge_ingest(category, payload):
+    """/api/ingest と WAL 再生で共通のマージ処理。"""
+    if category == "google_drive":
+        DRIVE_INDEX.clear()
+        DRIVE_INDEX.extend(payload if isinstance(payload, list) else [payload])
+        return
+    if category not in ORGANIZATIONAL_CONTEXT:
+        ORGANIZATIONAL_CONTEXT[category] = {}
+    if isinstance(payload, dict):
+        ORGANIZATIONAL_CONTEXT[category].update(payload)
+        knowledge_index.index_category(category, {k: ORGANIZATIONAL_CONTEXT[category][k] for k in payload})
+    elif isinstance(payload, list):
+        if not isinstance(ORGANIZATIONAL_CONTEXT[category], list):
+            ORGANIZATIONAL_CONTEXT[category] = []
+            knowledge_index.drop_category(category)
+        start = len(ORGANIZATIONAL_CONTEXT[category])
+        ORGANIZATIONAL_CONTEXT[category].extend(payload)
+        knowledge_index.index_category(category, ORGANIZATIONAL_CONTEXT[category], start=start)
+    else:
+        ORGANIZATIONAL_CONTEXT[category] = payload
+        knowledge_index.index_category(category, payload)
+
+
+def _unset_keys(category, keys):
+    """dict 型カテゴリからキーを削除する（/api/ingest/upsert の delete と WAL 再生で共通）。"""
+    value = ORGANIZATIONAL_CONTEXT.get(category)
+    if not isinstance(value, dict):
+        return
+    for key in keys:
+        if key in value:
+            del value[key]
+            knowledge_index.remove(category, key)
+
+
+def _thread_messages(decision):
+    meta = decision.get("meta") or {}
+    return [(meta.get("user") or "user", meta.get("body")),
+            ("Axiom", (decision.get("autonomous_action") or {}).get("instruction"))]
+
+
+def _load_thread(parent_id):
+    """メモリにないスレッド（再起動後・LRU で追い出し済み）を decision 履歴（コールド層を含む）から組み立てる。"""
+    messages = []
+    # 共有 DB の索引には他プロセスが確定済みでこのプロセスにはまだ取り込んでいない decision（適用中のものを含む）も
+    # 載っているので、このプロセスの件数より後ろの位置は読まない（適用中の decision は呼び出し側が追記する）
+    loaded = len(axiom_intelligence_storage)
+    for pos in decision_index.positions("parent", parent_id):
+        if pos >= loaded:
+            break
+        messages.extend(_thread_messages(axiom_intelligence_storage[pos]))
+    return messages
+
+
+def _remember_thread(decision):
+    """parentId 付きの decision（入力と回答）をサーバー側のスレッド文脈へ追記する。"""
+    meta = decision.get("meta") or {}
+    parent_id = meta.get("parentId")
+    if parent_id in (None, ""):
+        return
+    for role, text in _thread_messages(decision):
+        thread_store.add(parent_id, role, text)
+
+
+def _apply_delta(op, data):
+    """WAL の 1 レコード（差分）を知能状態へ適用する。"""
+    global execution_counter, knowledge_version, pending_gap_count
+    if op == "decision":
+        # スレッドへの追記を先に行う（未読み込みのスレッドは履歴から組み立てられ、この decision は含まれない）
+        _remember_thread(data)
+        axiom_intelligence_storage.append(data)
+        decision_index.add(len(axiom_intelligence_storage) - 1, data)
+    elif op == "protocol":
+        protocol_store.append(data)
+        knowledge_version += 1
+        _bump_version("protocols")
+    elif op == "protocol_seen":
+        protocol_store.touch(data.get("id"), data.get("timestamp"), logic=data.get("logic"))
+        # 本文の差し替え・出現回数（選択順位）でプロンプトが変わるので回答キャッシュの版も上げる
+        knowledge_version += 1
+        _bump_version("protocols")
+    elif op == "gap":
+        KNOWLEDGE_GAPS.append(data)
+        if data.get("status") == "pending":
+            pending_gap_count += 1
+    elif op == "exec":
+        execution_counter += 1
+    elif op == "ingest":
+        _merge_ingest(data.get("category", "metadata"), data.get("payload", {}))
+        knowledge_version += 1
+        _bump_version(data.get("category", "metadata"))
+    elif op == "unset":
+        _unset_keys(data.get("category"), data.get("keys", []))
+        knowledge_version += 1
+        _bump_version(data.get("category"))
+    else:
+        print(f"⚠️ [WAL] Unknown op: {op}")
+
+
+def _commit(op, data, resolve=None):
+    """
+    差分を状態へ適用し WAL に追記する（O(delta)）。revision = WAL seq を変更ジャーナルにも残す。
+    resolve(op, data) -> (op, data) は他プロセスの変更を取り込んだ後（共有バックエンドではトランザクション内）に呼ばれ、
+    記録する差分を決め直す。ジャーナルには実際に適用した差分を残す。
+    """
+    applied = [op, data]
+
+    def apply(op, data):
+        applied[:] = [op, data]
+        return _apply_delta(op, data)
+
+    with persistence.lock:
+        with span("wal_commit"):
+            persistence.commit(op, data, apply, resolve=resolve)
+        _journal(*applied)
+
+
+def _journal(op, data):
+    """確定した差分（revision = persistence.seq）を変更ジャーナルとイベント配信へ流す。"""
+    global journal_base
+    if len(CHANGE_JOURNAL) == CHANGE_JOURNAL.maxlen:
+        journal_base = CHANGE_JOURNAL[0][0]
+    CHANGE_JOURNAL.append((persistence.seq, op, data))
+    if len(event_bus):
+        _publish_change(persistence.seq, op, data)
+
+
+def _apply_synced(op, data):
+    """共有バックエンドで他プロセスが確定した差分を取り込む。"""
+    _apply_delta(op, data)
+    _journal(op, data)
+
+
+def _on_state_reload():
+    """共有バックエンドから全量を読み直した: 差分ジャーナルは使えないので購読者に再同期させる。"""
+    global journal_base
+    CHANGE_JOURNAL.clear()
+    journal_base = persistence.seq
+    event_bus.publish("resync", {})
+
+
+def _publish_change(revision, op, data):
+    """確定した差分をダッシュボード向けのイベントに変換して配信する。"""
+    if op == "decision":
+        event, payload = "decision", _flatten_log(data)
+    elif op == "protocol":
+        event, payload = "protocol", data
+    elif op == "protocol_seen":
+        event, payload = "protocol", protocol_store.get(data.get("id")) or {}
+    elif op == "gap":
+        event, payload = "gap", data
+    elif op in ("ingest", "unset"):
+        category = data.get("category")
+        payload = {"category": category}
+        if category == "on_demand_docs":
+            payload["on_demand_list"] = ORGANIZATIONAL_CONTEXT.get("on_demand_docs", [])
+        event = "ingest"
+    else:
+        event, payload = "summary", {}
+    event_bus.publish(event, {"cursor": revision, "data": payload, "summary_stats": _summary_stats()})
+
+
+def _record_protocol(user, logic):
+    """Axiom 2: 抽出されたロジックを記録する。既存と近似重複なら新規追加せず出現回数を増やし、本文を最新のものにする。"""
+    now = datetime.now().isoformat()
+
+    def resolve(op, data):
+        # 重複判定は他プロセスの変更を取り込んだ後に行う（同時に同じ教訓を学んだ 2 プロセスが両方とも新規追加しないように）
+        match = protocol_store.find(logic)
+        if match is None:
+            return op, data
+        return "protocol_seen", {"id": match["id"], "timestamp": now, "user": user, "logic": logic}
+
+    _commit("protocol", {"timestamp": now, "user": user, "logic": logic}, resolve=resolve)
+
+
+def _record_decision(decision):
+    """decision を採番して記録する（並行処理での ID 重複を防ぐため採番と追記を同一ロック内で行う）。"""
+    with persistence.lock:
+        decision["id"] = len(axiom_intelligence_storage) + 1
+        _commit("decision", decision)
+    return decision
+
+
+def _dump_state():
+    # ホット層から外れた decision をディスクへ確定させてから、ホット層だけを書き出す
+    axiom_intelligence_storage.sync()
+    return {
         "context": ORGANIZATIONAL_CONTEXT,
-        "logs": axiom_intelligence_storage,
+        "logs": axiom_intelligence_storage.hot_items(),
+        "logs_start": axiom_intelligence_storage.hot_start,
         "protocols": EXTRACTED_PROTOCOLS,
         "gaps": KNOWLEDGE_GAPS,
         "drive_index": DRIVE_INDEX,
         "exec_count": execution_counter,
         "tier": "Enterprise/Ver3.8.6"
     }
+
+
+def _restore_state(data):
+    global execution_counter, pending_gap_count
+    if "context" in data:
+        ORGANIZATIONAL_CONTEXT.update(data["context"])
+    knowledge_index.rebuild(ORGANIZATIONAL_CONTEXT)
+    if "logs" in data:
+        # スナップショットはホット層のみ（logs_start より前はコールド層にある）。旧形式は全件で logs_start = 0
+        axiom_intelligence_storage.restore(data.get("logs_start", 0), data["logs"])
+    decision_index.catch_up(axiom_intelligence_storage)
+    # スレッドは使われたときに decision 履歴から組み立て直す（_load_thread）
+    thread_store.clear()
+    if "protocols" in data:
+        protocol_store.restore(data["protocols"])
+    if "gaps" in data:
+        KNOWLEDGE_GAPS.clear()
+        KNOWLEDGE_GAPS.extend(data["gaps"])
+    pending_gap_count = sum(1 for g in KNOWLEDGE_GAPS if g.get("status") == "pending")
+    if "drive_index" in data:
+        DRIVE_INDEX.clear()
+        DRIVE_INDEX.extend(data["drive_index"])
+    execution_counter = data.get("exec_count", 0)
+    _bump_version(*ORGANIZATIONAL_CONTEXT, "google_drive", "protocols")
+
+
+# Ver 3.9: 追記型 WAL + 定期スナップショット（CACHE_FILE がスナップショット本体）
+if STATE_BACKEND == "sqlite":
+    persistence = SqliteStateBackend(
+        STATE_DB,
+        changes_keep=int(os.getenv("AXIOM_STATE_CHANGES_KEEP", "20000")),
+        sync_interval=float(os.getenv("AXIOM_STATE_SYNC_INTERVAL", "1")),
+        snapshot_interval=float(os.getenv("AXIOM_SNAPSHOT_INTERVAL", "60")),
+        fsync=os.getenv("AXIOM_WAL_FSYNC", "1") != "0",
+        on_reload=_on_state_reload,
+        hot_decisions=HOT_DECISIONS,
+    )
+else:
+    persistence = PersistenceEngine(
+        CACHE_FILE,
+        snapshot_every=int(os.getenv("AXIOM_SNAPSHOT_EVERY", "500")),
+        snapshot_interval=float(os.getenv("AXIOM_SNAPSHOT_INTERVAL", "60")),
+        fsync=os.getenv("AXIOM_WAL_FSYNC", "1") != "0",
+    )
+SHARED_STATE = getattr(persistence, "shared", False)
+state_loaded = False
+_state_ready = threading.Event()
+_boot_thread = None
+_boot_lock = threading.Lock()
+
+
+def save_cache():
+    """全状態のスナップショット（WAL コンパクション）。通常はバックグラウンドで定期実行される。"""
     try:
-        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with span("snapshot"):
+            persistence.snapshot(_dump_state)
         print(f"💾 [Brain] State secured (On-Demand: {len(ORGANIZATIONAL_CONTEXT.get('on_demand_docs', []))})")
     except Exception as e:
         print(f"⚠️ Cache Save Error: {e}")
 
 
-def load_cache():
-    global axiom_intelligence_storage, EXTRACTED_PROTOCOLS, KNOWLEDGE_GAPS, DRIVE_INDEX, execution_counter
-    if not os.path.exists(CACHE_FILE):
+def _import_legacy_snapshot():
+    """共有バックエンドが空なら、既存の JSON スナップショット + WAL を取り込む（初回移行）。"""
+    if not persistence.is_empty() or not os.path.exists(CACHE_FILE):
         return
+    global axiom_intelligence_storage
+    # file バックエンドの decision はスナップショット（ホット層）+ セグメント（コールド層）にあるため、一時的に差し替えて読む
+    live = axiom_intelligence_storage
+    axiom_intelligence_storage = TieredDecisionStore(HOT_DECISIONS, SegmentColdTier(DECISION_SEGMENT_DIR))
     try:
-        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if "context" in data:
-            ORGANIZATIONAL_CONTEXT.update(data["context"])
-        if "logs" in data:
-            axiom_intelligence_storage.clear()
-            axiom_intelligence_storage.extend(data["logs"])
-        if "protocols" in data:
-            EXTRACTED_PROTOCOLS.clear()
-            EXTRACTED_PROTOCOLS.extend(data["protocols"])
-        if "gaps" in data:
-            KNOWLEDGE_GAPS.clear()
-            KNOWLEDGE_GAPS.extend(data["gaps"])
-        if "drive_index" in data:
-            DRIVE_INDEX.clear()
-            DRIVE_INDEX.extend(data["drive_index"])
-        execution_counter = data.get("exec_count", 0)
-        print(f"📂 Intelligence Restored: {len(axiom_intelligence_storage)} logs, {len(ORGANIZATIONAL_CONTEXT.get('on_demand_docs', []))} on-demand docs.")
-    except Exception as e:
-        print(f"⚠️ Cache Load Error: {e}")
+        PersistenceEngine(CACHE_FILE).load(_restore_state, _apply_delta)
+        data = _dump_state()
+        data["logs"] = list(axiom_intelligence_storage)
+        if persistence.import_state(data):
+            print(f"📦 [State] Imported {CACHE_FILE} into {STATE_DB}")
+    finally:
+        axiom_intelligence_storage = live
+
+
+def load_cache():
+    global journal_base, state_loaded
+    with _startup_phase("state_load"):
+        try:
+            if SHARED_STATE:
+                _import_legacy_snapshot()
+            replayed = persistence.load(_restore_state, _apply_synced if SHARED_STATE else _apply_delta)
+            journal_base = persistence.seq
+            print(f"📂 Intelligence Restored: {len(axiom_intelligence_storage)} logs, {len(ORGANIZATIONAL_CONTEXT.get('on_demand_docs', []))} on-demand docs (WAL replay: {replayed}).")
+        except Exception as e:
+            print(f"⚠️ Cache Load Error: {e}")
+        persistence.start(_dump_state)
+    state_loaded = True
+    _state_ready.set()
+    if job_queue:
+        # 実行完了で exec を commit するため、状態の復元後にワーカーを起動する
+        job_queue.start()
+
+
+def _boot():
+    """状態の読み込み → 待ち受け前に温めておくもの（Dispatcher・Gemini クライアント）の順に初期化し、内訳を報告する。"""
+    t0 = time.perf_counter()
+    if not state_loaded:
+        load_cache()
+    get_dispatcher()
+    get_client()
+    STARTUP_TIMINGS["boot_total"] = round((time.perf_counter() - t0) * 1000, 1)
+    print("⏱️ [Startup] " + " | ".join(f"{k} {v:.0f}ms" for k, v in STARTUP_TIMINGS.items()))
+
+
+def start_boot():
+    """_boot をバックグラウンドで 1 回だけ開始する（待ち受けは即座に始められる）。"""
+    global _boot_thread
+    with _boot_lock:
+        if _boot_thread is None and not state_loaded:
+            _boot_thread = threading.Thread(target=_boot, name="axiom-boot", daemon=True)
+            _boot_thread.start()
+
+
+def _on_job_success(job_id, command_data, result):
+    _commit("exec", {"command": command_data.get("command"), "job_id": job_id})
+
+
+def _job_target_limits():
+    """送信先ごとの同時実行数・最小間隔を AXIOM_JOBS_<TARGET>_CONCURRENCY / _INTERVAL で上書き。"""
+    limits = {}
+    for target, default in DEFAULT_TARGET_LIMITS.items():
+        env = f"AXIOM_JOBS_{target.upper()}"
+        limits[target] = {
+            "concurrency": int(os.getenv(f"{env}_CONCURRENCY", default["concurrency"])),
+            "min_interval": float(os.getenv(f"{env}_INTERVAL", default["min_interval"])),
+        }
+    return limits
+
+
+def _ingest_local(category, payload):
+    """/api/ingest と同じ経路（WAL 追記・索引の差分更新・イベント配信）でナレッジを取り込む。"""
+    _commit("ingest", {"category": category, "payload": payload})
 
 
-atexit.register(save_cache)
+dispatcher = None
+job_queue = None
+_dispatcher_checked = False
+
+
+def get_dispatcher():
+    """ActionDispatcher とジョブキューを初回利用時に初期化する（失敗時は None）。"""
+    global dispatcher, job_queue, _dispatcher_checked
+    if _dispatcher_checked:
+        return dispatcher
+    with _lazy_init_lock:
+        if _dispatcher_checked:
+            return dispatcher
+        with _startup_phase("dispatcher"):
+            # Ver 3.9: ingest_knowledge は HTTP で自分自身を呼ばず、同一プロセスの commit 経路へ直接書き込む
+            try:
+                from action_dispatcher import ActionDispatcher
+                dispatcher = ActionDispatcher(knowledge_store=LocalKnowledgeStore(_ingest_local))
+            except Exception as e:
+                print(f"⚠️ [Warning] ActionDispatcher failed to load: {e}")
+            if dispatcher:
+                try:
+                    job_queue = ActionJobQueue(JOBS_DB, dispatcher.dispatch, on_success=_on_job_success,
+                                               target_limits=_job_target_limits(), max_attempts=JOBS_MAX_ATTEMPTS,
+                                               dedupe_window=JOBS_DEDUPE_WINDOW, retention=JOBS_RETENTION_HOURS * 3600)
+                except Exception as e:
+                    print(f"⚠️ [Jobs] Queue unavailable, dispatching inline: {e}")
+            if job_queue and state_loaded:
+                job_queue.start()
+        _dispatcher_checked = True
+    return dispatcher
+
+
+def _shutdown_persistence():
+    if traffic_recorder:
+        traffic_recorder.close()
+    if job_queue:
+        job_queue.stop()
+    persistence.stop()
+    # 読み込み前（起動中の終了・読み込み失敗）のメモリ状態は空なので、スナップショットで既存の状態を上書きしない
+    if state_loaded:
+        save_cache()
+
+
+atexit.register(_shutdown_persistence)
 
 
 def is_authorized(req):
@@ -108,7 +625,62 @@ def is_authorized(req):
     return False
 
 
+@app.before_request
+def _start_request_timer():
+    g.axiom_t0 = time.perf_counter()
+
+
+def _request_trace(header=True):
+    """
+    X-Axiom-Trace: 1 が付いたリクエスト（または常時有効時）の段階別 Trace を作る。
+    header=True なら応答ヘッダーに付ける。SSE はヘッダー送信後に処理が進むため trace イベントで送る。
+    """
+    if not (TRACE_HEADER_ALWAYS or request.headers.get("X-Axiom-Trace") == "1"):
+        return None
+    trace = metrics.Trace()
+    if header:
+        g.axiom_trace = trace
+    return trace
+
+
+@app.before_request
+def _record_traffic():
+    if traffic_recorder and request.method == "POST" and request.path in RECORDED_PATHS and is_authorized(request):
+        traffic_recorder.record(request.path, request.get_json(silent=True))
+
+
+@app.after_request
+def _finish_request_metrics(response):
+    t0 = g.get("axiom_t0")
+    if t0 is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.observe(time.perf_counter() - t0, endpoint, response.status_code)
+    trace = g.get("axiom_trace")
+    if trace is not None:
+        response.headers["X-Axiom-Trace"] = trace.header()
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+
+@app.before_request
+def _ensure_state():
+    """
+    gunicorn 等で __main__ を通らない場合も最初のリクエストで起動処理を開始し、状態の読み込み完了まで待たせる
+    （/healthz・/readyz は待たない）。共有バックエンドでは毎回最新化する。
+    """
+    if not state_loaded:
+        start_boot()
+        if request.path in ("/healthz", "/readyz", "/metrics"):
+            return None
+        if not _state_ready.wait(timeout=STARTUP_WAIT_SEC):
+            return jsonify({"error": "Starting up", "timings_ms": STARTUP_TIMINGS}), 503, {"Retry-After": "2"}
+    elif SHARED_STATE:
+        persistence.sync()
+
+
 class AxiomOSCore:
+    _stable_cache = None  # (on_demand_docs と Drive Index の版, _stable_knowledge の結果)
+
     def deep_clean_text(self, text):
         """URL隔離・ノイズ剥ぎ取り・出典タグの整形（Ver 3.8.6）"""
         if not text:
@@ -125,61 +697,154 @@ class AxiomOSCore:
         text = re.sub(url_pattern, url_isolate, text)
         return re.sub(r'\s{2,}', ' ', text).strip()
 
-    async def get_or_create_cache(self, system_instruction):
-        global cached_content_name, cache_expire_time
-        if cached_content_name and cache_expire_time and datetime.now() < cache_expire_time:
-            return cached_content_name
-        if not client:
-            return None
-        try:
-            cache = client.caches.create(
-                model=MODEL_ID,
-                config=types.CreateCachedContentConfig(
-                    display_name="axiom_v386_persistence_cache",
-                    system_instruction=system_instruction,
-                    ttl="3600s"
-                )
-            )
-            cached_content_name = cache.name
-            cache_expire_time = datetime.now() + timedelta(hours=1)
-            print(f"✅ [Cache] Synchronized: {cached_content_name}")
-            return cached_content_name
-        except Exception as e:
-            return None
-
-    def _build_content_parts(self, user_input_text, attachments):
-        """Ver 3.8.6: テキスト + 添付（画像等）を Gemini Part のリストに変換。"""
-        parts = [types.Part.from_text(text=user_input_text)]
+    async def _build_content_parts(self, user_input_text, attachments):
+        """
+        Ver 3.8.6: テキスト + 添付（画像等）を Gemini Part のリストに変換。
+        Ver 3.9: 添付は attachment_store の id で参照する。従来の base64 直書きもストアに入れてから同じ経路で渡す
+        （スレッド内で同じスクリーンショットが再送されても、縮小・アップロードは 1 回だけ）。
+        """
+        parts = [_types().Part.from_text(text=user_input_text)]
         if not attachments:
             return parts
         for att in attachments[:10]:  # 最大10件
-            raw = att.get("data") or att.get("content") or ""
-            if not raw:
-                continue
-            if isinstance(raw, str) and raw.startswith("data:"):
-                raw = raw.split(",", 1)[-1]
-            try:
-                data = base64.b64decode(raw) if isinstance(raw, str) else raw
-            except Exception:
-                continue
-            mime = (att.get("type") or att.get("mime_type") or "image/png").split(";")[0].strip()
-            if not mime.startswith("image/"):
-                mime = "application/octet-stream"
-            parts.append(types.Part.from_bytes(data=data, mime_type=mime))
+            if isinstance(att, str):
+                att = {"id": att}
+            blob_id = att.get("id") or att.get("attachment_id")
+            # ストアの参照とみなすのは登録済みの SHA-256（64 桁の 16 進数）だけ。
+            # クライアント側の id（ファイル名・連番など）が付いていても inline の data があればそちらを使う
+            if attachment_store.get(blob_id) is None:
+                raw = att.get("data") or att.get("content") or ""
+                if not raw:
+                    if blob_id:
+                        print(f"⚠️ [Attachments] Unknown attachment id: {str(blob_id)[:16]}")
+                    continue
+                if isinstance(raw, str) and raw.startswith("data:"):
+                    raw = raw.split(",", 1)[-1]
+                try:
+                    data = base64.b64decode(raw) if isinstance(raw, str) else raw
+                    blob_id = attachment_store.put_bytes(data, att.get("type") or att.get("mime_type") or "image/png")["id"]
+                except Exception:
+                    continue
+            part = await self._attachment_part(blob_id)
+            if part is not None:
+                parts.append(part)
         return parts
 
-    async def process_input(self, payload):
-        global execution_counter
+    async def _attachment_part(self, blob_id):
+        """縮小済みの版を渡す。大きいものは Files API にアップロード済みの uri を使い回す（なければ 1 回アップロード）。"""
+        target = await asyncio.to_thread(attachment_store.model_file, blob_id)  # 初回は Pillow で縮小（イベントループを塞がない）
+        if target is None:
+            print(f"⚠️ [Attachments] Unknown attachment id: {str(blob_id)[:16]}")
+            return None
+        path, mime = target
+        if not mime.startswith("image/"):
+            mime = "application/octet-stream"
+        files_api = getattr(get_client().aio, "files", None)
+        if files_api is not None and os.path.getsize(path) > ATTACHMENT_INLINE_BYTES:
+            handle = attachment_store.remote(blob_id)
+            if handle is None:
+                try:
+                    uploaded = await files_api.upload(file=path, config={"mime_type": mime})
+                    expires = uploaded.expiration_time.timestamp() if getattr(uploaded, "expiration_time", None) else None
+                    attachment_store.remember_remote(blob_id, uploaded.uri, uploaded.mime_type or mime, expires)
+                    handle = (uploaded.uri, uploaded.mime_type or mime)
+                except Exception as e:
+                    print(f"⚠️ [Attachments] Upload failed for {blob_id[:12]}, sending inline: {e}")
+            if handle is not None:
+                return _types().Part.from_uri(file_uri=handle[0], mime_type=handle[1])
+        with open(path, "rb") as f:
+            return _types().Part.from_bytes(data=f.read(), mime_type=mime)
+
+    def _retrieve_context(self, query):
+        """Ver 3.9: 入力に関連する組織情報の上位 k 件を関連度順の (category, key, record) で返す（on_demand_docs は別枠）。"""
+        items = []
+        for category, key, _score in knowledge_index.search(query, k=RETRIEVAL_TOP_K, exclude=("on_demand_docs",)):
+            value = ORGANIZATIONAL_CONTEXT.get(category)
+            if key is None:
+                items.append((category, None, value))
+            elif isinstance(value, dict) and key in value:
+                items.append((category, key, value[key]))
+            elif isinstance(value, list) and isinstance(key, int) and key < len(value):
+                items.append((category, key, value[key]))
+        return items
+
+    @staticmethod
+    def _fragment(versions, category, key, record, ident=None):
+        return fragment_cache.get(category, key, versions.get(category, 0), record, ident)
+
+    @staticmethod
+    def _render_context(items):
+        """
+        (category, key, Fragment) の列を従来の json.dumps({category: {key: record} / [record] / value}) と同じ文字列にする。
+        各レコードはキャッシュ済みの断片をつなぐだけ（毎回レコードをシリアライズし直さない）。
+        """
+        groups = {}
+        for category, key, fragment in items:
+            if key is None:
+                groups[category] = fragment.text
+            else:
+                groups.setdefault(category, []).append((key, fragment.text))
+        parts = []
+        for category, entries in groups.items():
+            if isinstance(entries, str):
+                body = entries
+            elif isinstance(entries[0][0], int):
+                body = "[" + ", ".join(text for _k, text in entries) + "]"
+            else:
+                body = "{" + ", ".join(f"{json.dumps(k, ensure_ascii=False)}: {text}" for k, text in entries) + "}"
+            parts.append(f"{json.dumps(category, ensure_ascii=False)}: {body}")
+        return "{" + ", ".join(parts) + "}"
+
+    def _stable_knowledge(self):
+        """
+        system_instruction に載せる on_demand_docs（新しい順に優先）と Drive Index を SYSTEM_PROMPT_BUDGET 内に詰める。
+        どちらかのカテゴリの版が上がるまで結果（シリアライズ済みの JSON を含む）を使い回す（Context Cache のキーも変わらない）。
+        """
+        version = (CATEGORY_VERSIONS.get("on_demand_docs", 0), CATEGORY_VERSIONS.get("google_drive", 0))
+        cached = self._stable_cache
+        if cached and cached[0] == version:
+            return cached[1]
+        docs = list(enumerate(ORGANIZATIONAL_CONTEXT.get('on_demand_docs', []) or []))
+        budget = PromptBudget(SYSTEM_PROMPT_BUDGET)
+        budget.add("on_demand_docs", reversed(docs), value=lambda x: x[1])
+        budget.add("drive_index", list(DRIVE_INDEX))
+        packed, breakdown = budget.pack()
+        result = {
+            "on_demand_json": json.dumps([doc for _i, doc in sorted(packed["on_demand_docs"], key=lambda x: x[0])],
+                                         ensure_ascii=False),
+            "drive_json": json.dumps(packed["drive_index"], ensure_ascii=False),
+            "breakdown": breakdown,
+            "seen": budget.seen,
+        }
+        self._stable_cache = (version, result)
+        return result
+
+    def _prepare_prompt(self, payload):
+        """入力ペイロードから system_instruction（キャッシュ対象）と入力テキストを組み立てる。"""
         body = payload.get('body') or payload.get('text') or ''
         user = payload.get('user') or 'Unknown'
         platform = payload.get('platform') or 'Unknown'
         parent_id = payload.get('parentId') or payload.get('parent_id')
         thread_messages = payload.get('thread_messages') or payload.get('threadContext') or []
-        attachments = payload.get('attachments') or []
+        attachments = payload.get('attachments') or [{"id": i} for i in payload.get('attachment_ids') or []]
 
-        full_ctx = json.dumps(ORGANIZATIONAL_CONTEXT, ensure_ascii=False)[:30000]
-        recent_p = json.dumps(EXTRACTED_PROTOCOLS[-15:], ensure_ascii=False)
-        drive_ctx = json.dumps(DRIVE_INDEX, ensure_ascii=False)
+        # Ver 3.9: thread_messages を送ってこない場合はサーバー側のスレッド文脈（parentId）を使う。
+        # 送ってきた場合は従来どおりそれを使い、サーバーが知らないスレッドならその内容で始める
+        if thread_messages:
+            thread_store.seed(parent_id, [(m.get("role") or m.get("sender", "user"), m.get("text") or m.get("body") or "")
+                                          for m in thread_messages[-THREAD_MESSAGES:]])
+            recent = [str(m.get("text") or m.get("body") or "") for m in thread_messages[-3:]]
+        else:
+            recent = thread_store.recent_texts(parent_id)
+        query = " ".join([body] + recent)
+        # 版はレコードを読む前に控える（読んだ後に ingest されても、古い内容を新しい版の断片として残さない）
+        versions = dict(CATEGORY_VERSIONS)
+        with span("retrieval"):
+            context_items = [(category, key, self._fragment(versions, category, key, record))
+                             for category, key, record in self._retrieve_context(query)]
+            protocols = [self._fragment(versions, "protocols", p.get("id"), {"logic": p.get("logic"), "count": p.get("count", 1)},
+                                        ident=p.get("logic")) for p in protocol_store.select(query, k=15)]
+        stable = self._stable_knowledge()
 
         # --- Ver 3.8.6: スレッド文脈を冒頭に付与（AIが文脈を考慮して回答）---
         thread_section = ""
@@ -191,9 +856,23 @@ class AxiomOSCore:
                 if text:
                     lines.append(f"{role}: {text[:500]}")
             thread_section = "\n".join(lines) + "\n\n"
+        else:
+            thread_section = thread_store.render(parent_id)
+
+        # Ver 3.9: 優先度順（on_demand_docs → EXTRACTED_PROTOCOLS → 固定資料/Drive）に予算内で詰める。
+        # スレッド文脈と本文は必ず載せ、残りの予算を関連プロトコル → 組織情報の順に使う。system 側と同じ資料は載せない
+        fixed_tokens = metrics.estimate_tokens(thread_section) + metrics.estimate_tokens(body)
+        budget = PromptBudget(max(0, INPUT_PROMPT_BUDGET - fixed_tokens))
+        budget.add("protocols", protocols, measure=lambda f: (f.key, f.tokens))
+        budget.add("context", context_items, measure=lambda x: (x[2].key, x[2].tokens))
+        packed, input_breakdown = budget.pack(seen=stable["seen"])
+        full_ctx = self._render_context(packed["context"])
+        recent_p = "[" + ", ".join(f.text for f in packed["protocols"]) + "]"
+        on_demand_json = stable["on_demand_json"]
+        drive_ctx = stable["drive_json"]
 
         # --- Ver 3.8.5 継承: 自信スコア + 最短品質向上 ---
-        on_demand_json = json.dumps(ORGANIZATIONAL_CONTEXT.get('on_demand_docs', []), ensure_ascii=False)
+        # Ver 3.9: 安定部分のみ system_instruction（= Context Cache 対象）。組織情報の検索結果・最新プロトコルは入力側へ
         system_instruction = f"""
         あなたは組織OS「Axiom」の品質監視型知能です。
 
@@ -206,83 +885,223 @@ class AxiomOSCore:
         【ナレッジ優先度】on_demand_docs 最優先 → EXTRACTED_PROTOCOLS → 固定資料/Drive。
 
         【組織知能：on_demand_docs】{on_demand_json}
-        【組織情報】{full_ctx}
         【Google Drive Index】{drive_ctx}
-        【最新プロトコル】{recent_p}
         """
-        user_input = f"{thread_section}User: {user} ({platform})\n【今回の入力】\n{body}"
-        cache_name = await self.get_or_create_cache(system_instruction)
+        knowledge_section = f"【組織情報】{full_ctx}\n【関連プロトコル】{recent_p}\n\n"
+        user_input = f"{knowledge_section}{thread_section}User: {user} ({platform})\n【今回の入力】\n{body}"
+        for part, text in (("system", system_instruction), ("input", user_input)):
+            PROMPT_CHARS.observe(len(text), part)
+            PROMPT_TOKENS.observe(metrics.estimate_tokens(text), part)
+        breakdown = {**stable["breakdown"], **input_breakdown,
+                     "thread": {"tokens": metrics.estimate_tokens(thread_section)},
+                     "body": {"tokens": metrics.estimate_tokens(body)}}
+        for section, info in breakdown.items():
+            PROMPT_SECTION_TOKENS.observe(info["tokens"], section)
+            for reason in ("dropped", "duplicates"):
+                if info.get(reason):
+                    PROMPT_DROPPED.inc(section, reason, amount=info[reason])
+        print("📐 [Prompt] " + " | ".join(f"{k} {v['tokens']}t" + (f" (-{v['dropped']})" if v.get("dropped") else "")
+                                         for k, v in breakdown.items()))
+        return {
+            "body": body, "user": user, "platform": platform, "parent_id": parent_id,
+            "message_id": payload.get('messageId') or payload.get('message_id'),
+            "attachments": attachments, "has_thread": bool(thread_section),
+            "system_instruction": system_instruction, "user_input": user_input, "budget": breakdown,
+        }
 
-        try:
-            content_parts = self._build_content_parts(user_input, attachments)
-            config = types.GenerateContentConfig(cached_content=cache_name) if cache_name else None
-            if cache_name and len(content_parts) == 1:
-                response = client.models.generate_content(
-                    model=MODEL_ID,
-                    contents=content_parts[0].text,
-                    config=config
-                )
-            elif content_parts and client:
-                response = client.models.generate_content(
+    async def _generate(self, prompt):
+        content_parts = await self._build_content_parts(prompt["user_input"], prompt["attachments"])
+        with span("cache_lookup"):
+            cache_name = await context_cache.get(prompt["system_instruction"])
+        if cache_name:
+            try:
+                return await get_client().aio.models.generate_content(
                     model=MODEL_ID,
                     contents=content_parts,
-                    config=config
+                    config=_types().GenerateContentConfig(cached_content=cache_name)
                 )
-            else:
-                response = client.models.generate_content(
-                    model=MODEL_ID,
-                    contents=[system_instruction, user_input]
-                )
-            raw_output = (response.text or "").strip()
-            print(f"\n--- [DEBUG] AI Raw ---\n{raw_output[:300]}...")
-
-            # Ver 3.8.1: JSON抽出ロジック強化（```json 優先 → { } ブロック）
-            cleaned_json = None
-            if "```json" in raw_output:
-                m = re.search(r'```json\s*(.*?)\s*```', raw_output, re.DOTALL)
-                if m:
-                    cleaned_json = m.group(1).strip()
-            if not cleaned_json:
-                json_match = re.search(r'\{.*\}', raw_output, re.DOTALL)
-                if json_match:
-                    cleaned_json = json_match.group(0)
-            if cleaned_json:
-                analysis = json.loads(cleaned_json)
-            else:
-                # Ver 3.8.3/3.8.4: JSON がなくても出典タグ付き本文 or 短いテキストなら採用
-                t = raw_output.strip()
-                if t and (t.startswith("[最新/依頼]") or t.startswith("[基本資料]") or t.startswith("[登録完了]") or t.startswith("[ホットフィックス完了]") or (len(t) < 2000 and "{" not in t[:100])):
-                    analysis = {"action_instruction": t}
-                else:
-                    analysis = {"action_instruction": t if t else "解析エラー。簡潔な指示をお願いします。"}
+            except Exception as e:
+                # サーバー側で失効済みのキャッシュ: 表から外してキャッシュなしで再送
+                print(f"⚠️ [Cache] {cache_name} unusable, retrying uncached: {e}")
+                context_cache.invalidate(cache_name)
+        return await get_client().aio.models.generate_content(
+            model=MODEL_ID,
+            contents=content_parts,
+            config=_types().GenerateContentConfig(system_instruction=prompt["system_instruction"])
+        )
+
+    async def _generate_stream(self, prompt, on_text):
+        """Ver 3.9: ストリーミング生成。断片ごとに on_text を呼び、全文を返す。"""
+        content_parts = await self._build_content_parts(prompt["user_input"], prompt["attachments"])
+        with span("cache_lookup"):
+            cache_name = await context_cache.get(prompt["system_instruction"])
+        chunks = []
+
+        async def run(config):
+            usage = None
+            stream = await get_client().aio.models.generate_content_stream(model=MODEL_ID, contents=content_parts, config=config)
+            async for chunk in stream:
+                text = chunk.text or ""
+                if text:
+                    chunks.append(text)
+                    on_text(text)
+                usage = getattr(chunk, "usage_metadata", None) or usage
+            context_cache.record_usage(usage)
+            return "".join(chunks)
+
+        if cache_name:
+            try:
+                return await run(_types().GenerateContentConfig(cached_content=cache_name))
+            except Exception as e:
+                if chunks:
+                    raise
+                print(f"⚠️ [Cache] {cache_name} unusable, retrying uncached: {e}")
+                context_cache.invalidate(cache_name)
+        return await run(_types().GenerateContentConfig(system_instruction=prompt["system_instruction"]))
+
+    def _parse_analysis(self, raw_output):
+        print(f"\n--- [DEBUG] AI Raw ---\n{raw_output[:300]}...")
+        # Ver 3.8.1: JSON抽出ロジック強化（```json 優先 → { } ブロック）
+        cleaned_json = None
+        if "```json" in raw_output:
+            m = re.search(r'```json\s*(.*?)\s*```', raw_output, re.DOTALL)
+            if m:
+                cleaned_json = m.group(1).strip()
+        if not cleaned_json:
+            json_match = re.search(r'\{.*\}', raw_output, re.DOTALL)
+            if json_match:
+                cleaned_json = json_match.group(0)
+        if cleaned_json:
+            try:
+                return json.loads(cleaned_json)
+            except ValueError:
+                JSON_PARSE_FAILURES.inc()
+                raise
+        # Ver 3.8.3/3.8.4: JSON がなくても出典タグ付き本文 or 短いテキストなら採用
+        t = raw_output.strip()
+        if t and (t.startswith("[最新/依頼]") or t.startswith("[基本資料]") or t.startswith("[登録完了]") or t.startswith("[ホットフィックス完了]") or (len(t) < 2000 and "{" not in t[:100])):
+            return {"action_instruction": t}
+        return {"action_instruction": t if t else "解析エラー。簡潔な指示をお願いします。"}
+
+    def _fast_path(self, payload):
+        """Ver 3.9: LLM を呼ばずに返せる入力（定型の挨拶・相槌、直近の重複質問）なら回答を返す。"""
+        if not FAST_PATH_ENABLED or payload.get('attachments') or payload.get('attachment_ids') or payload.get('thread_messages') or payload.get('threadContext'):
+            return None
+        parent_id = payload.get('parentId') or payload.get('parent_id')
+        if parent_id and parent_id in thread_store:
+            return None
+        body = payload.get('body') or payload.get('text') or ''
+        rule = fast_path.classify(body)
+        if rule:
+            fast_path.count_rule_hit()
+            return {"instruction": rule.reply, "confidence": 100, "reasoning": f"Fast path: {rule.name}",
+                    "cited_sources": [], "axiom_impact": {"primary_axiom": [0], "urgency": 1}}
+        return fast_path.lookup(body, knowledge_version)
+
+    def _fast_decision(self, payload, answer):
+        return {
+            "id": None,
+            "timestamp": datetime.now().isoformat(),
+            "axiom_impact": dict(answer["axiom_impact"]),
+            "autonomous_action": {
+                "instruction": answer["instruction"],
+                "confidence": answer["confidence"],
+                "reasoning": answer["reasoning"],
+                "cited_sources": list(answer["cited_sources"]),
+                "inquiry": None,
+                "execution_status": "None"
+            },
+            "meta": {"user": payload.get('user') or 'Unknown', "platform": payload.get('platform') or 'Unknown',
+                     "body": payload.get('body') or payload.get('text') or '',
+                     "parentId": payload.get('parentId') or payload.get('parent_id'), "attachments_count": 0,
+                     "fast_path": True}
+        }
+
+    async def process_input(self, payload):
+        with span("fast_path"):
+            answer = self._fast_path(payload)
+        if answer:
+            DECISIONS_TOTAL.inc("fast_path")
+            return self._fast_decision(payload, answer)
+        with span("prepare_prompt"):
+            prompt = self._prepare_prompt(payload)
+        try:
+            with span("llm"):
+                response = await self._generate(prompt)
+            context_cache.record_usage(getattr(response, "usage_metadata", None))
+            with span("parse"):
+                analysis = self._parse_analysis((response.text or "").strip())
+        except Exception as e:
+            print(f"❌ Analysis Error: {e}")
+            ANALYSIS_ERRORS.inc()
+            analysis = {"action_instruction": "解析エラー。簡潔な指示をお願いします。"}
+        DECISIONS_TOTAL.inc("llm")
+        return await self._finalize(prompt, analysis)
+
+    async def process_input_stream(self, payload, emit):
+        """Ver 3.9: action_instruction を token イベントとして逐次 emit し、最後に decision を返す。"""
+        with span("fast_path"):
+            answer = self._fast_path(payload)
+        if answer:
+            DECISIONS_TOTAL.inc("fast_path")
+            emit("token", {"text": answer["instruction"]})
+            return self._fast_decision(payload, answer)
+        with span("prepare_prompt"):
+            prompt = self._prepare_prompt(payload)
+        extractor = InstructionStreamExtractor()
+        isolator = IncrementalUrlIsolator()
+
+        def on_text(text):
+            piece = isolator.feed(extractor.feed(text))
+            if piece:
+                emit("token", {"text": piece})
+
+        try:
+            with span("llm"):
+                raw_output = (await self._generate_stream(prompt, on_text)).strip()
+            tail = isolator.flush()
+            if tail:
+                emit("token", {"text": tail})
+            with span("parse"):
+                analysis = self._parse_analysis(raw_output)
         except Exception as e:
             print(f"❌ Analysis Error: {e}")
+            ANALYSIS_ERRORS.inc()
             analysis = {"action_instruction": "解析エラー。簡潔な指示をお願いします。"}
+        DECISIONS_TOTAL.inc("llm_stream")
+        return await self._finalize(prompt, analysis)
+
+    async def _finalize(self, prompt, analysis):
+        """解析結果を decision に整形し、Gap / 実行 / プロトコルを記録する（id は _record_decision で採番）。"""
+        body, user, platform = prompt["body"], prompt["user"], prompt["platform"]
+        parent_id, attachments = prompt["parent_id"], prompt["attachments"]
 
         # 最終クレンジング（str(analysis) は絶対に使わない）
         raw_instruction = analysis.get('action_instruction') or analysis.get('response')
         if raw_instruction is not None and not isinstance(raw_instruction, str):
             raw_instruction = None
-        instruction = self.deep_clean_text(raw_instruction) if raw_instruction else ""
+        with span("clean"):
+            instruction = self.deep_clean_text(raw_instruction) if raw_instruction else ""
         # Ver 3.8.2/3.8.3: コマンド発行時に回答が空なら「登録完了報告」を自動生成
         if not instruction and analysis.get('execute_command'):
             cmd = analysis['execute_command']
             if cmd.get('command') == "ingest_knowledge":
                 title = (cmd.get('params') or {}).get('title', '資料')
                 instruction = f"[登録完了] 佐藤直様の指示に基づき、ナレッジ『{title}』を最優先データとして格納しました。"
-        # 空 or 生JSONっぽい文字列なら人間らしいフォールバック
+        # 空 or 生JSONっぽい文字列なら人間らしいフォールバック（定型文は fast_path のルール表と共通）
+        fallback_used = False
         if not instruction or "'action_instruction'" in instruction or '"action_instruction"' in instruction or "'reasoning'" in instruction:
-            if any(x in (body or "") for x in ("ありがとう", "感謝", "thanks", "thank you", "助かった")):
-                instruction = "どういたしまして！お役に立てて嬉しいです。"
-            elif any(x in body for x in ("おはよう", "こんにちは", "こんばんは", "よろしく")):
-                instruction = "こちらこそよろしくお願いします。何かあればお声がけください。"
-            else:
-                instruction = "承知しました。他にご用があればお知らせください。"
+            rule = fast_path.classify(body, strict=False)
+            instruction = rule.reply if rule else "承知しました。他にご用があればお知らせください。"
+            fallback_used = True
+            FALLBACKS_TOTAL.inc()
         inquiry = (analysis.get('inquiry_to_human') or "").strip() or None
 
         # 知能の欠損（Gap）を記録 — Dashboard の Knowledge Gaps に表示
+        # WAL の fsync・persistence.lock 待ち（大きな ingest の索引更新中など）でループ上の他の Gemini 呼び出しを止めないよう、
+        # 記録はすべてワーカースレッドで行う（contextvars はコピーされるので trace・defer_sync もそのまま効く）
         if inquiry and inquiry not in ["N/A", ""]:
-            KNOWLEDGE_GAPS.append({
+            await asyncio.to_thread(_commit, "gap", {
                 "id": len(KNOWLEDGE_GAPS) + 1,
                 "timestamp": datetime.now().isoformat(),
                 "user_query": body,
@@ -290,32 +1109,54 @@ class AxiomOSCore:
                 "status": "pending"
             })
 
-        # 実行レイヤー
+        # 実行レイヤー（Ver 3.9: ジョブキューへ積むだけで外部 API の応答は待たない）
         exec_status = "None"
-        if analysis.get('execute_command') and dispatcher:
+        job_id = None
+        if analysis.get('execute_command') and get_dispatcher():
             cmd = analysis['execute_command']
-            res = dispatcher.dispatch(cmd)
             # Ver 3.8.5: Hot-Fix / Ingest 完了時の自動応答
             if cmd.get("command") == "ingest_knowledge":
                 tag = "[ホットフィックス完了]" if ("間違い" in (body or "") or "正解は" in (body or "")) else "[登録完了]"
                 instruction = f"{tag} 佐藤直様の指示に基づき、ナレッジ『{(cmd.get('params') or {}).get('title', '資料')}』を最優先データとして格納しました。"
-            if res.get("status") == "success":
-                exec_status = f"Success: {cmd.get('command')} dispatched."
-                execution_counter += 1
+            # 同一プロセスへの ingest は外部 API を伴わないため即時実行（次の発言から参照できる）
+            local_ingest = cmd.get("command") == "ingest_knowledge" and dispatcher.knowledge_store.in_process
+            if job_queue and not local_ingest:
+                # 同じ発言（クライアントのメッセージ id、なければユーザー・スレッド・本文）からの同一コマンドは
+                # JOBS_DEDUPE_WINDOW 秒以内なら 1 回だけ実行する
+                key = idempotency_key(cmd, prompt["message_id"] or f"{user}|{platform}|{parent_id}|{body}")
+                with span("dispatch"):
+                    job_id = await asyncio.to_thread(job_queue.enqueue, cmd, key=key)
+                exec_status = f"Queued: job {job_id}"
+                DISPATCH_TOTAL.inc(cmd.get("command"), "queued")
             else:
-                exec_status = f"Failed: {res.get('error', 'Unknown Error')}"
+                with span("dispatch"):
+                    res = await asyncio.to_thread(dispatcher.dispatch, cmd)
+                if res.get("status") == "success":
+                    exec_status = f"Success: {cmd.get('command')} dispatched."
+                    await asyncio.to_thread(_commit, "exec", {"command": cmd.get("command")})
+                else:
+                    exec_status = f"Failed: {res.get('error', 'Unknown Error')}"
+                DISPATCH_TOTAL.inc(cmd.get("command"), "success" if res.get("status") == "success" else "failed")
 
         # Axiom 2: 逆引きプロトコル（ユーザーが教えた知識を即座に保存）
         extracted = analysis.get('logic_extraction')
         if extracted and extracted not in ["N/A", "", None]:
-            EXTRACTED_PROTOCOLS.append({
-                "timestamp": datetime.now().isoformat(),
-                "user": user,
-                "logic": str(extracted)
+            await asyncio.to_thread(_record_protocol, user, str(extracted))
+
+        # Ver 3.9: 文脈に依存せず副作用もない確信度の高い回答のみ、重複質問用にキャッシュ
+        confidence = analysis.get('confidence_score', 80)
+        if (FAST_PATH_ENABLED and not fallback_used and not inquiry and not analysis.get('execute_command')
+                and not attachments and not prompt["has_thread"] and isinstance(confidence, (int, float)) and confidence >= 70
+                and not instruction.startswith("解析エラー")):
+            fast_path.remember(body, knowledge_version, {
+                "instruction": instruction, "confidence": confidence,
+                "reasoning": str(analysis.get('reasoning', 'Logic match')),
+                "cited_sources": analysis.get('cited_sources', []) or [],
+                "axiom_impact": {"primary_axiom": analysis.get('aligned_axiom', [0]), "urgency": analysis.get('urgency_score', 1)},
             })
 
         return {
-            "id": len(axiom_intelligence_storage) + 1,
+            "id": None,
             "timestamp": datetime.now().isoformat(),
             "axiom_impact": {
                 "primary_axiom": analysis.get('aligned_axiom', [0]),
@@ -327,7 +1168,8 @@ class AxiomOSCore:
                 "reasoning": str(analysis.get('reasoning', 'Logic match')),
                 "cited_sources": analysis.get('cited_sources', []),
                 "inquiry": inquiry,
-                "execution_status": exec_status
+                "execution_status": exec_status,
+                "job_id": job_id
             },
             "meta": {"user": user, "platform": platform, "body": body, "parentId": parent_id, "attachments_count": len(attachments)}
         }
@@ -336,6 +1178,46 @@ class AxiomOSCore:
 axiom_brain = AxiomOSCore()
 
 
+async def _process_and_record(payload, emit=None, trace=None):
+    """解析 → 記録までをループ上で完結させる（クライアント切断・タイムアウト時も decision は残る）。"""
+    if trace is not None:
+        metrics.bind_trace(trace)
+    if emit is None:
+        output = await axiom_brain.process_input(payload)
+    else:
+        output = await axiom_brain.process_input_stream(payload, emit)
+    with span("record"):
+        return await asyncio.to_thread(_record_decision, output)
+
+
+async def _process_batch(items):
+    """
+    Ver 3.9: 複数ペイロードを BATCH_CONCURRENCY 件ずつ並行処理し、入力順の結果を返す。
+    各項目はプール全体の同時実行枠（gate）にも従う。WAL 同期はバッチ末尾で 1 回のみ。
+    """
+    sem = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+    token = persistence.defer_sync()
+
+    async def one(payload):
+        if not isinstance(payload, dict):
+            return {"status": "Error", "error": "Payload must be an object"}
+        async with sem, worker_pool.gate():
+            try:
+                return {"status": "Processed", "decision": await _process_and_record(payload)}
+            except Exception as e:
+                print(f"❌ [Batch] Item failed: {e}")
+                return {"status": "Error", "error": str(e)}
+
+    try:
+        return await asyncio.gather(*(one(p) for p in items))
+    finally:
+        persistence.end_defer(token)
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.route('/api/ingest', methods=['POST'])
 def handle_ingest():
     if not is_authorized(request):
@@ -343,73 +1225,426 @@ def handle_ingest():
     data = request.json
     category = data.get('category', 'metadata')
     payload = data.get('payload', {})
-    global DRIVE_INDEX, cached_content_name
-
-    if category == "google_drive":
-        DRIVE_INDEX.clear()
-        DRIVE_INDEX.extend(payload if isinstance(payload, list) else [payload])
-    else:
-        if category not in ORGANIZATIONAL_CONTEXT:
-            ORGANIZATIONAL_CONTEXT[category] = {}
-        if isinstance(payload, dict):
-            ORGANIZATIONAL_CONTEXT[category].update(payload)
-        elif isinstance(payload, list):
-            if not isinstance(ORGANIZATIONAL_CONTEXT[category], list):
-                ORGANIZATIONAL_CONTEXT[category] = []
-            ORGANIZATIONAL_CONTEXT[category].extend(payload)
-        else:
-            ORGANIZATIONAL_CONTEXT[category] = payload
-    cached_content_name = None
-    save_cache()
+    _ingest_local(category, payload)
     print(f"✅ [Ingest] Context updated: {category}")
     return jsonify({"status": "Intelligence Synced", "category": category}), 200
 
 
+def _category_hashes(category):
+    """dict 型カテゴリの {key: row_hash}。カテゴリの版が変わるまで再計算しない。dict でなければ None。"""
+    with persistence.lock:
+        value = ORGANIZATIONAL_CONTEXT.get(category)
+        if value is None:
+            return {}
+        if not isinstance(value, dict):
+            return None
+        version = CATEGORY_VERSIONS.get(category, 0)
+        cached = _row_hash_cache.get(category)
+        if cached and cached[0] == version:
+            return cached[1]
+        hashes = {str(k): row_hash(v) for k, v in value.items()}
+        _row_hash_cache[category] = (version, hashes)
+        return hashes
+
+
+@app.route('/api/ingest/hashes', methods=['GET'])
+def handle_ingest_hashes():
+    """Ver 3.9: カテゴリ内の各レコードの内容ハッシュ（差分同期で変更行だけを送るための比較用）。"""
+    if not is_authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    category = request.args.get("category", "agencies")
+    hashes = _category_hashes(category)
+    if hashes is None:
+        return jsonify({"error": f"{category} is not a keyed category"}), 400
+    return jsonify({"category": category, "count": len(hashes), "hashes": hashes}), 200
+
+
+@app.route('/api/ingest/upsert', methods=['POST'])
+def handle_ingest_upsert():
+    """
+    Ver 3.9: 差分同期。{"category", "rows": {key: record}, "delete": [key, ...]}
+    内容ハッシュが現在と異なる行だけを ingest として記録し、delete のキーは削除する（変更のない行は WAL にも載らない）。
+    """
+    if not is_authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.json or {}
+    category = data.get("category", "agencies")
+    rows = data.get("rows") or {}
+    delete = data.get("delete") or []
+    if not isinstance(rows, dict) or not isinstance(delete, list):
+        return jsonify({"error": "rows must be an object and delete a list"}), 400
+    current = _category_hashes(category)
+    if current is None:
+        return jsonify({"error": f"{category} is not a keyed category"}), 400
+    changed = {k: v for k, v in rows.items() if current.get(str(k)) != row_hash(v)}
+    deleted = [k for k in delete if str(k) in current and k not in rows]
+    if changed:
+        _ingest_local(category, changed)
+    if deleted:
+        _commit("unset", {"category": category, "keys": deleted})
+    if changed or deleted:
+        print(f"✅ [Ingest] Upsert {category}: {len(changed)} changed, {len(deleted)} deleted, "
+              f"{len(rows) - len(changed)} unchanged")
+    return jsonify({"status": "Intelligence Synced", "category": category, "received": len(rows),
+                    "changed": len(changed), "unchanged": len(rows) - len(changed), "deleted": len(deleted)}), 200
+
+
+@app.route('/api/attachments', methods=['POST'])
+def handle_attachment_upload():
+    """
+    Ver 3.9: 添付のアップロード。multipart/form-data（複数ファイル可）か、本文そのもの（Content-Type に mime、?name=）。
+    ディスクへ逐次書き込みながら SHA-256 を取り、同じ内容は既存の id を返す。/api/logs では attachments: [{"id": ...}] で参照する。
+    """
+    if not is_authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    if request.content_length is not None and request.content_length > ATTACHMENT_REQUEST_MAX_BYTES:
+        return jsonify({"error": f"upload exceeds {ATTACHMENT_REQUEST_MAX_BYTES} bytes"}), 413
+    if request.content_length is None and request.mimetype == "multipart/form-data":
+        # 長さ不明の multipart は解析時に一時ファイルへ無制限に書かれるため受け付けない（本文そのものの送信は put_stream が上限で止める）
+        return jsonify({"error": "Content-Length required for multipart upload"}), 411
+    try:
+        if request.mimetype == "multipart/form-data":
+            files = [f for _name, f in request.files.items(multi=True)][:10]
+            if not files:
+                return jsonify({"error": "No file in upload"}), 400
+            stored = [attachment_store.put_stream(f.stream, f.mimetype, f.filename) for f in files]
+        else:
+            stored = [attachment_store.put_stream(request.stream, request.mimetype, request.args.get("name"))]
+    except AttachmentTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"attachments": [{k: a[k] for k in ("id", "mime", "size", "name", "deduplicated")} for a in stored]}), 200
+
+
+@app.route('/api/attachments/<blob_id>', methods=['GET'])
+def handle_attachment_meta(blob_id):
+    """登録済みか（HEAD でも可）とメタデータ。クライアントは SHA-256 を計算して未登録のものだけアップロードすればよい。"""
+    if not is_authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    meta = attachment_store.get(blob_id)
+    if meta is None:
+        return jsonify({"error": "Attachment not found"}), 404
+    return jsonify({k: meta.get(k) for k in ("id", "mime", "size", "name", "created")}), 200
+
+
 @app.route('/api/logs', methods=['POST'])
 def handle_logs():
     if not is_authorized(request):
         return jsonify({"error": "Unauthorized"}), 401
-    output = asyncio.run(axiom_brain.process_input(request.json))
-    axiom_intelligence_storage.append(output)
-    save_cache()
+    try:
+        output = worker_pool.run(_process_and_record(request.json, trace=_request_trace()), timeout=LLM_TIMEOUT_SEC)
+    except PoolSaturated:
+        return jsonify({"error": "Too Many Requests", "pool": worker_pool.stats()}), 429, {"Retry-After": "1"}
+    except concurrent.futures.TimeoutError:
+        return jsonify({"error": "Gateway Timeout"}), 504
     return jsonify({"status": "Processed", "decision": output}), 200
 
 
+@app.route('/api/logs/batch', methods=['POST'])
+def handle_logs_batch():
+    """Ver 3.9: ペイロード配列（または {"items": [...]}）を一括処理し、入力順に結果を返す。"""
+    if not is_authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.json
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return jsonify({"error": "Expected a JSON array or {\"items\": [...]}"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Too many items (max {BATCH_MAX_ITEMS})"}), 413
+    try:
+        results = worker_pool.run(_process_batch(items), timeout=BATCH_TIMEOUT_SEC, gated=False)
+    except PoolSaturated:
+        return jsonify({"error": "Too Many Requests", "pool": worker_pool.stats()}), 429, {"Retry-After": "1"}
+    except concurrent.futures.TimeoutError:
+        return jsonify({"error": "Gateway Timeout"}), 504
+    return jsonify({"status": "Processed", "count": len(results), "results": results}), 200
+
+
+@app.route('/api/logs/stream', methods=['POST'])
+def handle_logs_stream():
+    """Ver 3.9: SSE 版 /api/logs。token イベントで回答本文を逐次送り、最後に decision イベントを送る。"""
+    if not is_authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    events = queue.Queue()
+    trace = _request_trace(header=False)
+    try:
+        future = worker_pool.submit(_process_and_record(request.json, emit=lambda ev, data: events.put((ev, data)),
+                                                        trace=trace))
+    except PoolSaturated:
+        return jsonify({"error": "Too Many Requests", "pool": worker_pool.stats()}), 429, {"Retry-After": "1"}
+    future.add_done_callback(lambda _f: events.put(None))
+
+    def generate():
+        deadline = time.monotonic() + LLM_TIMEOUT_SEC
+        while True:
+            try:
+                item = events.get(timeout=max(0.1, deadline - time.monotonic()))
+            except queue.Empty:
+                yield _sse("error", {"error": "Gateway Timeout"})
+                return
+            if item is None:
+                break
+            yield _sse(*item)
+        try:
+            output = future.result()
+        except Exception as e:
+            yield _sse("error", {"error": str(e)})
+            return
+        if trace is not None:
+            yield _sse("trace", {"spans": [{"stage": n, "ms": round(ms, 1)} for n, ms in trace.spans]})
+        yield _sse("decision", {"status": "Processed", "decision": output})
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _flatten_log(l):
+    act = dict(l.get("autonomous_action") or {})
+    act.setdefault("execution_status", "None")
+    return {
+        "id": l["id"],
+        "timestamp": l["timestamp"],
+        "user": l["meta"]["user"],
+        "platform": l["meta"].get("platform", ""),
+        "message": l["meta"]["body"],
+        "primary_axiom": l["axiom_impact"]["primary_axiom"][0] if l["axiom_impact"].get("primary_axiom") else 0,
+        "instruction": act.get("instruction", ""),
+        "autonomous_action": act
+    }
+
+
+def _summary_stats():
+    return {
+        "total_logs": len(axiom_intelligence_storage),
+        "logic_extractions": len(EXTRACTED_PROTOCOLS),
+        "knowledge_gaps": pending_gap_count,
+        "drive_files": len(DRIVE_INDEX),
+        "on_demand_docs": len(ORGANIZATIONAL_CONTEXT.get("on_demand_docs", [])),
+        "execution_count": execution_counter,
+        "tier": "Enterprise V3.8.6 (Persistence & Threading)"
+    }
+
+
+def _int_arg(name, default, lo=None, hi=None):
+    try:
+        v = int(request.args.get(name, default))
+    except (TypeError, ValueError):
+        v = default
+    if lo is not None:
+        v = max(lo, v)
+    if hi is not None:
+        v = min(hi, v)
+    return v
+
+
+def _bi_delta(since, limit):
+    """since（revision）以降の差分のみ。ジャーナル範囲外なら None（呼び出し側で全量を返す）。"""
+    with persistence.lock:
+        if since < journal_base or since > persistence.seq:
+            return None
+        changes = []
+        for rev, op, data in reversed(CHANGE_JOURNAL):
+            if rev <= since:
+                break
+            changes.append((op, data))
+    changes.reverse()
+    logs = [_flatten_log(d) for op, d in changes if op == "decision"][-limit:]
+    # 近似重複の出現（protocol_seen）は更新後のエントリとして返す（同じ id は最後の 1 件のみ）
+    protocols = {}
+    for op, d in changes:
+        if op == "protocol":
+            protocols.pop(d.get("id"), None)
+            protocols[d.get("id")] = d
+        elif op == "protocol_seen" and protocol_store.get(d.get("id")):
+            protocols.pop(d.get("id"), None)
+            protocols[d.get("id")] = protocol_store.get(d.get("id"))
+    ingested = {d.get("category") for op, d in changes if op == "ingest"}
+    body = {
+        "bi_ready_logs": logs,
+        "knowledge_gaps": [d for op, d in changes if op == "gap"],
+        "new_protocols": list(protocols.values())[-limit:],
+    }
+    if "on_demand_docs" in ingested:
+        body["on_demand_list"] = ORGANIZATIONAL_CONTEXT.get("on_demand_docs", [])
+    return body
+
+
 @app.route('/api/axiom-bi', methods=['GET'])
 def handle_bi():
+    """
+    Ver 3.9: ETag（revision）で未変更時は 304。since=<revision> で前回以降の差分のみ返す。
+    応答の cursor を次回の since に渡す。ジャーナル外の since は reset=true で全量を返す。
+    ETag は状態の識別子（sqlite バックエンドでは全ワーカー共通）+ revision。応答は revision まで確定した状態だけから作る
+    （キャッシュ・高速経路のカウンタなど revision を上げずに変わる値は載せない。/metrics を参照）。
+    """
     if not is_authorized(request):
         return jsonify({"error": "Unauthorized"}), 401
-    flat_logs = []
-    for l in axiom_intelligence_storage[-50:]:
-        act = dict(l.get("autonomous_action") or {})
-        act.setdefault("execution_status", "None")
-        flat_logs.append({
-            "id": l["id"],
-            "timestamp": l["timestamp"],
-            "user": l["meta"]["user"],
-            "platform": l["meta"].get("platform", ""),
-            "message": l["meta"]["body"],
-            "primary_axiom": l["axiom_impact"]["primary_axiom"][0] if l["axiom_impact"].get("primary_axiom") else 0,
-            "instruction": act.get("instruction", ""),
-            "autonomous_action": act
-        })
+    revision = persistence.seq
+    etag = f"{persistence.state_id}-{revision}"
+    if request.if_none_match.contains_weak(etag):
+        resp = app.response_class(status=304)
+        resp.set_etag(etag, weak=True)
+        return resp
+    limit = _int_arg("limit", 50, 1, 500)
+    since = request.args.get("since")
+    body = None
+    if since is not None:
+        body = _bi_delta(_int_arg("since", -1), limit)
+    if body is None:
+        body = {
+            "bi_ready_logs": [_flatten_log(l) for l in axiom_intelligence_storage[-limit:]],
+            "knowledge_gaps": KNOWLEDGE_GAPS[-10:],
+            "new_protocols": EXTRACTED_PROTOCOLS[-limit:],
+            "on_demand_list": ORGANIZATIONAL_CONTEXT.get("on_demand_docs", []),
+            "reset": since is not None,
+        }
+    body["summary_stats"] = _summary_stats()
+    body["cursor"] = revision
+    resp = jsonify(body)
+    resp.set_etag(etag, weak=True)
+    return resp, 200
+
+
+@app.route('/api/events', methods=['GET'])
+def handle_events():
+    """
+    Ver 3.9: ダッシュボード向け SSE。decision / protocol / gap / ingest / summary をプッシュ配信。
+    EventSource はヘッダーを付けられないため ?token= でも認証する。
+    接続直後の hello（cursor）と resync 受信時は /api/axiom-bi?since=<cursor> で追いつく。
+    """
+    if not (is_authorized(request) or request.args.get("token") == API_ACCESS_TOKEN):
+        return jsonify({"error": "Unauthorized"}), 401
+    sub = event_bus.subscribe()
+
+    def generate():
+        try:
+            yield _sse("hello", {"cursor": persistence.seq, "summary_stats": _summary_stats()})
+            while True:
+                item = sub.get(timeout=EVENT_HEARTBEAT_SEC)
+                if item is None:
+                    yield ": ping\n\n"
+                    continue
+                event, data = item
+                rev = data.get("cursor")
+                yield (f"id: {rev}\n" if rev is not None else "") + _sse(event, data)
+        finally:
+            sub.close()
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/api/axiom-bi/history', methods=['GET'])
+def handle_bi_history():
+    """Ver 3.9: 履歴のページング取得。kind=logs|protocols|gaps, before=<id>（未指定は最新から）, limit。"""
+    if not is_authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    kind = request.args.get("kind", "logs")
+    source = {"logs": axiom_intelligence_storage, "protocols": EXTRACTED_PROTOCOLS, "gaps": KNOWLEDGE_GAPS}.get(kind)
+    if source is None:
+        return jsonify({"error": f"Unknown kind: {kind}"}), 400
+    limit = _int_arg("limit", 50, 1, 500)
+    # id は 1 始まりの連番（= 位置 + 1）
+    end = _int_arg("before", len(source) + 1, 1, len(source) + 1) - 1
+    start = max(0, end - limit)
+    items = source[start:end]
+    if kind == "logs":
+        items = [_flatten_log(l) for l in items]
     return jsonify({
-        "summary_stats": {
-            "total_logs": len(axiom_intelligence_storage),
-            "logic_extractions": len(EXTRACTED_PROTOCOLS),
-            "knowledge_gaps": len([g for g in KNOWLEDGE_GAPS if g.get("status") == "pending"]),
-            "drive_files": len(DRIVE_INDEX),
-            "on_demand_docs": len(ORGANIZATIONAL_CONTEXT.get("on_demand_docs", [])),
-            "execution_count": execution_counter,
-            "tier": "Enterprise V3.8.6 (Persistence & Threading)"
-        },
-        "bi_ready_logs": flat_logs,
-        "knowledge_gaps": KNOWLEDGE_GAPS[-10:],
-        "new_protocols": EXTRACTED_PROTOCOLS,
-        "on_demand_list": ORGANIZATIONAL_CONTEXT.get("on_demand_docs", [])
+        "kind": kind,
+        "items": list(reversed(items)),
+        "next_before": start + 1 if start > 0 else None,
+        "total": len(source)
     }), 200
 
 
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def handle_job_status(job_id):
+    """Ver 3.9: 非同期アクションの実行状況（queued / running / retrying / succeeded / failed）。"""
+    if not is_authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    get_dispatcher()
+    if not job_queue:
+        return jsonify({"error": "Job queue disabled"}), 503
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+
+def _float_arg(name):
+    try:
+        return float(request.args[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+@app.route('/api/history', methods=['GET'])
+def handle_history():
+    """
+    Ver 3.9: decision 履歴の検索（二次索引を使うため全件走査しない）。新しい順、cursor でページング。
+    user / platform / axiom / status（success|failed|queued|none）/ urgency_min, urgency_max /
+    confidence_min, confidence_max / from, to（ISO 8601）/ cursor / limit
+    """
+    if not is_authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    filters = {
+        "user": request.args.get("user"),
+        "platform": request.args.get("platform"),
+        "axiom": request.args.get("axiom"),
+        "status": (request.args.get("status") or "").lower() or None,
+        "urgency": (_float_arg("urgency_min"), _float_arg("urgency_max")),
+        "confidence": (_float_arg("confidence_min"), _float_arg("confidence_max")),
+        "timestamp": (request.args.get("from"), request.args.get("to")),
+    }
+    if filters["timestamp"][1]:
+        # to は前方一致で含める（to=2026-01-31 でその日の全件）
+        filters["timestamp"] = (filters["timestamp"][0], filters["timestamp"][1] + "\uffff")
+    cursor = request.args.get("cursor")
+    if cursor is not None and not cursor.isdigit():
+        return jsonify({"error": "Invalid cursor"}), 400
+    limit = _int_arg("limit", 50, 1, 500)
+    with persistence.lock:
+        # 共有 DB の索引には他プロセスが書いた未同期の decision も載っているので、このプロセスの件数で切る
+        total = len(axiom_intelligence_storage)
+        before = total if cursor is None else min(int(cursor), total)
+        positions, next_cursor = decision_index.query(filters, before=before, limit=limit)
+        items = [_flatten_log(axiom_intelligence_storage[p]) for p in positions]
+    return jsonify({
+        "items": items,
+        "next_cursor": str(next_cursor) if next_cursor is not None else None,
+        "total": total
+    }), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    """Ver 3.9: Prometheus テキスト形式のメトリクス（段階別レイテンシ・キャッシュ・フォールバック・ディスパッチ等）。"""
+    if not is_authorized(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/healthz', methods=['GET'])
+def handle_healthz():
+    """Ver 3.9: liveness（プロセスが応答できれば 200。状態の読み込み中でも落とさない）。"""
+    return jsonify({"status": "alive", "uptime_sec": round(time.perf_counter() - _MODULE_T0, 1)}), 200
+
+
+@app.route('/readyz', methods=['GET'])
+def handle_readyz():
+    """Ver 3.9: readiness（状態の読み込みが終わるまで 503）。起動時間の内訳を返す。"""
+    body = {"ready": state_loaded, "timings_ms": STARTUP_TIMINGS,
+            "gemini_client": client is not None, "dispatcher": dispatcher is not None}
+    return jsonify(body), 200 if state_loaded else 503
+
+
+STARTUP_TIMINGS["module_import"] = round((time.perf_counter() - _MODULE_T0) * 1000, 1)
+
 if __name__ == '__main__':
-    load_cache()
-    app.run(host='0.0.0.0', port=PORT, debug=True)
+    if LAZY_START:
+        start_boot()
+    else:
+        _boot()
+    app.run(host='0.0.0.0', port=PORT, debug=True, threaded=True)
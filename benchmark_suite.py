@@ -0,0 +1,341 @@
+"""
+Benchmark Suite - Axiom サーバーをプロセス内で起動し、偽の Gemini（fake_gemini）に対してオフラインで負荷をかける。
+代理店 CSV から作った質問・ホットフィックス・報告・添付付き・スレッド返信の混在ワークロードを流し、
+スループット、種類別の p50 / p95 / p99 レイテンシ、段階別の平均時間、メモリ（最大 RSS・ヒープ）を報告する。
+
+    python benchmark_suite.py --requests 500 --concurrency 16 --latency lognormal:0.8,0.5
+    python benchmark_suite.py --stream --mix question=1 --json bench.json
+
+状態ファイルは一時ディレクトリに作る（既存の axiom_* には触れない）。
+"""
+import argparse
+import atexit
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CSV = os.path.join(HERE, "チーム代理店管理 - 光回線代理店情報.csv")
+DEFAULT_MIX = "question=0.55,report=0.15,hotfix=0.05,attachment=0.1,thread=0.15"
+# 1x1 の PNG（添付付きワークロード用）
+_TINY_PNG = base64.b64encode(bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082")).decode("ascii")
+_USERS = ["佐藤直", "田中", "新人A", "新人B", "鈴木", "高橋", "Axiom-Worker-01"]
+_PLATFORMS = ["Slack", "Chatwork", "GoogleChat", "LINE WORKS"]
+
+
+def load_agencies(csv_path):
+    """seed_context.py と同じ読み方（2 行目の【入力必須】行を飛ばし、企業名をキーにする）。"""
+    import pandas as pd
+    df = pd.read_csv(csv_path, skiprows=[1])
+    df = df.astype(object).where(pd.notnull(df), None)
+    agencies = {}
+    for row in df.to_dict("records"):
+        name = str(row.get("企業名") or "").strip()
+        if name:
+            agencies[name] = row
+    return agencies
+
+
+def parse_mix(spec):
+    weights = {}
+    for item in spec.split(","):
+        kind, _, w = item.partition("=")
+        if kind.strip():
+            weights[kind.strip()] = float(w or 1)
+    unknown = set(weights) - set(WorkloadGenerator.KINDS)
+    if unknown:
+        raise ValueError(f"Unknown workload kinds: {sorted(unknown)}")
+    return weights
+
+
+class WorkloadGenerator:
+    """
+    代理店データから /api/logs のペイロードを作る。企業名・項目は偏りのある分布で選ぶため、
+    実運用と同様に同じ質問の繰り返し（fast path の命中）も一定量含まれる。
+    """
+    KINDS = ("question", "report", "hotfix", "attachment", "thread")
+
+    def __init__(self, agencies, seed=0):
+        self.rng = random.Random(seed)
+        self.names = list(agencies) or ["サンプル代理店"]
+        first = next(iter(agencies.values()), {})
+        self.fields = [k for k in first if k not in ("no", "企業名")] or ["取引状況"]
+        self._threads = {}
+        self._thread_ids = 0
+
+    def _name(self):
+        # 先頭ほど選ばれやすい（上位数社に質問が集中する）
+        return self.names[min(int(self.rng.paretovariate(1.2)) - 1, len(self.names) - 1)]
+
+    def _base(self, body):
+        return {"user": self.rng.choice(_USERS), "platform": self.rng.choice(_PLATFORMS), "body": body}
+
+    def question(self):
+        name, field = self._name(), self.rng.choice(self.fields[:8])
+        return self._base(self.rng.choice([f"{name}の{field}を教えてください", f"{name}の{field}はどうなってますか？",
+                                           f"{name}って今も取引中ですか？"]))
+
+    def report(self):
+        name = self._name()
+        return self._base(self.rng.choice([
+            f"{name}の今月分、回収完了しました。kintone に反映済みです。",
+            f"{name}の住所不一致案件は Google Map で建物名まで確認してから差し戻す運用にします。",
+            f"【自律実行レポート】{name}のキャンセル理由 50 件を抽出し正規化しました。"]))
+
+    def hotfix(self):
+        name, field = self._name(), self.rng.choice(self.fields[:8])
+        return self._base(f"その回答は間違いです。正解は{name}の{field}は「確認中」です。")
+
+    def attachment(self):
+        payload = self._base(f"{self._name()}の申込書のスクショです。不備がないか見てください？")
+        payload["attachments"] = [{"type": "image/png", "data": _TINY_PNG}]
+        return payload
+
+    def thread(self):
+        # 既存スレッドへの返信が 7 割、新規スレッドが 3 割。スレッドごとに履歴が伸びていく
+        if self._threads and self.rng.random() < 0.7:
+            parent_id = self.rng.choice(list(self._threads))
+        else:
+            self._thread_ids += 1
+            parent_id = f"bench-thread-{self._thread_ids}"
+            self._threads[parent_id] = []
+        history = self._threads[parent_id]
+        payload = self.question()
+        payload["parentId"] = parent_id
+        payload["thread_messages"] = list(history[-10:])
+        history.append({"user": payload["user"], "text": payload["body"]})
+        return payload
+
+    def make(self, kind):
+        return kind, getattr(self, kind)()
+
+    def generate(self, n, mix):
+        kinds, weights = zip(*mix.items())
+        return [self.make(self.rng.choices(kinds, weights)[0]) for _ in range(n)]
+
+
+def percentile(sorted_values, q):
+    """最近傍順位法の百分位（sorted_values は昇順）。"""
+    if not sorted_values:
+        return None
+    rank = max(1, min(len(sorted_values), int(round(q / 100 * len(sorted_values) + 0.5))))
+    return sorted_values[rank - 1]
+
+
+def _latency_summary(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {"count": len(values), "mean_ms": round(sum(values) / len(values) * 1000, 1),
+            **{f"p{q}_ms": round(percentile(values, q) * 1000, 1) for q in (50, 95, 99)},
+            "max_ms": round(values[-1] * 1000, 1)}
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class BenchmarkRunner:
+    """
+    一時ディレクトリで axiom_server を import（状態ファイルはすべて相対パス）し、fake_gemini を注入して
+    Flask の test client から並行にリクエストを送る。HTTP サーバー・ネットワークは使わない。
+    """
+    def __init__(self, latency="lognormal:0.8,0.5", malformed_rate=0.0, seed=0, stream=False,
+                 workdir=None, trace_heap=False, quiet=True):
+        self.latency, self.malformed_rate, self.seed = latency, malformed_rate, seed
+        self.stream, self.trace_heap, self.quiet = stream, trace_heap, quiet
+        self.workdir = workdir or tempfile.mkdtemp(prefix="axiom_bench_")
+        self.server = None
+
+    def _output(self):
+        return contextlib.redirect_stdout(io.StringIO()) if self.quiet else contextlib.nullcontext()
+
+    def setup(self, agencies):
+        os.makedirs(self.workdir, exist_ok=True)
+        self._cwd = os.getcwd()
+        os.chdir(self.workdir)
+        os.environ.setdefault("AXIOM_LAZY_START", "0")
+        os.environ["AXIOM_FAKE_GEMINI"] = self.latency
+        sys.path.insert(0, HERE)
+        if self.trace_heap:
+            tracemalloc.start()
+        with self._output():
+            import axiom_server
+            from fake_gemini import FakeGeminiClient
+            axiom_server.client = FakeGeminiClient(latency=self.latency, malformed_rate=self.malformed_rate, seed=self.seed)
+            axiom_server._boot()
+            if agencies:
+                axiom_server._ingest_local("agencies", agencies)
+        self.server = axiom_server
+        self.headers = {"Authorization": f"Bearer {axiom_server.API_ACCESS_TOKEN}"}
+
+    def _send(self, client, payload):
+        t0 = time.perf_counter()
+        if not self.stream:
+            res = client.post("/api/logs", json=payload, headers=self.headers)
+            return res.status_code, time.perf_counter() - t0, None
+        res = client.post("/api/logs/stream", json=payload, headers=self.headers, buffered=False)
+        first_token, status = None, res.status_code
+        for chunk in res.response:
+            if first_token is None and b"event: token" in chunk:
+                first_token = time.perf_counter() - t0
+            if b"event: error" in chunk:
+                status = 599
+        res.close()
+        return status, time.perf_counter() - t0, first_token
+
+    def run(self, workload, concurrency):
+        app = self.server.app
+        local = threading.local()
+        results = []
+        results_lock = threading.Lock()
+
+        def one(item):
+            kind, payload = item
+            if not hasattr(local, "client"):
+                local.client = app.test_client()
+            try:
+                status, elapsed, ttft = self._send(local.client, payload)
+            except Exception:
+                status, elapsed, ttft = 598, 0.0, None
+            with results_lock:
+                results.append((kind, status, elapsed, ttft))
+
+        stages_before = self.server.metrics.STAGE_SECONDS.totals()
+        rss_before = _max_rss_mb()
+        t0 = time.perf_counter()
+        with self._output(), ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, workload))
+        wall = time.perf_counter() - t0
+        return self._report(results, wall, concurrency, stages_before, rss_before)
+
+    def _report(self, results, wall, concurrency, stages_before, rss_before):
+        ok = [r for r in results if r[1] == 200]
+        by_kind = {}
+        for kind in sorted({r[0] for r in results}):
+            rows = [r for r in results if r[0] == kind]
+            by_kind[kind] = {**_latency_summary([r[2] for r in rows if r[1] == 200]),
+                             "errors": sum(1 for r in rows if r[1] != 200)}
+        stages = {}
+        for labels, (count, total) in self.server.metrics.STAGE_SECONDS.totals().items():
+            prev_count, prev_total = stages_before.get(labels, (0, 0.0))
+            if count > prev_count:
+                stages[labels[0]] = {"count": count - prev_count,
+                                     "mean_ms": round((total - prev_total) / (count - prev_count) * 1000, 2)}
+        report = {
+            "config": {"requests": len(results), "concurrency": concurrency, "latency": self.latency,
+                       "malformed_rate": self.malformed_rate, "stream": self.stream, "seed": self.seed},
+            "wall_sec": round(wall, 3),
+            "throughput_rps": round(len(ok) / wall, 2) if wall else None,
+            "errors": {str(code): sum(1 for r in results if r[1] == code) for code in {r[1] for r in results} if code != 200},
+            "latency": _latency_summary([r[2] for r in ok]),
+            "by_kind": by_kind,
+            "stages": dict(sorted(stages.items(), key=lambda kv: -kv[1]["mean_ms"])),
+            "memory": {"max_rss_mb_before": rss_before, "max_rss_mb_after": _max_rss_mb(),
+                       "decisions": len(self.server.axiom_intelligence_storage)},
+            "fast_path": self.server.fast_path.stats(),
+            "context_cache": self.server.context_cache.stats(),
+        }
+        ttfts = [r[3] for r in ok if r[3] is not None]
+        if ttfts:
+            report["first_token"] = _latency_summary(ttfts)
+        if self.trace_heap:
+            current, peak = tracemalloc.get_traced_memory()
+            report["memory"].update({"heap_current_mb": round(current / 2 ** 20, 1), "heap_peak_mb": round(peak / 2 ** 20, 1)})
+        return report
+
+    def shutdown(self, remove_workdir=True):
+        """ジョブキュー・永続化を止めて最終スナップショットを書く（atexit では一時ディレクトリ削除後になるため先に行う）。"""
+        if self.server is not None:
+            with self._output():
+                self.server._shutdown_persistence()
+            atexit.unregister(self.server._shutdown_persistence)
+        os.chdir(getattr(self, "_cwd", HERE))
+        if remove_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def print_report(report):
+    cfg = report["config"]
+    print(f"📊 [Bench] {cfg['requests']} requests, concurrency {cfg['concurrency']}, latency {cfg['latency']}"
+          f"{', stream' if cfg['stream'] else ''}")
+    print(f"   wall {report['wall_sec']}s | {report['throughput_rps']} req/s | errors {report['errors'] or 0}")
+    lat = report["latency"]
+    if lat.get("count"):
+        print(f"   all        p50 {lat['p50_ms']:>8}ms  p95 {lat['p95_ms']:>8}ms  p99 {lat['p99_ms']:>8}ms  (n={lat['count']})")
+    for kind, s in report["by_kind"].items():
+        if s.get("count"):
+            print(f"   {kind:<10} p50 {s['p50_ms']:>8}ms  p95 {s['p95_ms']:>8}ms  p99 {s['p99_ms']:>8}ms  (n={s['count']}, errors {s['errors']})")
+    if "first_token" in report:
+        ft = report["first_token"]
+        print(f"   first token p50 {ft['p50_ms']}ms  p95 {ft['p95_ms']}ms  p99 {ft['p99_ms']}ms")
+    print("   stages     " + " | ".join(f"{k} {v['mean_ms']}ms" for k, v in report["stages"].items()))
+    mem = report["memory"]
+    print(f"   memory     max RSS {mem['max_rss_mb_before']} → {mem['max_rss_mb_after']} MB"
+          + (f", heap peak {mem['heap_peak_mb']} MB" if "heap_peak_mb" in mem else "")
+          + f", decisions {mem['decisions']}")
+    print(f"   fast path  {report['fast_path']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Axiom benchmark with a fake Gemini backend")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20, help="計測前に流すリクエスト数（キャッシュ作成等を除外）")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"種類=重み のカンマ区切り（{', '.join(WorkloadGenerator.KINDS)}）")
+    parser.add_argument("--latency", default="lognormal:0.8,0.5", help='"0" / "fixed:S" / "uniform:A,B" / "lognormal:MEDIAN,SIGMA"')
+    parser.add_argument("--malformed", type=float, default=0.0, help="壊れた JSON を返す割合")
+    parser.add_argument("--stream", action="store_true", help="/api/logs/stream（SSE）を計測")
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="代理店 CSV（無ければ合成データ）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action="store_true", help="ヒープのピークも測る（実行は遅くなる）")
+    parser.add_argument("--workdir", help="状態ファイルの置き場所（既定: 一時ディレクトリ、終了時に削除）")
+    parser.add_argument("--json", help="結果を JSON で書き出すパス")
+    parser.add_argument("--verbose", action="store_true", help="サーバーのログを表示")
+    args = parser.parse_args(argv)
+
+    agencies = load_agencies(args.csv) if os.path.exists(args.csv) else \
+        {f"代理店{i:03d}": {"企業名": f"代理店{i:03d}", "取引状況": "取引中", "商材": "光回線"} for i in range(50)}
+    generator = WorkloadGenerator(agencies, seed=args.seed)
+    mix = parse_mix(args.mix)
+    warmup, workload = generator.generate(args.warmup, mix), generator.generate(args.requests, mix)
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    runner = BenchmarkRunner(latency=args.latency, malformed_rate=args.malformed, seed=args.seed, stream=args.stream,
+                             workdir=args.workdir, trace_heap=args.tracemalloc, quiet=not args.verbose)
+    try:
+        runner.setup(agencies)
+        if warmup:
+            runner.run(warmup, args.concurrency)
+        report = runner.run(workload, args.concurrency)
+    finally:
+        runner.shutdown(remove_workdir=not args.workdir)
+    print_report(report)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Context Cache Manager - Gemini の Context Cache をナレッジ版（内容ハッシュ）単位で管理する。
+安定部分（指示・on_demand_docs・Drive Index）のみをキャッシュし、変化の激しい部分は毎回の入力側へ回す。
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+
+class _CacheEntry:
+    __slots__ = ("name", "expires_at")
+
+    def __init__(self, name, expires_at):
+        self.name = name
+        self.expires_at = expires_at
+
+
+class ContextCacheManager:
+    """
+    - get(stable_instruction): 内容ハッシュを版キーとして、既存キャッシュを再利用 / 期限前延長 / 新規作成
+    - 版キーが max_entries を超えたら古いキャッシュをサーバー側からも削除
+    - 作成に失敗した版キー（トークン数不足など）は retry_after 秒間キャッシュなしで処理
+    - stats(): ヒット率・作成/延長/破棄回数・プロンプト/キャッシュ済みトークン数
+    """
+    def __init__(self, get_client, model_id, ttl_sec=3600, refresh_margin_sec=300, max_entries=4,
+                 retry_after_sec=300, display_prefix="axiom_ctx"):
+        self._get_client = get_client
+        self.model_id = model_id
+        self.ttl_sec = int(ttl_sec)
+        self.refresh_margin_sec = refresh_margin_sec
+        self.max_entries = max(1, int(max_entries))
+        self.retry_after_sec = retry_after_sec
+        self.display_prefix = display_prefix
+        self._entries = OrderedDict()  # version_key -> _CacheEntry
+        self._failed = {}  # version_key -> 再試行可能時刻
+        self._locks = {}
+        self._stats = {"hits": 0, "misses": 0, "created": 0, "refreshed": 0, "evicted": 0,
+                       "failures": 0, "bypassed": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+    @staticmethod
+    def version_key(stable_instruction):
+        return hashlib.sha256(stable_instruction.encode("utf-8")).hexdigest()[:16]
+
+    async def get(self, stable_instruction):
+        """キャッシュ名を返す。利用できない場合は None（呼び出し側は system_instruction で直接送る）。"""
+        client = self._get_client()
+        if client is None:
+            return None
+        key = self.version_key(stable_instruction)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry and entry.expires_at - now > self.refresh_margin_sec:
+            self._stats["hits"] += 1
+            self._entries.move_to_end(key)
+            return entry.name
+        if self._failed.get(key, 0) > now:
+            self._stats["bypassed"] += 1
+            return None
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry and entry.expires_at - now > self.refresh_margin_sec:
+                self._stats["hits"] += 1
+                return entry.name
+            from google.genai import types
+            try:
+                if entry and entry.expires_at > now:
+                    # 期限間近: 作り直さず TTL のみ延長
+                    await client.aio.caches.update(
+                        name=entry.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_sec}s"))
+                    entry.expires_at = now + self.ttl_sec
+                    self._stats["hits"] += 1
+                    self._stats["refreshed"] += 1
+                    return entry.name
+                self._stats["misses"] += 1
+                cache = await client.aio.caches.create(
+                    model=self.model_id,
+                    config=types.CreateCachedContentConfig(
+                        display_name=f"{self.display_prefix}_{key}",
+                        system_instruction=stable_instruction,
+                        ttl=f"{self.ttl_sec}s"
+                    )
+                )
+            except Exception as e:
+                self._stats["failures"] += 1
+                self._entries.pop(key, None)
+                self._failed[key] = now + self.retry_after_sec
+                print(f"⚠️ [Cache] Create failed for {key}: {e}")
+                return None
+            self._entries[key] = _CacheEntry(cache.name, now + self.ttl_sec)
+            self._entries.move_to_end(key)
+            self._failed.pop(key, None)
+            self._stats["created"] += 1
+            print(f"✅ [Cache] Synchronized: {cache.name} (version {key})")
+        await self._evict(client)
+        return cache.name
+
+    async def _evict(self, client):
+        while len(self._entries) > self.max_entries:
+            key, entry = self._entries.popitem(last=False)
+            self._locks.pop(key, None)
+            self._stats["evicted"] += 1
+            try:
+                await client.aio.caches.delete(name=entry.name)
+            except Exception as e:
+                print(f"⚠️ [Cache] Delete failed for {entry.name}: {e}")
+
+    def invalidate(self, name):
+        """サーバー側で失効していたキャッシュを手元の表からも外す。"""
+        for key, entry in list(self._entries.items()):
+            if entry.name == name:
+                del self._entries[key]
+
+    def record_usage(self, usage):
+        """generate_content の usage_metadata を集計（キャッシュで節約したトークンの可視化）。"""
+        if usage is None:
+            return
+        self._stats["prompt_tokens"] += getattr(usage, "prompt_token_count", 0) or 0
+        self._stats["cached_tokens"] += getattr(usage, "cached_content_token_count", 0) or 0
+
+    def stats(self):
+        s = dict(self._stats)
+        lookups = s["hits"] + s["misses"] + s["bypassed"]
+        s["hit_rate"] = round(s["hits"] / lookups, 4) if lookups else 0.0
+        s["cached_token_ratio"] = round(s["cached_tokens"] / s["prompt_tokens"], 4) if s["prompt_tokens"] else 0.0
+        s["active_versions"] = list(self._entries.keys())
+        return s
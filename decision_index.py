@@ -0,0 +1,150 @@
+"""
+Decision Index - decision 履歴の二次索引（追記時に差分更新）。
+1 decision = 1 行（位置・timestamp / user / platform / primary_axiom / urgency / confidence / execution_status / parentId）を
+SQLite のテーブルに持ち、列ごとの B-tree 索引で絞り込む。メモリには載せず、再起動時も全件を読み直さない。
+file バックエンドではセグメントの隣（axiom_decisions/index.db）、sqlite バックエンドでは状態 DB の同じテーブルに置く
+（後者は SqliteStateBackend が decisions と同じトランザクションで書く）。
+"""
+import sqlite3
+import threading
+
+_EQ_FIELDS = ("user", "platform", "axiom", "status", "parent")
+_RANGE_FIELDS = ("timestamp", "urgency", "confidence")
+_COLUMNS = ("pos", "timestamp", "user", "platform", "axiom", "urgency", "confidence", "status", "parent")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decision_index (
+    pos INTEGER PRIMARY KEY,
+    timestamp TEXT,
+    user TEXT,
+    platform TEXT,
+    axiom REAL,
+    urgency REAL,
+    confidence REAL,
+    status TEXT,
+    parent TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_di_user ON decision_index (user, pos);
+CREATE INDEX IF NOT EXISTS idx_di_platform ON decision_index (platform, pos);
+CREATE INDEX IF NOT EXISTS idx_di_axiom ON decision_index (axiom, pos);
+CREATE INDEX IF NOT EXISTS idx_di_status ON decision_index (status, pos);
+CREATE INDEX IF NOT EXISTS idx_di_parent ON decision_index (parent, pos);
+CREATE INDEX IF NOT EXISTS idx_di_timestamp ON decision_index (timestamp);
+CREATE INDEX IF NOT EXISTS idx_di_urgency ON decision_index (urgency);
+CREATE INDEX IF NOT EXISTS idx_di_confidence ON decision_index (confidence);
+"""
+INSERT_SQL = (f"INSERT OR REPLACE INTO decision_index ({', '.join(_COLUMNS)}) "
+              f"VALUES ({', '.join('?' * len(_COLUMNS))})")
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def status_kind(execution_status):
+    """"Success: ..." / "Failed: ..." / "Queued: job 3" / "None" → success / failed / queued / none。"""
+    return str(execution_status or "None").split(":", 1)[0].strip().lower()
+
+
+def index_row(pos, decision):
+    """INSERT_SQL に渡す 1 行。"""
+    meta = decision.get("meta") or {}
+    impact = decision.get("axiom_impact") or {}
+    act = decision.get("autonomous_action") or {}
+    axioms = impact.get("primary_axiom") or [0]
+    axiom = axioms[0] if isinstance(axioms, list) else axioms
+    parent = meta.get("parentId")
+    return (pos, str(decision.get("timestamp") or ""), meta.get("user"), meta.get("platform", ""), _number(axiom),
+            _number(impact.get("urgency")), _number(act.get("confidence")), status_kind(act.get("execution_status")),
+            None if parent in (None, "") else str(parent))
+
+
+class DecisionIndex:
+    """
+    - add(pos, decision): axiom_intelligence_storage[pos] を索引へ追加（同じ位置は置き換え）
+    - catch_up(decisions): 索引の件数を decisions に合わせる（足りない分だけ追加、多い分は削除）。状態復元時
+    - positions(field, value): 等値条件の位置（古い順）。parent でスレッドの decision を引く
+    - query(filters, before, limit): 条件に合う位置を新しい順に最大 limit 件。before は前ページ末尾の位置（カーソル）
+      filters: user, platform, axiom, status, parent（等値）/ timestamp, urgency, confidence（(下限, 上限) のタプル、None は無制限）
+    writable=False は行を別の経路（SqliteStateBackend）が書く場合。add / catch_up は何もしない。
+    """
+    def __init__(self, db_path, writable=True, batch=5000):
+        self.writable = writable
+        self.batch = batch
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        if writable:
+            # decision 本体（セグメント）から作り直せるので fsync しない
+            self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(pos) + 1, 0) FROM decision_index").fetchone()[0]
+
+    def add(self, pos, decision):
+        if not self.writable:
+            return
+        with self._lock:
+            self._conn.execute(INSERT_SQL, index_row(pos, decision))
+
+    def catch_up(self, decisions):
+        """索引を decisions（len と [a:b] が使える列）に合わせ、追加した件数を返す。初回（既存データの移行）以外は差分だけ。"""
+        if not self.writable:
+            return 0
+        total = len(decisions)
+        indexed = len(self)
+        with self._lock:
+            if indexed > total:
+                self._conn.execute("DELETE FROM decision_index WHERE pos >= ?", (total,))
+                return 0
+        for begin in range(indexed, total, self.batch):
+            rows = [index_row(begin + i, d) for i, d in enumerate(decisions[begin:min(total, begin + self.batch)])]
+            with self._lock:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(INSERT_SQL, rows)
+                self._conn.execute("COMMIT")
+        return max(0, total - indexed)
+
+    def positions(self, field, value):
+        if field not in _EQ_FIELDS:
+            raise ValueError(f"not an equality field: {field}")
+        with self._lock:
+            return [r[0] for r in self._conn.execute(
+                f"SELECT pos FROM decision_index WHERE {field} = ? ORDER BY pos", (value,))]
+
+    def query(self, filters, before=None, limit=50):
+        """戻り値は (位置のリスト（新しい順）, 次ページのカーソル or None)。"""
+        where, params = [], []
+        for f in _EQ_FIELDS:
+            value = filters.get(f)
+            if value is None:
+                continue
+            if f == "axiom":
+                value = _number(value)
+            where.append(f"{f} = ?")
+            params.append(value)
+        for f in _RANGE_FIELDS:
+            lo, hi = filters.get(f) or (None, None)
+            if lo is not None:
+                where.append(f"{f} >= ?")
+                params.append(lo)
+            if hi is not None:
+                where.append(f"{f} <= ?")
+                params.append(hi)
+        if before is not None:
+            where.append("pos < ?")
+            params.append(int(before))
+        sql = "SELECT pos FROM decision_index"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY pos DESC LIMIT ?"
+        with self._lock:
+            result = [r[0] for r in self._conn.execute(sql, (*params, limit + 1))]
+        if len(result) > limit:
+            return result[:limit], result[limit - 1]
+        return result, None
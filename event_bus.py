@@ -0,0 +1,69 @@
+"""
+Event Bus - サーバー内の状態変化（decision / protocol / gap / ingest）を接続中のダッシュボードへファンアウトする。
+購読者ごとに上限付きキューを持ち、publish は決してブロックしない。
+"""
+import queue
+import threading
+
+
+class Subscription:
+    def __init__(self, bus, max_queue):
+        self._bus = bus
+        self.queue = queue.Queue(maxsize=max_queue)
+
+    def get(self, timeout=None):
+        """(event, data) を返す。timeout までに何もなければ None。"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+    """
+    - subscribe(): Subscription を返す（SSE 接続ごとに 1 つ）
+    - publish(event, data): 全購読者のキューへ投入。溢れた購読者はキューを破棄して
+      "resync" を 1 件だけ積む（クライアントは /api/axiom-bi?since= で追いつく）
+    """
+    def __init__(self, max_queue=256):
+        self.max_queue = max_queue
+        self._subs = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self):
+        sub = Subscription(self, self.max_queue)
+        with self._lock:
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def publish(self, event, data):
+        with self._lock:
+            subs = list(self._subs)
+        self.published += 1
+        for sub in subs:
+            try:
+                sub.queue.put_nowait((event, data))
+            except queue.Full:
+                self.dropped += 1
+                try:
+                    while True:
+                        sub.queue.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    sub.queue.put_nowait(("resync", {}))
+                except queue.Full:
+                    pass
+
+    def __len__(self):
+        with self._lock:
+            return len(self._subs)
@@ -0,0 +1,199 @@
+"""
+Fake Gemini - オフライン計測用の決定的な Gemini クライアント代替。
+google.genai.Client のうち Axiom が使う部分（aio.models.generate_content / generate_content_stream、
+aio.caches.create / update / delete、aio.files.upload）だけを実装し、入力に応じたテンプレート JSON を指定の遅延分布で返す。
+AXIOM_FAKE_GEMINI=<遅延指定> でサーバーの get_client() がこれを使う（例: "lognormal:0.8,0.5" / "fixed:0.2" / "0"）。
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import types
+
+from metrics import estimate_tokens
+
+
+def parse_latency(spec):
+    """
+    遅延指定 → rng を受け取って秒数を返す関数。
+    "0" / "" … 遅延なし、"fixed:S"、"uniform:A,B"、"lognormal:MEDIAN,SIGMA"（中央値 MEDIAN 秒）
+    """
+    spec = (spec or "0").strip()
+    kind, _, args = spec.partition(":")
+    if not args:
+        try:
+            value = float(kind)
+        except ValueError:
+            value = None
+        if value is not None:
+            return lambda rng: value
+    nums = [float(x) for x in args.split(",") if x.strip()]
+    if kind == "fixed" and len(nums) == 1:
+        return lambda rng: nums[0]
+    if kind == "uniform" and len(nums) == 2:
+        return lambda rng: rng.uniform(nums[0], nums[1])
+    if kind == "lognormal" and len(nums) == 2:
+        mu = math.log(max(nums[0], 1e-6))
+        return lambda rng: rng.lognormvariate(mu, nums[1])
+    raise ValueError(f"Unknown latency spec: {spec!r}")
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, cached_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.cached_content_token_count = cached_tokens
+
+
+class _Response:
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+def _part_text(contents):
+    texts = []
+    for part in contents if isinstance(contents, list) else [contents]:
+        text = part if isinstance(part, str) else getattr(part, "text", None)
+        if text:
+            texts.append(text)
+    return "\n".join(texts)
+
+
+def default_responder(user_input, rng):
+    """
+    【今回の入力】の本文から応答 JSON を作る（実際の system_instruction の行動指針をなぞる）。
+    - 「正解は」「間違い」を含む → ingest_knowledge 付きのホットフィックス
+    - 疑問文 → 出典タグ付きの回答（一定割合で自信 70 未満 → inquiry_to_human）
+    - それ以外（報告・手順の共有）→ logic_extraction 付きの受領
+    """
+    body = user_input.rsplit("【今回の入力】", 1)[-1].strip()
+    head = re.sub(r"\s+", " ", body)[:40]
+    if "正解は" in body or "間違い" in body:
+        return {
+            "action_instruction": f"[ホットフィックス完了] ご指摘ありがとうございます。「{head}」を反映しました。",
+            "confidence_score": 95,
+            "aligned_axiom": [2],
+            "urgency_score": 3,
+            "reasoning": "Human correction",
+            "execute_command": {"command": "ingest_knowledge",
+                                "params": {"title": head, "url": "", "source": "Hotfix via Chat"}},
+        }
+    if body.endswith(("?", "？")) or "ですか" in body or "教えて" in body:
+        confidence = rng.randint(55, 98)
+        analysis = {
+            "action_instruction": f"[基本資料] {head} について: 組織情報の該当箇所をご確認ください。",
+            "confidence_score": confidence,
+            "aligned_axiom": [rng.randint(1, 5)],
+            "urgency_score": rng.randint(1, 5),
+            "reasoning": "Context match",
+            "cited_sources": ["agencies"],
+        }
+        if confidence < 70:
+            analysis["inquiry_to_human"] = "自信がありません。正しい資料はこれですか？"
+        return analysis
+    return {
+        "action_instruction": f"[最新/依頼] 報告を受領しました: {head}",
+        "confidence_score": rng.randint(70, 95),
+        "aligned_axiom": [rng.randint(1, 5)],
+        "urgency_score": rng.randint(1, 5),
+        "reasoning": "Report",
+        "logic_extraction": f"{head} の手順を標準フローとする",
+    }
+
+
+class _Models:
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def generate_content(self, model, contents, config=None):
+        text, usage, delay = self._owner._respond(contents, config)
+        await asyncio.sleep(delay)
+        return _Response(text, usage)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        text, usage, delay = self._owner._respond(contents, config)
+        chunk_size = self._owner.stream_chunk_chars
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+        # 遅延の 3 割を最初のトークンまで、残りをチャンク間に均等に配分
+        first, per_chunk = delay * 0.3, delay * 0.7 / len(chunks)
+
+        async def gen():
+            await asyncio.sleep(first)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(per_chunk)
+                yield _Response(chunk, usage if i == len(chunks) - 1 else None)
+        return gen()
+
+
+class _Caches:
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.live = {}
+
+    async def create(self, model, config=None):
+        name = f"cachedContents/fake-{next(self._ids)}"
+        self.live[name] = getattr(config, "system_instruction", "") or ""
+        return types.SimpleNamespace(name=name, model=model)
+
+    async def update(self, name, config=None):
+        if name not in self.live:
+            raise RuntimeError(f"404 NOT_FOUND: {name}")
+        return types.SimpleNamespace(name=name)
+
+    async def delete(self, name):
+        self.live.pop(name, None)
+
+
+class _Files:
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.uploads = 0
+
+    async def upload(self, file, config=None):
+        self.uploads += 1
+        name = f"files/fake-{next(self._ids)}"
+        mime = (config or {}).get("mime_type") if isinstance(config, dict) else getattr(config, "mime_type", None)
+        return types.SimpleNamespace(name=name, uri=f"https://fake.invalid/{name}", mime_type=mime, expiration_time=None)
+
+
+class FakeGeminiClient:
+    """
+    latency: parse_latency の指定文字列、または rng → 秒 の関数
+    responder(user_input, rng) → dict | str: 応答本文（dict は ```json ブロックで包む）
+    malformed_rate: 壊れた JSON を返す割合（JSON 解析失敗の経路を計測する用）
+    応答内容は seed と入力から決まり（同じ入力には同じ応答）、遅延は seed 起点の乱数列から取る。
+    """
+    def __init__(self, latency="0", responder=None, malformed_rate=0.0, seed=0, stream_chunk_chars=24):
+        self._latency = parse_latency(latency) if isinstance(latency, str) or latency is None else latency
+        self._responder = responder or default_responder
+        self.malformed_rate = malformed_rate
+        self.seed = seed
+        self.stream_chunk_chars = max(1, int(stream_chunk_chars))
+        self._latency_rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.aio = types.SimpleNamespace(models=_Models(self), caches=_Caches(), files=_Files())
+
+    def _respond(self, contents, config):
+        user_input = _part_text(contents)
+        digest = hashlib.sha256(f"{self.seed}:{user_input}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self._latency(self._latency_rng))
+        if rng.random() < self.malformed_rate:
+            text = '```json\n{"action_instruction": "[基本資料] 途中で切れた応答, "confidence_score": \n```'
+        else:
+            analysis = self._responder(user_input, rng)
+            text = analysis if isinstance(analysis, str) else \
+                "```json\n" + json.dumps(analysis, ensure_ascii=False) + "\n```"
+        cached = getattr(config, "cached_content", None)
+        system = self.aio.caches.live.get(cached) if cached else getattr(config, "system_instruction", "")
+        system_tokens = estimate_tokens(system or "")
+        usage = _Usage(estimate_tokens(user_input) + system_tokens, system_tokens if cached else 0)
+        return text, usage, delay
@@ -0,0 +1,137 @@
+"""
+Fast Path Responder - LLM を呼ばずに返せるメッセージ（挨拶・お礼・相槌・直近の重複質問）を即答する。
+ルール表は register() で差し替え・追加可能。回答キャッシュはナレッジ版ごとの LRU。
+"""
+import re
+import unicodedata
+from collections import OrderedDict
+
+_NOISE = re.compile(r"[\s\W_]+")
+# 定型文に添えられる語（キーワードと組み合わせて本文全体がこれらだけでできている場合のみ定型文とみなす）
+COURTESY_FILLERS = ("ございます", "ございました", "どうも", "本当に", "ほんとうに", "大変", "たいへん", "いつも", "皆さん", "みなさん",
+                    "お願いします", "お願いいたします", "おねがいします", "いたします", "します", "です", "ました",
+                    "ね", "よ", "ー", "w")
+# 訂正・指摘を含む発言はホットフィックス（ingest_knowledge）の経路に乗せるため、定型文扱いしない
+CORRECTION_MARKERS = ("正解は", "間違い", "まちがい", "違います", "ちがいます")
+
+
+def normalize(text):
+    """NFKC・小文字化し、空白・記号を除去（「ありがとう！！」と「ありがとう」を同一視）。"""
+    return _NOISE.sub("", unicodedata.normalize("NFKC", str(text or "")).lower())
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+class FastPathRule:
+    """
+    keywords の定型文に reply を返すルール。
+    strict 判定では正規化した本文全体がキーワードと COURTESY_FILLERS（「ございます」「お願いします」等）だけで
+    できている場合のみ一致する（「至急対応よろしく」「ありがとう。正解は5です」のように内容が残るものは一致しない）。
+    exact=True は完全一致のみ。
+    """
+    __slots__ = ("name", "keywords", "reply", "exact", "_phrases")
+
+    def __init__(self, name, keywords, reply, exact=False):
+        self.name = name
+        self.keywords = tuple(normalize(k) for k in keywords)
+        self.reply = reply
+        self.exact = exact
+        # 長いものから試す（「お願いします」を「します」より先に）
+        self._phrases = sorted((set(self.keywords) | {normalize(f) for f in COURTESY_FILLERS}) - {""}, key=len, reverse=True)
+
+    def _whole_phrase(self, norm):
+        seen_keyword, i = False, 0
+        while i < len(norm):
+            for phrase in self._phrases:
+                if norm.startswith(phrase, i):
+                    seen_keyword = seen_keyword or phrase in self.keywords
+                    i += len(phrase)
+                    break
+            else:
+                return False
+        return seen_keyword
+
+    def matches(self, norm, strict=True):
+        if self.exact:
+            return norm in self.keywords
+        if not strict:
+            return any(k in norm for k in self.keywords)
+        return self._whole_phrase(norm)
+
+
+class FastPathResponder:
+    """
+    - classify(body): 短い定型メッセージをルール表で判定（strict=False は LLM 失敗時のフォールバック用の緩い判定）
+    - lookup(body, version): 正規化本文 + ナレッジ版で回答キャッシュを引く。完全一致がなければ直近 window 件と bigram 類似度で近似一致
+    - remember(body, version, answer): 再利用可能な回答を登録（LRU で max_entries 件まで）
+    """
+    def __init__(self, max_entries=512, similarity=0.95, window=64):
+        self.max_entries = max(1, int(max_entries))
+        self.similarity = similarity
+        self.window = window
+        self.rules = []
+        self._answers = OrderedDict()  # (version, norm) -> answer
+        self._stats = {"rule_hits": 0, "cache_hits": 0, "near_hits": 0, "misses": 0}
+        for rule in DEFAULT_RULES:
+            self.register(**rule)
+
+    def register(self, name, keywords, reply, exact=False):
+        self.rules.append(FastPathRule(name, keywords, reply, exact))
+
+    def classify(self, body, strict=True):
+        norm = normalize(body)
+        if not norm or (strict and ("?" in body or "？" in body)):
+            return None
+        if any(m in norm for m in CORRECTION_MARKERS):
+            return None
+        for rule in self.rules:
+            if rule.matches(norm, strict=strict):
+                return rule
+        return None
+
+    def lookup(self, body, version):
+        norm = normalize(body)
+        if not norm:
+            return None
+        answer = self._answers.get((version, norm))
+        if answer is not None:
+            self._answers.move_to_end((version, norm))
+            self._stats["cache_hits"] += 1
+            return answer
+        grams = _bigrams(norm)
+        for (v, key) in reversed(list(self._answers.keys())[-self.window:]):
+            if v != version or abs(len(key) - len(norm)) > len(norm) * (1 - self.similarity) + 1:
+                continue
+            other = _bigrams(key)
+            if len(grams & other) / len(grams | other) >= self.similarity:
+                self._stats["near_hits"] += 1
+                return self._answers[(v, key)]
+        self._stats["misses"] += 1
+        return None
+
+    def remember(self, body, version, answer):
+        norm = normalize(body)
+        if not norm:
+            return
+        self._answers[(version, norm)] = answer
+        self._answers.move_to_end((version, norm))
+        while len(self._answers) > self.max_entries:
+            self._answers.popitem(last=False)
+
+    def count_rule_hit(self):
+        self._stats["rule_hits"] += 1
+
+    def stats(self):
+        return dict(self._stats, cached_answers=len(self._answers))
+
+
+DEFAULT_RULES = [
+    {"name": "thanks", "keywords": ("ありがとう", "感謝", "thanks", "thank you", "助かった"),
+     "reply": "どういたしまして！お役に立てて嬉しいです。"},
+    {"name": "greeting", "keywords": ("おはよう", "こんにちは", "こんばんは", "よろしく"),
+     "reply": "こちらこそよろしくお願いします。何かあればお声がけください。"},
+    {"name": "ack", "keywords": ("了解", "了解です", "了解しました", "承知しました", "わかりました", "かしこまりました", "ok", "okです"),
+     "reply": "承知しました。他にご用があればお知らせください。", "exact": True},
+]
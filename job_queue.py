@@ -0,0 +1,270 @@
+"""
+Action Job Queue - ActionDispatcher のコマンドを SQLite の永続キューで非同期実行する。
+送信先（slack / kintone / axiom）ごとの同時実行数・レート制限、冪等キー、指数バックオフ再試行を持つ。
+同時実行数と最小間隔は共有の SQLite 上で判定するため、複数プロセス（gunicorn の複数ワーカー）で動かしても送信先ごとの上限は全体で守られる。
+冪等キーは dedupe_window 秒のあいだだけ有効（クライアントの再送を 1 回にまとめるため）。完了済みのジョブは retention 秒後に削除する。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# コマンド名 → 送信先（同時実行数・レート制限の単位）
+COMMAND_TARGETS = {"slack_notify": "slack", "kintone_update": "kintone", "ingest_knowledge": "axiom"}
+# 送信先ごとの既定値: concurrency = 同時実行数, min_interval = 連続実行の最小間隔（秒）
+DEFAULT_TARGET_LIMITS = {
+    "slack": {"concurrency": 1, "min_interval": 1.0},
+    "kintone": {"concurrency": 2, "min_interval": 0.2},
+    "axiom": {"concurrency": 1, "min_interval": 0.0},
+    "default": {"concurrency": 1, "min_interval": 0.5},
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT UNIQUE NOT NULL,
+    target TEXT NOT NULL,
+    command TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_run_at REAL NOT NULL,
+    last_error TEXT,
+    result TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (target, status, next_run_at);
+CREATE TABLE IF NOT EXISTS target_state (
+    target TEXT PRIMARY KEY,
+    next_start_at REAL NOT NULL
+);
+"""
+
+
+def target_for(command_data):
+    return COMMAND_TARGETS.get((command_data or {}).get("command"), "default")
+
+
+def idempotency_key(command_data, scope=""):
+    """同一コマンド（+ scope）の二重実行を防ぐキー。"""
+    raw = json.dumps(command_data, ensure_ascii=False, sort_keys=True) + "|" + str(scope)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ActionJobQueue:
+    """
+    - enqueue(command_data, key): ジョブを登録して job id を返す（dedupe_window 秒以内に登録された同じ key は既存 id を返す。
+      それより古いものはキーを退避して新しいジョブにする）
+    - prune(): retention 秒より前に完了（succeeded / failed）したジョブを削除（ワーカーが prune_interval ごとに実行）
+    - get(job_id): ジョブの状態（queued / running / retrying / succeeded / failed）
+    - start(): 送信先ごとのワーカースレッドを起動。executor(command_data) の戻り値
+      {"status": "success"} で完了、それ以外は max_attempts まで指数バックオフで再試行
+      （戻り値に "retryable": False があれば即失敗）
+    - running のジョブは lease 秒のリース付き（next_run_at = リース期限）。実行中のプロセスが落ちても期限切れで再実行される
+    - on_success(job_id, command_data, result): 完了時のコールバック（実行カウンタ更新など）
+    """
+    def __init__(self, db_path, executor, on_success=None, target_limits=None, max_attempts=5,
+                 backoff_base=2.0, backoff_max=300.0, poll_interval=1.0, dedupe_window=600.0,
+                 retention=3 * 86400.0, prune_interval=3600.0, lease=300.0):
+        self.db_path = db_path
+        self.executor = executor
+        self.on_success = on_success
+        self.target_limits = dict(DEFAULT_TARGET_LIMITS, **(target_limits or {}))
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.dedupe_window = dedupe_window
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.lease = lease
+        self._next_prune = 0.0
+        self._local = threading.local()
+        self._wake = {}
+        self._prune_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = []
+        # 前回終了時に実行中だったジョブはリース期限切れで再実行される（他プロセスが実行中のジョブを巻き戻さない）
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    # --- 登録・参照 ---
+    def enqueue(self, command_data, key=None):
+        key = key or idempotency_key(command_data)
+        target = target_for(command_data)
+        now = datetime.now().isoformat()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT id, created_at FROM jobs WHERE idempotency_key = ?", (key,)).fetchone()
+            if row is not None and (datetime.now() - datetime.fromisoformat(row["created_at"])).total_seconds() > self.dedupe_window:
+                # 期限切れのキー: 既存ジョブのキーを退避し（履歴は残す）、新しいジョブとして登録する
+                conn.execute("UPDATE jobs SET idempotency_key = idempotency_key || ':' || id WHERE id = ?", (row["id"],))
+                row = None
+            if row is None:
+                job_id = conn.execute(
+                    "INSERT INTO jobs (idempotency_key, target, command, status, next_run_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                    (key, target, json.dumps(command_data, ensure_ascii=False), time.time(), now, now)).lastrowid
+            else:
+                job_id = row["id"]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._notify(target)
+        return job_id
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["command"] = json.loads(job["command"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def prune(self):
+        """retention 秒より前に完了したジョブを削除し、削除件数を返す。"""
+        cutoff = datetime.fromtimestamp(time.time() - self.retention).isoformat()
+        deleted = self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?", (cutoff,)).rowcount
+        if deleted:
+            print(f"🧹 [Jobs] Pruned {deleted} finished jobs")
+        return deleted
+
+    def _maybe_prune(self):
+        with self._prune_lock:
+            if time.monotonic() < self._next_prune:
+                return
+            self._next_prune = time.monotonic() + self.prune_interval
+        try:
+            self.prune()
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ [Jobs] Prune failed: {e}")
+
+    def counts(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+    # --- ワーカー ---
+    def _limits(self, target):
+        return self.target_limits.get(target) or self.target_limits["default"]
+
+    def _notify(self, target):
+        ev = self._wake.get(target) or self._wake.get("default")
+        if ev:
+            ev.set()
+
+    def start(self):
+        if self._threads:
+            return
+        for target, limits in self.target_limits.items():
+            self._wake[target] = threading.Event()
+            for i in range(max(1, int(limits.get("concurrency", 1)))):
+                t = threading.Thread(target=self._worker, args=(target,), name=f"axiom-job-{target}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self):
+        self._stopped.set()
+        for ev in self._wake.values():
+            ev.set()
+
+    def _claim(self, target):
+        """
+        実行可能なジョブを 1 件 running にして (row, None) を返す。上限に達していれば (None, 待つ秒数)。
+        同時実行数（リース期限内の running の件数）と最小間隔（target_state）は即時トランザクション内で判定・更新する。
+        """
+        limits = self._limits(target)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if target == "default":
+                known = [t for t in self.target_limits if t != "default"]
+                scope, params = f"target NOT IN ({','.join('?' * len(known))})", tuple(known)
+            else:
+                scope, params = "target = ?", (target,)
+            running = conn.execute(f"SELECT COUNT(*) FROM jobs WHERE {scope} AND status = 'running' AND next_run_at > ?",
+                                   (*params, now)).fetchone()[0]
+            if running >= max(1, int(limits.get("concurrency", 1))):
+                conn.execute("COMMIT")
+                return None, None
+            state = conn.execute("SELECT next_start_at FROM target_state WHERE target = ?", (target,)).fetchone()
+            if state is not None and state["next_start_at"] > now:
+                conn.execute("COMMIT")
+                return None, state["next_start_at"] - now
+            # running でリース期限が切れたもの（実行中にプロセスが落ちたジョブ）も取り直す
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE {scope} AND status IN ('queued', 'retrying', 'running') "
+                "AND next_run_at <= ? ORDER BY next_run_at LIMIT 1", (*params, now)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, next_run_at = ?, updated_at = ? "
+                             "WHERE id = ?", (now + self.lease, datetime.now().isoformat(), row["id"]))
+                conn.execute("INSERT OR REPLACE INTO target_state (target, next_start_at) VALUES (?, ?)",
+                             (target, now + float(limits.get("min_interval", 0))))
+            conn.execute("COMMIT")
+            return row, None
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _worker(self, target):
+        wake = self._wake[target]
+        while not self._stopped.is_set():
+            try:
+                row, wait = self._claim(target)
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ [Jobs] Claim failed ({target}): {e}")
+                row, wait = None, None
+            if row is None:
+                if wait is not None:
+                    # 最小間隔待ち: 起こされても間隔が空くまでは取りに行かない
+                    self._stopped.wait(timeout=min(wait, self.poll_interval))
+                    continue
+                self._maybe_prune()
+                wake.wait(timeout=self.poll_interval)
+                wake.clear()
+                continue
+            self._execute(row)
+
+    def _execute(self, row):
+        command_data = json.loads(row["command"])
+        attempts = row["attempts"] + 1
+        try:
+            res = self.executor(command_data) or {}
+        except Exception as e:
+            res = {"status": "exception", "details": str(e)}
+        now = datetime.now().isoformat()
+        conn = self._conn()
+        if res.get("status") == "success":
+            conn.execute("UPDATE jobs SET status = 'succeeded', result = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+                         (json.dumps(res, ensure_ascii=False), now, row["id"]))
+            print(f"✅ [Jobs] #{row['id']} {command_data.get('command')} succeeded (attempt {attempts})")
+            if self.on_success:
+                try:
+                    self.on_success(row["id"], command_data, res)
+                except Exception as e:
+                    print(f"⚠️ [Jobs] on_success failed: {e}")
+            return
+        error = str(res.get("error") or res.get("details") or "Unknown Error")
+        if res.get("retryable") is False or attempts >= self.max_attempts:
+            conn.execute("UPDATE jobs SET status = 'failed', result = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                         (json.dumps(res, ensure_ascii=False), error, now, row["id"]))
+            print(f"❌ [Jobs] #{row['id']} {command_data.get('command')} failed: {error}")
+            return
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        conn.execute("UPDATE jobs SET status = 'retrying', last_error = ?, next_run_at = ?, updated_at = ? WHERE id = ?",
+                     (error, time.time() + delay, now, row["id"]))
+        print(f"🔁 [Jobs] #{row['id']} retry in {delay:.0f}s: {error}")
@@ -0,0 +1,148 @@
+"""
+Knowledge Index - ORGANIZATIONAL_CONTEXT 向けのインメモリ検索索引（文字 bigram + BM25）。
+日本語は分かち書きなしで扱えるよう、NFKC 正規化後の文字 bigram を語として扱う。
+"""
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+_WORD_RUN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """NFKC・小文字化した文字列を、単語文字の連続ごとに文字 bigram へ分割する（1 文字の連続はそのまま）。"""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    tokens = []
+    for run in _WORD_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _record_text(key, record):
+    """レコード内のスカラー値を連結（JSON のキー名は全件共通のノイズになるため除外）。"""
+    parts = [str(key)]
+    stack = [record]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, dict):
+            stack.extend(v.values())
+        elif isinstance(v, (list, tuple)):
+            stack.extend(v)
+        elif v is not None:
+            parts.append(str(v))
+    return " ".join(parts)
+
+
+class KnowledgeIndex:
+    """
+    (category, key) 単位の転置索引。
+    - dict カテゴリ: 1 キー = 1 文書 / list カテゴリ: 1 要素 = 1 文書（key は添字）/ スカラー: key=None
+    - upsert / index_category で差分更新、search で BM25 上位 k 件を返す
+    """
+    def __init__(self, categories=None, k1=1.5, b=0.75):
+        self.categories = set(categories) if categories else None
+        self.k1 = k1
+        self.b = b
+        self._postings = {}   # term -> {doc_id: tf}
+        self._doc_terms = {}  # doc_id -> Counter(term)
+        self._doc_len = {}    # doc_id -> 語数
+        self._total_len = 0
+        self._lock = threading.RLock()
+
+    def accepts(self, category):
+        return self.categories is None or category in self.categories
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    # --- 更新 ---
+    def remove(self, category, key):
+        doc_id = (category, key)
+        with self._lock:
+            terms = self._doc_terms.pop(doc_id, None)
+            if terms is None:
+                return
+            for term in terms:
+                posting = self._postings.get(term)
+                if posting is not None:
+                    posting.pop(doc_id, None)
+                    if not posting:
+                        del self._postings[term]
+            self._total_len -= self._doc_len.pop(doc_id, 0)
+
+    def upsert(self, category, key, record):
+        if not self.accepts(category):
+            return
+        terms = Counter(tokenize(_record_text(key if key is not None else category, record)))
+        doc_id = (category, key)
+        with self._lock:
+            self.remove(category, key)
+            if not terms:
+                return
+            self._doc_terms[doc_id] = terms
+            length = sum(terms.values())
+            self._doc_len[doc_id] = length
+            self._total_len += length
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+
+    def drop_category(self, category):
+        with self._lock:
+            for doc_id in [d for d in self._doc_terms if d[0] == category]:
+                self.remove(*doc_id)
+
+    def index_category(self, category, value, start=0):
+        """カテゴリの値を索引へ反映。list は start 番目以降の要素のみ追加（extend 差分）。"""
+        if not self.accepts(category):
+            return
+        with self._lock:
+            if isinstance(value, dict):
+                for key, record in value.items():
+                    self.upsert(category, key, record)
+            elif isinstance(value, list):
+                for i in range(start, len(value)):
+                    self.upsert(category, i, value[i])
+            else:
+                self.drop_category(category)
+                self.upsert(category, None, value)
+
+    def rebuild(self, context):
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_len.clear()
+            self._total_len = 0
+            for category, value in context.items():
+                self.index_category(category, value)
+
+    # --- 検索 ---
+    def search(self, query, k=10, exclude=()):
+        """BM25 スコア上位 k 件を [(category, key, score), ...] で返す。"""
+        q_terms = set(tokenize(query))
+        if not q_terms:
+            return []
+        with self._lock:
+            n_docs = len(self._doc_len)
+            if not n_docs:
+                return []
+            avg_len = self._total_len / n_docs
+            scores = {}
+            for term in q_terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    if doc_id[0] in exclude:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        top = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+        return [(cat, key, score) for (cat, key), score in top]
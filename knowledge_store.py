@@ -0,0 +1,60 @@
+"""
+Knowledge Store - ActionDispatcher からナレッジを書き込む先の抽象化。
+同一プロセスで動くサーバーでは LocalKnowledgeStore（/api/ingest と同じ commit 経路を直接呼ぶ）、
+別ホストの脳へ書き戻す場合のみ HttpKnowledgeStore（HTTP POST /api/ingest）を使う。
+"""
+import hashlib
+import json
+
+import requests
+
+
+def row_hash(value):
+    """
+    レコード 1 件の内容ハッシュ（キー順・空白に依存しない JSON から計算）。
+    seed_context の差分同期と /api/ingest/hashes・/api/ingest/upsert で同じ値になるよう共通化している。
+    """
+    blob = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+
+class KnowledgeStore:
+    """ingest(category, payload) は {"status": "success"} または {"status": "error", "error": ...} を返す。"""
+    in_process = False
+
+    def ingest(self, category, payload):
+        raise NotImplementedError
+
+
+class LocalKnowledgeStore(KnowledgeStore):
+    """commit(category, payload) を直接呼ぶ（HTTP の往復・2 つ目のワーカー占有・自己呼び出しのデッドロックがない）。"""
+    in_process = True
+
+    def __init__(self, commit):
+        self._commit = commit
+
+    def ingest(self, category, payload):
+        try:
+            self._commit(category, payload)
+            return {"status": "success"}
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
+
+
+class HttpKnowledgeStore(KnowledgeStore):
+    """リモートの Axiom サーバーの /api/ingest へ POST する。"""
+    def __init__(self, api_base, token, timeout=10):
+        self.url = f"{api_base.rstrip('/')}/ingest"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {token}", "Content-Type": "application/json"})
+
+    def ingest(self, category, payload):
+        try:
+            res = self.session.post(self.url, json={"category": category, "payload": payload}, timeout=self.timeout)
+            if res.status_code == 200:
+                return {"status": "success"}
+            # 認証・入力エラーは再試行しても通らない
+            return {"status": "error", "error": res.text, "retryable": res.status_code == 429 or res.status_code >= 500}
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
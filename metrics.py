@@ -0,0 +1,173 @@
+"""
+Metrics - プロセス内のカウンタ・ヒストグラム・区間計測（span）と Prometheus テキスト形式での出力。
+span はリクエストごとの Trace（contextvars）にも記録され、X-Axiom-Trace / Server-Timing ヘッダーに使える。
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 秒単位の既定バケット（1ms 〜 60s）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+_current_trace = contextvars.ContextVar("axiom_trace", default=None)
+
+
+def estimate_tokens(text):
+    """トークン数の概算（ASCII は約 4 文字で 1 トークン、それ以外は 1 文字 1 トークン）。"""
+    text = text or ""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for n, v in zip(names, values):
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{n}="{v}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for lv, v in items:
+            lines.append(f"{self.name}{_label_str(self.labels, lv)} {v}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label_values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def totals(self):
+        """{ラベル値のタプル: (件数, 合計)}（ベンチマーク等での集計用）。"""
+        with self._lock:
+            return {lv: (s[-1], s[-2]) for lv, s in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((lv, list(s)) for lv, s in self._series.items())
+        for lv, series in items:
+            cumulative = 0
+            for le, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_label_str(self.labels + ('le',), lv + (le,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_str(self.labels + ('le',), lv + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, lv)} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, lv)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """出力時に fn() を呼んで値を得る（既存の stats() をそのまま公開する用途）。fn は数値か {ラベル値: 数値} を返す。"""
+    def __init__(self, name, help_text, fn, label=None):
+        self.name, self.help, self.fn, self.label = name, help_text, fn, label
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.fn()
+        except Exception:
+            return lines
+        if isinstance(value, dict):
+            for k, v in sorted(value.items()):
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    lines.append(f"{self.name}{_label_str((self.label,), (k,))} {v}")
+        elif value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, fn, label=None):
+        return self._add(Gauge(name, help_text, fn, label))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+STAGE_SECONDS = registry.histogram("axiom_stage_seconds", "Time spent per processing stage", ("stage",))
+
+
+class Trace:
+    """1 リクエスト内の span（段階名, ミリ秒）を記録順に保持する。"""
+    __slots__ = ("spans",)
+
+    def __init__(self):
+        self.spans = []
+
+    def add(self, name, ms):
+        self.spans.append((name, ms))
+
+    def header(self):
+        return ";".join(f"{n}={ms:.1f}" for n, ms in self.spans)
+
+    def server_timing(self):
+        return ", ".join(f"{n};dur={ms:.1f}" for n, ms in self.spans)
+
+
+def bind_trace(trace):
+    """現在のコンテキスト（イベントループ上のタスクなど）に Trace を紐づける。"""
+    return _current_trace.set(trace)
+
+
+@contextmanager
+def span(stage):
+    """区間を計測して axiom_stage_seconds{stage} と現在の Trace に記録する。"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe(elapsed, stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, elapsed * 1000)
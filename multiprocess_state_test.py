@@ -0,0 +1,102 @@
+"""
+SQLite 共有状態（AXIOM_STATE_BACKEND=sqlite）の複数プロセス回帰テスト。
+別プロセス A が確定した decision をプロセス B が sync() で取り込めるか（スレッドの読み込み中に
+共有索引の未取り込み分を読んで IndexError にならず、seq と件数が DB と一致するか）と、
+A が記録したプロトコルと同じものを未同期の B が記録しても新規追加にならず出現回数が増えるかを検証する。
+サーバーは不要（一時ディレクトリで axiom_server を直接読み込む）。python multiprocess_state_test.py
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# プロセス A: 状態を読み込み、parentId 付きの decision を 1 件記録して終了する
+WRITER = """
+import sys
+sys.path.insert(0, {root!r})
+import axiom_server as s
+s.load_cache()
+s._record_decision({{"timestamp": "2026-01-01T00:00:00", "meta": {{"user": "A", "platform": "test", "body": {body!r}, "parentId": "P"}},
+                     "autonomous_action": {{"instruction": {answer!r}}}}})
+"""
+# プロセス A: プロトコルを 1 件記録して終了する
+PROTOCOL_WRITER = """
+import sys
+sys.path.insert(0, {root!r})
+import axiom_server as s
+s.load_cache()
+s._record_protocol("A", {logic!r})
+"""
+LOGIC = "ドコモ光の解約は30日前までに申請する"
+
+
+def _env(work):
+    env = dict(os.environ, AXIOM_STATE_BACKEND="sqlite", AXIOM_STATE_DB=os.path.join(work, "axiom_state.db"),
+               AXIOM_FAKE_GEMINI="0", AXIOM_STATE_SYNC_INTERVAL="3600")
+    return env
+
+
+def _write(work, body, answer):
+    _run(work, WRITER.format(root=ROOT, body=body, answer=answer))
+
+
+def _run(work, code):
+    subprocess.run([sys.executable, "-c", code], cwd=work, env=_env(work), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_multiprocess_sync_verification():
+    print("🧪 [Axiom Test] SQLite 共有状態のプロセス間同期の検証開始\n")
+    work = tempfile.mkdtemp(prefix="axiom_mp_")
+    os.chdir(work)
+    os.environ.update(_env(work))
+    sys.path.insert(0, ROOT)
+
+    print("Step 1: プロセス A が 1 件目を記録...")
+    _write(work, "FIRST question", "first answer")
+
+    print("Step 2: プロセス B（このプロセス）が状態を読み込み...")
+    import axiom_server as s
+    s.load_cache()
+    s.persistence.stop()  # 同期はテストから明示的に呼ぶ
+
+    print("Step 3: プロセス A が同じスレッドに 2 件目を記録...")
+    _write(work, "second question", "second answer")
+
+    print("Step 4: プロセス B が sync() で取り込み...")
+    failures = []
+    try:
+        s.persistence.sync()
+    except Exception as e:
+        failures.append(f"sync() raised {type(e).__name__}: {e}")
+    db_count = s.persistence._conn.execute("SELECT COUNT(*) FROM decisions").fetchone()[0]
+    if len(s.axiom_intelligence_storage) != db_count:
+        failures.append(f"decisions in memory {len(s.axiom_intelligence_storage)} != DB {db_count}")
+    if s.persistence.seq != s.persistence._max_seq():
+        failures.append(f"seq {s.persistence.seq} != max changes seq {s.persistence._max_seq()}")
+    rendered = s.thread_store.render("P")
+    for text in ("FIRST question", "second question", "second answer"):
+        if rendered.count(text) != 1:
+            failures.append(f"thread P should contain {text!r} exactly once:\n{rendered}")
+
+    print("Step 5: プロセス A がプロトコルを記録し、未同期の B が同じものを記録...")
+    _run(work, PROTOCOL_WRITER.format(root=ROOT, logic=LOGIC))
+    s._record_protocol("B", LOGIC)
+    rows = [r[0] for r in s.persistence._conn.execute("SELECT json_extract(data, '$.count') FROM protocols")]
+    if rows != [2]:
+        failures.append(f"protocols in DB should be one entry seen twice, got counts {rows}")
+    if [p.get("count") for p in s.protocol_store.entries] != [2]:
+        failures.append(f"protocols in memory: {s.protocol_store.entries}")
+
+    if failures:
+        for f in failures:
+            print(f"  ❌ {f}")
+        return False
+    print(f"  ✅ decisions {db_count} / seq {s.persistence.seq} / スレッド P は 2 往復 / プロトコルは 1 件（出現 2 回）")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_multiprocess_sync_verification() else 1)
@@ -3,12 +3,12 @@ APCLO Eye - 現場観測エージェント
 観測データを Central Brain (CENTRAL_BRAIN_URL) に送信する。
 """
 import os
-import json
 from datetime import datetime
 
-import requests
 from dotenv import load_dotenv
 
+from axiom_client import get_client
+
 load_dotenv()
 
 CENTRAL_BRAIN_URL = os.getenv("CENTRAL_BRAIN_URL", "http://localhost:5000/api/logs")
@@ -16,19 +16,11 @@ CHATWORK_TOKEN = os.getenv("CHATWORK_TOKEN", "")
 
 
 def send_log(payload: dict) -> bool:
-    """観測ログを Central Brain に送信する。"""
-    try:
-        r = requests.post(
-            CENTRAL_BRAIN_URL,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=10,
-        )
-        r.raise_for_status()
-        return True
-    except requests.RequestException as e:
-        print(f"[APCLO Eye] 送信エラー: {e}")
-        return False
+    """
+    観測ログを Central Brain 送信キューに積む（バッチ送信・再送・不達時のディスク退避は axiom_client が担う）。
+    False はサーバー不達中・バッファ溢れで spool に退避したとき（疎通回復後に再送される）。
+    """
+    return get_client(agent="observer_bot").send(payload)
 
 
 def observe_and_send(source: str, data: dict) -> bool:
@@ -46,5 +38,6 @@ if __name__ == "__main__":
     print("APCLO Eye - 現場観測エージェント")
     print(f"Central Brain: {CENTRAL_BRAIN_URL}")
     # テスト送信
-    ok = observe_and_send("test", {"message": "Hello from APCLO Eye"})
-    print("送信結果:", "OK" if ok else "NG")
+    observe_and_send("test", {"message": "Hello from APCLO Eye"})
+    ok = get_client(agent="observer_bot").flush(timeout=10)
+    print("送信結果:", "OK" if ok else "NG（spool に退避し、次回起動時に再送）")
@@ -0,0 +1,210 @@
+"""
+Persistence Engine - 追記型 WAL（JSONL）+ 定期スナップショットによる状態永続化。
+1 リクエストあたりの書き込みは差分 1 行（O(delta)）。全量の書き出しはバックグラウンドのスナップショットのみ。
+"""
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+# バッチ処理中のタスクでは WAL の flush/fsync を遅延し、最後に 1 回だけ行う（グループコミット）
+_deferred_sync = contextvars.ContextVar("axiom_wal_deferred_sync", default=False)
+
+
+class PersistenceEngine:
+    """
+    - commit(op, data, apply, resolve): 状態への適用と WAL 追記をロック内で原子的に行う
+      （resolve(op, data) -> (op, data) があれば、ロック内で現在の状態を見て記録する差分を決め直す）
+    - snapshot(dump_state): 全状態を一時ファイルへ書き出し os.replace で差し替え、WAL を切り詰める
+    - load(restore, apply): スナップショット復元 → wal_seq より新しい WAL レコードを再生
+    - state_id: 状態の系列の識別子（スナップショットに保存。seq と組にすれば別の状態と取り違えない）
+    WAL レコード形式: {"seq": n, "op": "...", "data": {...}}
+    """
+    def __init__(self, snapshot_path, wal_path=None, snapshot_every=500, snapshot_interval=60.0, fsync=True):
+        self.snapshot_path = snapshot_path
+        self.wal_path = wal_path or f"{snapshot_path}.wal"
+        self.prev_wal_path = f"{self.wal_path}.prev"
+        self.snapshot_every = max(1, int(snapshot_every))
+        self.snapshot_interval = float(snapshot_interval)
+        self.fsync = fsync
+        self.lock = threading.RLock()
+        # スナップショット全体（直列化〜差し替え）を直列化する（バックグラウンドと終了時の save_cache が重なっても
+        # 古い内容で新しいスナップショットを上書きしない）
+        self._snapshot_lock = threading.Lock()
+        self.seq = 0
+        self.state_id = uuid.uuid4().hex[:16]
+        self._pending = 0  # 前回スナップショット以降の WAL レコード数
+        self._wal = None
+        self._dirty = False
+        self._dump_state = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    # --- WAL ---
+    def _open_wal(self):
+        if self._wal is None:
+            self._wal = open(self.wal_path, "a", encoding="utf-8")
+        return self._wal
+
+    def _write_record(self, op, data):
+        self.seq += 1
+        line = json.dumps({"seq": self.seq, "op": op, "data": data}, ensure_ascii=False, separators=(",", ":"))
+        wal = self._open_wal()
+        wal.write(line + "\n")
+        if _deferred_sync.get():
+            self._dirty = True
+        else:
+            self._sync(wal)
+        self._pending += 1
+        if self._pending >= self.snapshot_every:
+            self._wake.set()
+
+    def _sync(self, wal):
+        wal.flush()
+        if self.fsync:
+            os.fsync(wal.fileno())
+        self._dirty = False
+
+    def defer_sync(self):
+        """現在のコンテキスト（と以後に生成する子タスク）の commit を flush() までディスク同期しない。戻り値は end_defer に渡す。"""
+        return _deferred_sync.set(True)
+
+    def end_defer(self, token):
+        _deferred_sync.reset(token)
+        self.flush()
+
+    def flush(self):
+        """遅延分の WAL をまとめてディスクへ同期する。"""
+        with self.lock:
+            if self._dirty and self._wal is not None:
+                self._sync(self._wal)
+
+    def commit(self, op, data, apply, resolve=None):
+        """状態変更（apply）と WAL 追記を同一ロック内で行う。"""
+        with self.lock:
+            if resolve:
+                op, data = resolve(op, data)
+            result = apply(op, data)
+            self._write_record(op, data)
+            return result
+
+    @staticmethod
+    def _read_wal(path):
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # クラッシュ時に途中まで書かれた末尾行は破棄
+                    print(f"⚠️ [WAL] Skipped torn record in {path}")
+                    return
+
+    # --- 復元 ---
+    def load(self, restore, apply):
+        """スナップショット + WAL 末尾から状態を再構築する。戻り値は再生したレコード数。"""
+        with self.lock:
+            snap_seq = 0
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                snap_seq = int(data.get("wal_seq", 0))
+                self.state_id = data.get("state_id") or self.state_id
+                restore(data)
+            self.seq = snap_seq
+            replayed = 0
+            for path in (self.prev_wal_path, self.wal_path):
+                for rec in self._read_wal(path):
+                    seq = int(rec.get("seq", 0))
+                    if seq <= self.seq:
+                        continue
+                    apply(rec.get("op"), rec.get("data"))
+                    self.seq = seq
+                    replayed += 1
+            self._pending = replayed
+            return replayed
+
+    # --- スナップショット ---
+    def _rotate_wal(self):
+        """現在の WAL を .prev へ退避（スナップショット完了まで保持）。"""
+        if self._wal is not None:
+            self._sync(self._wal)
+            self._wal.close()
+            self._wal = None
+        if not os.path.exists(self.wal_path):
+            return
+        if os.path.exists(self.prev_wal_path):
+            # 前回のスナップショットが未完了: .prev に連結して保持
+            with open(self.wal_path, "r", encoding="utf-8") as src, open(self.prev_wal_path, "a", encoding="utf-8") as dst:
+                dst.write(src.read())
+            os.remove(self.wal_path)
+        else:
+            os.replace(self.wal_path, self.prev_wal_path)
+
+    def snapshot(self, dump_state=None):
+        """全状態を書き出して WAL をコンパクション。直列化のみ状態ロック内、ファイル書き込みは状態ロック外。"""
+        dump_state = dump_state or self._dump_state
+        if dump_state is None:
+            return False
+        with self._snapshot_lock:
+            with self.lock:
+                data = dict(dump_state())
+                data["wal_seq"] = self.seq
+                data["state_id"] = self.state_id
+                text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+                self._rotate_wal()
+                self._pending = 0
+            # 一時ファイルは同じディレクトリに一意な名前で作る（os.replace を同一ファイルシステム内に保つ）
+            directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+            fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(self.snapshot_path)}.", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            if os.path.exists(self.prev_wal_path):
+                os.remove(self.prev_wal_path)
+        return True
+
+    # --- バックグラウンド・コンパクション ---
+    def start(self, dump_state):
+        """snapshot_interval 秒ごと、または snapshot_every 件ごとにスナップショットを取る。"""
+        self._dump_state = dump_state
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="axiom-snapshot", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        last = time.monotonic()
+        while not self._stopped.is_set():
+            self._wake.wait(timeout=self.snapshot_interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            due = self._pending >= self.snapshot_every or (time.monotonic() - last) >= self.snapshot_interval
+            if self._pending and due:
+                try:
+                    self.snapshot()
+                    print(f"💾 [Snapshot] Compacted at seq {self.seq}")
+                except Exception as e:
+                    print(f"⚠️ Snapshot Error: {e}")
+                last = time.monotonic()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
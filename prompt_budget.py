@@ -0,0 +1,112 @@
+"""
+Prompt Budget - トークン予算内でプロンプトの各セクションを優先度順に詰める。
+セクションは追加した順（= 優先度順）に、各セクション内も渡した順に 1 件ずつ入れ、予算を超える要素は捨てる。
+先に採用したセクションと同じ内容（URL または内容ハッシュが同じ）の要素は後のセクションから除く。
+トークン数は metrics.estimate_tokens（ASCII 約 4 文字 = 1、その他 1 文字 = 1）の概算。
+FragmentCache は要素ごとのシリアライズ結果（JSON 文字列・トークン数・重複判定キー）をカテゴリの版ごとに使い回す。
+"""
+import json
+from collections import namedtuple
+
+from knowledge_store import row_hash
+from metrics import estimate_tokens
+
+_URL_FIELDS = ("url", "link", "webViewLink", "web_view_link")
+
+
+def dedupe_key(item):
+    """重複判定のキー。URL を持つ資料は URL、それ以外は内容ハッシュ。"""
+    if isinstance(item, dict):
+        for field in _URL_FIELDS:
+            if item.get(field):
+                return ("url", str(item[field]).strip())
+    return ("hash", row_hash(item))
+
+
+def item_tokens(item, estimate=estimate_tokens):
+    text = item if isinstance(item, str) else json.dumps(item, ensure_ascii=False, separators=(",", ":"))
+    return estimate(text) + 1  # 区切り文字の分
+
+
+Fragment = namedtuple("Fragment", "text tokens key")
+
+
+class FragmentCache:
+    """
+    get(category, key, version, value) -> Fragment(text=json.dumps(value), tokens, key=dedupe_key)
+    カテゴリの版（ingest ごとに上がる）が変わったら、そのカテゴリの断片はまとめて捨てて使われた分だけ作り直す。
+    ident: 重複判定に使う値（既定は value そのもの）
+    """
+    def __init__(self, estimate=estimate_tokens):
+        self.estimate = estimate
+        self._categories = {}  # category -> (version, {key: Fragment})
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, category, key, version, value, ident=None):
+        cached = self._categories.get(category)
+        if cached is None or cached[0] != version:
+            cached = (version, {})
+            self._categories[category] = cached
+        fragment = cached[1].get(key)
+        if fragment is not None:
+            self.hits += 1
+            return fragment
+        self.misses += 1
+        ident = value if ident is None else ident
+        fragment = Fragment(json.dumps(value, ensure_ascii=False), item_tokens(ident, self.estimate), dedupe_key(ident))
+        cached[1][key] = fragment
+        return fragment
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "fragments": sum(len(frags) for _v, frags in list(self._categories.values()))}
+
+
+class PromptBudget:
+    """
+    budget = PromptBudget(6000)
+    budget.add("protocols", items, max_tokens=1500)  # 先に add したセクションほど優先
+    packed, breakdown = budget.pack()
+    packed: {name: [採用した要素]}、breakdown: {name: {"tokens", "items", "dropped", "duplicates"}}
+    value: 要素から重複判定・トークン計算の対象を取り出す関数（(category, key, record) の record だけを見る等）
+    measure: 要素 -> (重複判定キー, トークン数)。FragmentCache で計算済みの要素に使う（value より優先）
+    """
+    def __init__(self, max_tokens, estimate=estimate_tokens):
+        self.max_tokens = max_tokens
+        self.estimate = estimate
+        self._sections = []
+
+    def add(self, name, items, max_tokens=None, value=None, measure=None):
+        if measure is None:
+            value = value or (lambda x: x)
+            measure = lambda item: (dedupe_key(value(item)), None)  # トークン数は重複でないときだけ計算する
+        self._sections.append((name, list(items), max_tokens, value, measure))
+        return self
+
+    def pack(self, seen=None):
+        """seen: 他のプロンプト部分で既に載せた要素の dedupe_key 集合（重複除去の対象に含める）。"""
+        remaining = self.max_tokens
+        seen = set(seen or ())
+        packed, breakdown = {}, {}
+        for name, items, cap, value, measure in self._sections:
+            section_left = remaining if cap is None else min(cap, remaining)
+            kept, used, dropped, dups = [], 0, 0, 0
+            for item in items:
+                key, cost = measure(item)
+                if key in seen:
+                    dups += 1
+                    continue
+                if cost is None:
+                    cost = item_tokens(value(item), self.estimate)
+                if cost > section_left - used:
+                    dropped += 1
+                    continue
+                seen.add(key)
+                kept.append(item)
+                used += cost
+            remaining -= used
+            packed[name] = kept
+            breakdown[name] = {"tokens": used, "items": len(kept), "dropped": dropped, "duplicates": dups}
+        self.seen = seen
+        return packed, breakdown
@@ -0,0 +1,189 @@
+"""
+Protocol Store - EXTRACTED_PROTOCOLS（logic_extraction の蓄積）の重複排除と選択。
+本文を正規化（NFKC・小文字化・空白と句読点の除去）し、文字 3-gram の MinHash + LSH で近似重複を検出する。
+近似重複とみなすのは類似度が高く（既定 0.9）、かつ数値・否定表現・固有名（カタカナ / 英字の語）が一致する場合のみ
+（「30日前」と「60日前」、「する」と「しない」、「ドコモ光」と「So-net光」は別のプロトコル）。
+重複は 1 件にまとめて出現回数（count）と最終出現時刻（last_seen）を更新し、本文は最新のものに置き換える。
+プロンプトには入力との関連度（BM25）× 出現頻度の高い順に載せる。
+"""
+import hashlib
+import math
+import random
+import re
+import unicodedata
+
+from knowledge_index import KnowledgeIndex
+
+_NOISE = re.compile(r"[\s\W_]+")
+# 文意を左右する語: 数値・英字の語・カタカナ語（正規化後の本文から取る）
+_FACT_TOKENS = re.compile(r"[0-9]+|[a-z][a-z0-9]*|[ァ-ヴー]{2,}")
+_NEGATIONS = ("ない", "なし", "ません", "ず", "禁止", "不可", "不要", "無効", "以外", "ng")
+_MERSENNE = (1 << 61) - 1
+
+
+def normalize_text(text):
+    """全角/半角・大文字/小文字・空白・句読点の違いを吸収した比較用の文字列。"""
+    return _NOISE.sub("", unicodedata.normalize("NFKC", str(text or "")).lower())
+
+
+def key_facts(norm):
+    """数値・固有名・否定表現の集合。これが異なる 2 つのプロトコルは類似度にかかわらずまとめない。"""
+    facts = set(_FACT_TOKENS.findall(norm))
+    facts.update("neg:" + n for n in _NEGATIONS if n in norm)
+    return frozenset(facts)
+
+
+def _shingles(norm, size=3):
+    if len(norm) <= size:
+        return {norm}
+    return {norm[i:i + size] for i in range(len(norm) - size + 1)}
+
+
+class ProtocolStore:
+    """
+    - entries: 保持しているプロトコル（id は 1 始まりの連番 = 位置 + 1）。EXTRACTED_PROTOCOLS としてそのまま公開する
+    - find(logic): 近似重複（推定 Jaccard 類似度 >= threshold かつ key_facts が一致）の既存エントリ、なければ None
+    - append(entry) / touch(id, timestamp, logic=...): 新規追加 / 重複の出現を記録し本文を最新に置き換える
+      （WAL の protocol / protocol_seen に対応）
+    - restore(entries): スナップショットから復元。compact=True なら旧形式の重複をまとめて採番し直す
+    - select(query, k): プロンプト用に関連度と頻度で k 件を選ぶ
+    compact=False は id が外部（SQLite の行 id）で決まる場合。重複をまとめず、渡された id をそのまま使う。
+    """
+    def __init__(self, threshold=0.9, num_perm=64, bands=16, compact=True):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.compact = compact
+        self.bands = bands
+        self.rows = num_perm // bands
+        # 乱数は固定シード（WAL 再生・複数プロセスで同じ署名になるように）
+        rng = random.Random(20240601)
+        self._perms = [(rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE)) for _ in range(num_perm)]
+        self.entries = []
+        self._signatures = {}  # id -> MinHash 署名
+        self._facts = {}       # id -> key_facts
+        self._exact = {}       # 正規化後の本文 -> id
+        self._buckets = {}     # (band, 署名の一部) -> [id, ...]
+        self._search = KnowledgeIndex()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _signature(self, norm):
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+                  for s in _shingles(norm)]
+        return tuple(min((a * h + b) % _MERSENNE for h in hashes) for a, b in self._perms)
+
+    def _band_keys(self, signature):
+        r = self.rows
+        return [(i, signature[i * r:(i + 1) * r]) for i in range(self.bands)]
+
+    def get(self, entry_id):
+        if isinstance(entry_id, int) and 0 < entry_id <= len(self.entries):
+            return self.entries[entry_id - 1]
+        return None
+
+    def find(self, logic):
+        norm = normalize_text(logic)
+        if not norm:
+            return None
+        if norm in self._exact:
+            return self.get(self._exact[norm])
+        signature, facts = self._signature(norm), key_facts(norm)
+        best, best_sim = None, self.threshold
+        seen = set()
+        for key in self._band_keys(signature):
+            for entry_id in self._buckets.get(key, ()):
+                if entry_id in seen:
+                    continue
+                seen.add(entry_id)
+                if self._facts.get(entry_id) != facts:
+                    continue
+                other = self._signatures[entry_id]
+                sim = sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+                if sim >= best_sim:
+                    best, best_sim = entry_id, sim
+        return self.get(best) if best is not None else None
+
+    def _index(self, entry):
+        norm = normalize_text(entry.get("logic"))
+        signature = self._signature(norm)
+        self._signatures[entry["id"]] = signature
+        self._facts[entry["id"]] = key_facts(norm)
+        self._exact.setdefault(norm, entry["id"])
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(entry["id"])
+        self._search.upsert("protocols", entry["id"], entry.get("logic", ""))
+
+    def _unindex(self, entry):
+        norm = normalize_text(entry.get("logic"))
+        if self._exact.get(norm) == entry["id"]:
+            del self._exact[norm]
+        for key in self._band_keys(self._signatures.pop(entry["id"])):
+            bucket = self._buckets.get(key)
+            if bucket and entry["id"] in bucket:
+                bucket.remove(entry["id"])
+        self._facts.pop(entry["id"], None)
+
+    def append(self, entry):
+        if self.compact or "id" not in entry:
+            # 位置で採番（まとめる前の旧 WAL レコードが持つ id は使わない）
+            entry["id"] = len(self.entries) + 1
+        entry.setdefault("count", 1)
+        entry.setdefault("last_seen", entry.get("timestamp"))
+        self.entries.append(entry)
+        self._index(entry)
+        return entry
+
+    def touch(self, entry_id, timestamp=None, count=1, logic=None):
+        """出現を記録する。logic があれば本文を最新の表現に置き換えて索引し直す。"""
+        entry = self.get(entry_id)
+        if entry is None:
+            return None
+        entry["count"] = entry.get("count", 1) + count
+        if timestamp and str(timestamp) > str(entry.get("last_seen") or ""):
+            entry["last_seen"] = timestamp
+        if logic and logic != entry.get("logic"):
+            self._unindex(entry)
+            entry["logic"] = logic
+            self._index(entry)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self._signatures.clear()
+        self._facts.clear()
+        self._exact.clear()
+        self._buckets.clear()
+        self._search = KnowledgeIndex()
+
+    def restore(self, entries):
+        self.clear()
+        for entry in entries:
+            entry = dict(entry)
+            if self.compact:
+                match = self.find(entry.get("logic"))
+                if match is not None:
+                    self.touch(match["id"], entry.get("last_seen") or entry.get("timestamp"), entry.get("count", 1),
+                               logic=entry.get("logic"))
+                    continue
+            self.append(entry)
+
+    def _weight(self, entry):
+        return 1 + math.log(entry.get("count", 1))
+
+    def select(self, query, k=15):
+        """入力と関連するものを関連度 × (1 + log 出現回数) の順に。足りない分は出現回数・新しさの順で補う。"""
+        picked = []
+        for _cat, entry_id, score in self._search.search(query, k=k * 3):
+            entry = self.get(entry_id)
+            if entry is not None:
+                picked.append((score * self._weight(entry), entry))
+        picked.sort(key=lambda x: x[0], reverse=True)
+        result = [e for _s, e in picked[:k]]
+        if len(result) < k:
+            chosen = {e["id"] for e in result}
+            rest = sorted((e for e in self.entries if e["id"] not in chosen),
+                          key=lambda e: (e.get("count", 1), str(e.get("last_seen") or "")), reverse=True)
+            result.extend(rest[:k - len(result)])
+        return result
@@ -1,49 +1,95 @@
+import argparse
+import os
+
 import pandas as pd
 import requests
-import os
-import json
+
+from knowledge_store import row_hash
 
 # Axiom OS のエンドポイント
-INGEST_URL = "http://localhost:5000/api/ingest"
+API_BASE = os.getenv("AXIOM_API_BASE", "http://localhost:5000/api")
+INGEST_URL = f"{API_BASE}/ingest"
+CHUNK_ROWS = 200
+
+
+def _session():
+    session = requests.Session()
+    token = os.getenv("AXIOM_TOKEN")
+    if token:
+        session.headers["Authorization"] = f"Bearer {token}"
+    return session
+
 
-def seed_agency_data():
+def iter_agency_chunks(csv_file, chunk_rows=CHUNK_ROWS):
     """
-    『光回線代理店情報.csv』を読み込み、Axiom OS のナレッジベースへ同期します。
+    CSV を chunk_rows 行ずつ読み、{企業名: 行} の辞書を順に返す（全体をメモリに載せない）。
+    値はすべて文字列で読む（チャンクごとの型推論の揺れで、内容が同じ行のハッシュが変わらないように）。
     """
-    # ファイル名は実際のパスに合わせて調整してください
-    csv_file = "サポートチーム代理店管理 - 光回線代理店情報.csv"
+    # 同じ企業名が複数行ある場合は従来どおり最後の行を採用する。企業名の列だけ先に読み、採用する行番号を決めておく
+    # （チャンクをまたぐ重複で、毎回前の行 → 後の行と二度書きされないように）
+    names = pd.read_csv(csv_file, skiprows=[1], usecols=["企業名"], dtype=str)["企業名"].fillna("").str.strip()
+    keep = (names != "") & ~names.duplicated(keep="last")
 
+    # 2 行目の【入力必須】行をスキップ
+    reader = pd.read_csv(csv_file, skiprows=[1], chunksize=chunk_rows, dtype=str)
+    for chunk in reader:
+        chunk = chunk[keep.loc[chunk.index].to_numpy()]
+        # NaN → None（JSON の null）を列単位でまとめて変換
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        yield dict(zip(names.loc[chunk.index], chunk.to_dict("records")))
+
+
+def seed_agency_data(csv_file="サポートチーム代理店管理 - 光回線代理店情報.csv", chunk_rows=CHUNK_ROWS,
+                     full=False, prune=False):
+    """
+    『光回線代理店情報.csv』を読み込み、Axiom OS のナレッジベースへ差分同期します。
+    サーバーの行ハッシュ（/api/ingest/hashes）と比べて変わった行だけを /api/ingest/upsert へ送る。
+    full=True ならハッシュを見ずに全行を送り（サーバー側でも未変更行は書き込まない）、
+    prune=True なら CSV から消えた代理店をサーバーからも削除する。
+    """
     if not os.path.exists(csv_file):
         print(f"❌ Error: {csv_file} が見つかりません。プロジェクトルートに配置してください。")
         return
 
+    session = _session()
     try:
-        # CSV読み込み (2行目の【入力必須】行をスキップ)
-        df = pd.read_csv(csv_file, skiprows=[1])
-
-        # 企業名をキーにした辞書構造へ変換
-        agency_data = {}
-        for _, row in df.iterrows():
-            name = str(row.get('企業名', '')).strip()
-            if name and name != 'nan':
-                # NaN値をNone(JSONのnull)に変換してクリーンにする
-                agency_data[name] = row.where(pd.notnull(row), None).to_dict()
-
-        # Axiom OS へ送信
-        payload = {
-            "category": "agencies",
-            "payload": agency_data
-        }
-
-        response = requests.post(INGEST_URL, json=payload)
-
-        if response.status_code == 200:
-            print(f"✅ 成功: {len(agency_data)} 社の代理店コンテキストを Axiom OS に同期しました。")
-        else:
-            print(f"❌ 失敗: ステータスコード {response.status_code} - {response.text}")
+        remote = {}
+        if not full:
+            res = session.get(f"{INGEST_URL}/hashes", params={"category": "agencies"}, timeout=30)
+            res.raise_for_status()
+            remote = res.json().get("hashes", {})
+
+        seen, totals = set(), {"rows": 0, "sent": 0, "changed": 0}
+        for i, agencies in enumerate(iter_agency_chunks(csv_file, chunk_rows), 1):
+            seen.update(agencies)
+            changed = {name: row for name, row in agencies.items() if remote.get(name) != row_hash(row)}
+            totals["rows"] += len(agencies)
+            if changed:
+                res = session.post(f"{INGEST_URL}/upsert", json={"category": "agencies", "rows": changed}, timeout=60)
+                res.raise_for_status()
+                totals["sent"] += len(changed)
+                totals["changed"] += res.json().get("changed", 0)
+            print(f"📦 Chunk {i}: {len(agencies)} 社中 {len(changed)} 社を送信（累計 {totals['rows']} 社）")
+
+        deleted = 0
+        if prune:
+            stale = sorted(set(remote) - seen)
+            if stale:
+                res = session.post(f"{INGEST_URL}/upsert", json={"category": "agencies", "delete": stale}, timeout=60)
+                res.raise_for_status()
+                deleted = res.json().get("deleted", 0)
+
+        print(f"✅ 成功: {totals['rows']} 社を確認し、{totals['changed']} 社を更新、{deleted} 社を削除しました"
+              f"（送信 {totals['sent']} 社）。")
 
     except Exception as e:
         print(f"❌ 実行エラー: {e}")
 
 if __name__ == "__main__":
-    seed_agency_data()
+    parser = argparse.ArgumentParser(description="代理店 CSV を Axiom OS へ差分同期")
+    parser.add_argument("csv_file", nargs="?", default="サポートチーム代理店管理 - 光回線代理店情報.csv")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--full", action="store_true", help="ハッシュ比較をせず全行を送る")
+    parser.add_argument("--prune", action="store_true", help="CSV にない代理店をサーバーから削除する")
+    args = parser.parse_args()
+    seed_agency_data(args.csv_file, chunk_rows=args.chunk_rows, full=args.full, prune=args.prune)
@@ -1,7 +1,7 @@
-import requests
-import time
 from datetime import datetime
 
+from axiom_client import AxiomClient
+
 # Axiom OS Core Endpoint
 # このエージェントは脳（Server）に対して「実行結果」を報告します
 API_URL = "http://localhost:5000/api/logs"
@@ -29,20 +29,23 @@ def simulate_automated_task():
         "body": mock_batch_data
     }
 
-    try:
-        # 脳へ報告
-        res = requests.post(API_URL, json=payload)
-
-        if res.status_code == 200:
-            decision = res.json().get('decision', {})
-            # 脳がこの「実行」を公理に基づいてどう評価したかを表示（Axiom 4：リードタイム等の判定）
-            print(f"🧠 [Brain Feedback]: {decision['autonomous_action']['instruction']}")
-            print(f"📊 Reasoning: {decision['autonomous_action']['reasoning']}")
-        else:
-            print(f"❌ サーバーエラー: ステータスコード {res.status_code}")
-
-    except Exception as e:
-        print(f"❌ 接続エラー（サーバーが起動しているか確認してください）: {e}")
+    # 脳へ報告（接続の再利用・指数バックオフ再送は AxiomClient が担う）
+    client = AxiomClient(API_URL, agent="sonet_auto_worker")
+    res = client.post(payload)
+
+    if res:
+        decision = res.get('decision', {})
+        # 脳がこの「実行」を公理に基づいてどう評価したかを表示（Axiom 4：リードタイム等の判定）
+        print(f"🧠 [Brain Feedback]: {decision['autonomous_action']['instruction']}")
+        print(f"📊 Reasoning: {decision['autonomous_action']['reasoning']}")
+    elif not client.last_post_reached:
+        # 一度もサーバーに届いていない: 報告自体はバッチ送信キューに残して後で再送する
+        client.send(payload)
+        print("❌ 接続エラー（サーバーが起動しているか確認してください）。報告は spool に退避しました。")
+    else:
+        # サーバーには届いた（504 や応答待ちのタイムアウト等）: 受理済みの可能性があるので再送しない（decision の二重登録を防ぐ）
+        print("❌ 判断結果を受け取れませんでした（報告は受理済みの可能性があるため再送しません）。")
+    client.close()
 
 if __name__ == "__main__":
     # 検証用のため、一度だけ実行して結果を報告します
@@ -0,0 +1,373 @@
+"""
+SQLite State Backend - 複数プロセス（gunicorn の複数ワーカー等）で共有できる状態ストア。
+PersistenceEngine と同じインターフェース（lock / seq / commit / load / snapshot / start / stop）を持ち、
+AXIOM_STATE_BACKEND=sqlite で差し替える。各プロセスはメモリ上の状態を持ったまま、
+他プロセスの変更を changes テーブルから取り込む（sync）。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from decision_index import INSERT_SQL as _INDEX_INSERT, SCHEMA as _INDEX_SCHEMA, index_row
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    data TEXT NOT NULL,
+    pid INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS decisions (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT,
+    user TEXT,
+    platform TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_decisions_user ON decisions (user);
+CREATE INDEX IF NOT EXISTS idx_decisions_timestamp ON decisions (timestamp);
+CREATE TABLE IF NOT EXISTS protocols (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT,
+    user TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS gaps (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_gaps_status ON gaps (status);
+CREATE TABLE IF NOT EXISTS context_entries (
+    category TEXT NOT NULL,
+    key TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (category, key)
+);
+CREATE INDEX IF NOT EXISTS idx_context_pos ON context_entries (category, pos);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# op → 採番に使うカウンタ（プロセス間で重複しない id を発行する）
+_ID_COUNTERS = {"decision": "decision", "protocol": "protocol", "gap": "gap"}
+# DRIVE_INDEX は置き換え型のカテゴリとして context_entries に保存する
+DRIVE_CATEGORY = "google_drive"
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class SqliteStateBackend:
+    """
+    - commit(op, data, apply, resolve): BEGIN IMMEDIATE（プロセス間の排他）内で他プロセスの変更を取り込み、
+      resolve(op, data) -> (op, data) で記録する差分を決め直し（取り込み後の状態を見る。例: プロトコルの重複判定）、
+      id を counters から採番 → changes と各テーブルへ書き込み → COMMIT の後に apply
+    - load(restore, apply): テーブルから状態を組み立てて restore（decision は直近 hot_decisions 件のみ。古いものは
+      get_decision / iter_decisions で必要時に読む）。以後 sync() は apply で差分を取り込む
+    - decision の二次索引（decision_index テーブル）は decisions と同じトランザクションで書く
+    - sync(): 自プロセスより新しい changes を適用。剪定で取りこぼした場合は全量を読み直し on_reload() を呼ぶ
+    - snapshot(): changes の古いレコードを剪定し WAL をチェックポイント（全状態の書き出しは不要）
+    - state_id: DB ごとの識別子（counters に保存。全プロセスで同じ値）
+    """
+    shared = True
+
+    def __init__(self, db_path, changes_keep=20000, sync_interval=1.0, snapshot_interval=60.0, fsync=True,
+                 on_reload=None, hot_decisions=2000):
+        self.db_path = db_path
+        self.changes_keep = max(100, int(changes_keep))
+        self.sync_interval = float(sync_interval)
+        self.snapshot_interval = float(snapshot_interval)
+        self.on_reload = on_reload
+        self.hot_decisions = max(1, int(hot_decisions))
+        self.lock = threading.RLock()
+        self.seq = 0
+        self._restore = None
+        self._apply = None
+        self._stopped = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self._conn.executescript(_SCHEMA)
+        self._conn.executescript(_INDEX_SCHEMA)
+        # DB の識別子（作り直すと seq が巻き戻るので、ETag などでは seq と組にして使う）
+        self._conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('state_id', abs(random()))")
+        self.state_id = format(self._conn.execute("SELECT value FROM counters WHERE name = 'state_id'").fetchone()[0], "x")
+        # decision の遅延読み込みは状態ロックを取らない別接続で行う（TieredDecisionStore のロックとの順序逆転を避ける）
+        self._reader = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._read_lock = threading.Lock()
+
+    # --- トランザクション ---
+    def _begin(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def _end(self, ok):
+        self._conn.execute("COMMIT" if ok else "ROLLBACK")
+
+    def _next_id(self, name):
+        self._conn.execute("INSERT INTO counters (name, value) VALUES (?, 1) "
+                           "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+        return self._conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+
+    def _set_counter(self, name, value):
+        self._conn.execute("INSERT INTO counters (name, value) VALUES (?, ?) "
+                           "ON CONFLICT(name) DO UPDATE SET value = excluded.value", (name, value))
+
+    # --- 差分の書き込み ---
+    def commit(self, op, data, apply, resolve=None):
+        with self.lock:
+            self._begin()
+            try:
+                self._catch_up()
+                if resolve:
+                    op, data = resolve(op, data)
+                counter = _ID_COUNTERS.get(op)
+                if counter:
+                    data["id"] = self._next_id(counter)
+                cur = self._conn.execute("INSERT INTO changes (op, data, pid) VALUES (?, ?, ?)",
+                                         (op, _dumps(data), os.getpid()))
+                self._materialize(op, data)
+                self._end(True)
+            except Exception:
+                self._end(False)
+                raise
+            # メモリへの適用は DB の確定後（巻き戻った変更をメモリに残さない）。適用に失敗したら seq を進めず、
+            # 次の sync で changes から取り込み直す
+            result = apply(op, data)
+            self.seq = cur.lastrowid
+            return result
+
+    def _materialize(self, op, data):
+        if op == "decision":
+            meta = data.get("meta") or {}
+            self._conn.execute("INSERT OR REPLACE INTO decisions (id, timestamp, user, platform, data) VALUES (?, ?, ?, ?, ?)",
+                               (data["id"], data.get("timestamp"), meta.get("user"), meta.get("platform"), _dumps(data)))
+            self._conn.execute(_INDEX_INSERT, index_row(data["id"] - 1, data))
+        elif op == "protocol":
+            self._conn.execute("INSERT OR REPLACE INTO protocols (id, timestamp, user, data) VALUES (?, ?, ?, ?)",
+                               (data["id"], data.get("timestamp"), data.get("user"), _dumps(data)))
+        elif op == "protocol_seen":
+            self._conn.execute(
+                "UPDATE protocols SET data = json_set(data, '$.count', COALESCE(json_extract(data, '$.count'), 1) + 1, "
+                "'$.last_seen', CASE WHEN ? > COALESCE(json_extract(data, '$.last_seen'), '') THEN ? "
+                "ELSE json_extract(data, '$.last_seen') END, "
+                "'$.logic', COALESCE(?, json_extract(data, '$.logic'))) WHERE id = ?",
+                (data.get("timestamp"), data.get("timestamp"), data.get("logic"), data.get("id")))
+        elif op == "gap":
+            self._conn.execute("INSERT OR REPLACE INTO gaps (id, timestamp, status, data) VALUES (?, ?, ?, ?)",
+                               (data["id"], data.get("timestamp"), data.get("status"), _dumps(data)))
+        elif op == "exec":
+            self._next_id("exec")
+        elif op == "ingest":
+            self._write_context(data.get("category", "metadata"), data.get("payload", {}))
+        elif op == "unset":
+            self._conn.executemany("DELETE FROM context_entries WHERE category = ? AND key = ? AND kind = 'dict'",
+                                   [(data.get("category"), str(k)) for k in data.get("keys", [])])
+
+    def _write_context(self, category, payload):
+        """_merge_ingest と同じ意味論（dict は key 単位で上書き、list は追記、それ以外は置き換え）。"""
+        rows = self._conn.execute("SELECT kind, MAX(pos) FROM context_entries WHERE category = ? GROUP BY kind",
+                                  (category,)).fetchall()
+        kinds = {r[0] for r in rows}
+        if category == DRIVE_CATEGORY and not isinstance(payload, list):
+            payload = [payload]
+        next_pos = max((r[1] for r in rows), default=-1) + 1
+        if category == DRIVE_CATEGORY or not isinstance(payload, (dict, list)):
+            self._conn.execute("DELETE FROM context_entries WHERE category = ?", (category,))
+            next_pos = 0
+        if isinstance(payload, dict):
+            for key, value in payload.items():
+                self._conn.execute(
+                    "INSERT INTO context_entries (category, key, pos, kind, value) VALUES (?, ?, ?, 'dict', ?) "
+                    "ON CONFLICT(category, key) DO UPDATE SET value = excluded.value",
+                    (category, str(key), next_pos, _dumps(value)))
+                next_pos += 1
+        elif isinstance(payload, list):
+            if kinds - {"list"} and category != DRIVE_CATEGORY:
+                self._conn.execute("DELETE FROM context_entries WHERE category = ?", (category,))
+                next_pos = 0
+            self._conn.executemany(
+                "INSERT INTO context_entries (category, key, pos, kind, value) VALUES (?, ?, ?, 'list', ?)",
+                [(category, f"#{next_pos + i}", next_pos + i, _dumps(v)) for i, v in enumerate(payload)])
+        else:
+            self._conn.execute("INSERT INTO context_entries (category, key, pos, kind, value) VALUES (?, '', 0, 'scalar', ?)",
+                               (category, _dumps(payload)))
+
+    # --- 読み込み・同期 ---
+    def _read_state(self):
+        context, drive_index = {}, []
+        for category, key, kind, value in self._conn.execute(
+                "SELECT category, key, kind, value FROM context_entries ORDER BY category, pos"):
+            value = json.loads(value)
+            if category == DRIVE_CATEGORY:
+                drive_index.append(value)
+            elif kind == "dict":
+                context.setdefault(category, {})[key] = value
+            elif kind == "list":
+                context.setdefault(category, []).append(value)
+            else:
+                context[category] = value
+        counters = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+        # decision は直近 hot_decisions 件だけ（それより前は logs_start 未満の位置としてコールド層から読む）
+        logs_start = max(0, self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM decisions").fetchone()[0] - self.hot_decisions)
+        return {
+            "context": context,
+            "logs_start": logs_start,
+            "logs": [json.loads(r[0]) for r in self._conn.execute("SELECT data FROM decisions WHERE id > ? ORDER BY id",
+                                                                  (logs_start,))],
+            "protocols": [json.loads(r[0]) for r in self._conn.execute("SELECT data FROM protocols ORDER BY id")],
+            "gaps": [json.loads(r[0]) for r in self._conn.execute("SELECT data FROM gaps ORDER BY id")],
+            "drive_index": drive_index,
+            "exec_count": counters.get("exec", 0),
+        }
+
+    def _backfill_index(self):
+        """索引テーブル導入前の DB: 索引のない decision を 1 回だけ索引へ入れる。"""
+        indexed = self._conn.execute("SELECT COALESCE(MAX(pos) + 1, 0) FROM decision_index").fetchone()[0]
+        rows = self._conn.execute("SELECT id, data FROM decisions WHERE id > ? ORDER BY id", (indexed,))
+        while True:
+            batch = rows.fetchmany(5000)
+            if not batch:
+                break
+            self._conn.executemany(_INDEX_INSERT, [index_row(i - 1, json.loads(d)) for i, d in batch])
+
+    def _max_seq(self):
+        return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def load(self, restore, apply):
+        """テーブルから状態を復元する（WAL 再生は不要なので戻り値は常に 0）。"""
+        with self.lock:
+            self._restore, self._apply = restore, apply
+            self._begin()
+            try:
+                self._backfill_index()
+                data = self._read_state()
+                seq = self._max_seq()
+            finally:
+                self._conn.execute("COMMIT")
+            restore(data)
+            self.seq = seq
+            return 0
+
+    def _catch_up(self):
+        """自プロセスの seq より新しい changes を適用する。取り込んだ件数を返す。"""
+        if self._apply is None:
+            return 0
+        oldest = self._conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+        if oldest is not None and oldest > self.seq + 1 and self._max_seq() > self.seq:
+            # 剪定済みの範囲を取りこぼした: 全量を読み直す
+            self._restore(self._read_state())
+            self.seq = self._max_seq()
+            if self.on_reload:
+                self.on_reload()
+            return -1
+        applied = 0
+        for seq, op, data in self._conn.execute("SELECT seq, op, data FROM changes WHERE seq > ? ORDER BY seq",
+                                                (self.seq,)).fetchall():
+            # 適用に失敗したレコードは次の sync で取り込み直す（先に seq を進めると取りこぼす）
+            self._apply(op, json.loads(data))
+            self.seq = seq
+            applied += 1
+        return applied
+
+    def sync(self):
+        with self.lock:
+            if self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0] <= self.seq:
+                return 0
+            self._conn.execute("BEGIN")
+            try:
+                return self._catch_up()
+            finally:
+                self._conn.execute("COMMIT")
+
+    # --- decision の遅延読み込み（TieredDecisionStore のコールド層。id = 位置 + 1） ---
+    def get_decision(self, pos):
+        with self._read_lock:
+            row = self._reader.execute("SELECT data FROM decisions WHERE id = ?", (pos + 1,)).fetchone()
+        if row is None:
+            raise IndexError(f"decision {pos + 1} not found")
+        return row[0]
+
+    def iter_decisions(self, begin, end):
+        with self._read_lock:
+            rows = self._reader.execute("SELECT data FROM decisions WHERE id > ? AND id <= ? ORDER BY id", (begin, end)).fetchall()
+        return (r[0] for r in rows)
+
+    # --- 移行 ---
+    def is_empty(self):
+        with self.lock:
+            return self._max_seq() == 0 and not self._conn.execute(
+                "SELECT 1 FROM decisions UNION ALL SELECT 1 FROM context_entries LIMIT 1").fetchone()
+
+    def import_state(self, data):
+        """JSON スナップショット形式の状態を空の DB へ取り込む（他プロセスが先に取り込んでいれば何もしない）。"""
+        with self.lock:
+            self._begin()
+            try:
+                if self._conn.execute("SELECT 1 FROM decisions UNION ALL SELECT 1 FROM context_entries LIMIT 1").fetchone():
+                    self._end(True)
+                    return False
+                for category, value in (data.get("context") or {}).items():
+                    self._write_context(category, value)
+                if data.get("drive_index"):
+                    self._write_context(DRIVE_CATEGORY, data["drive_index"])
+                for op, key in (("decision", "logs"), ("protocol", "protocols"), ("gap", "gaps")):
+                    items = data.get(key) or []
+                    for i, item in enumerate(items):
+                        item.setdefault("id", i + 1)
+                        self._materialize(op, item)
+                    self._set_counter(op, max((it["id"] for it in items), default=0))
+                self._set_counter("exec", int(data.get("exec_count", 0)))
+                self._end(True)
+                return True
+            except Exception:
+                self._end(False)
+                raise
+
+    # --- PersistenceEngine 互換 ---
+    def snapshot(self, dump_state=None):
+        """changes を直近 changes_keep 件に剪定し、SQLite の WAL をチェックポイントする。"""
+        with self.lock:
+            self._conn.execute("DELETE FROM changes WHERE seq <= ?", (self._max_seq() - self.changes_keep,))
+        self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return True
+
+    def defer_sync(self):
+        return None
+
+    def end_defer(self, token):
+        pass
+
+    def flush(self):
+        pass
+
+    def start(self, dump_state=None):
+        """他プロセスの変更を sync_interval 秒ごとに取り込み（SSE 購読者へも配信される）、定期的に剪定する。"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="axiom-state-sync", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        last = time.monotonic()
+        while not self._stopped.wait(self.sync_interval):
+            try:
+                self.sync()
+                if time.monotonic() - last >= self.snapshot_interval:
+                    self.snapshot()
+                    last = time.monotonic()
+            except sqlite3.Error as e:
+                print(f"⚠️ [State] Sync Error: {e}")
+
+    def stop(self):
+        self._stopped.set()
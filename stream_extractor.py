@@ -0,0 +1,114 @@
+"""
+Stream Extractor - Gemini のストリーミング出力から action_instruction を逐次取り出す。
+モデルは ```json {...}``` 形式で返すため、JSON 文字列を部分的にデコードしながらトークンを流す。
+"""
+import re
+
+_KEY_PATTERN = re.compile(r'"(?:action_instruction|response)"\s*:\s*"')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+# deep_clean_text と同じ URL 隔離規則（§14: URL 末尾の記号をリンク範囲から切り離す）
+_URL_PATTERN = re.compile(r'(https?://\S+)')
+_URL_TRAILING = re.compile(r'[)）\]」』》。、,]+$')
+_URL_HEAD = "https://"
+
+
+class InstructionStreamExtractor:
+    """
+    feed(chunk) で生テキスト断片を受け取り、新たに確定した回答本文を返す。
+    - 先頭が { / ` なら JSON モード: "action_instruction": "..." の中身だけをデコードして返す
+    - それ以外はプレーンテキスト回答（出典タグ付き本文など）としてそのまま返す
+    """
+    def __init__(self):
+        self._buf = ""
+        self._mode = None  # None / "json" / "plain"
+        self._pos = None   # JSON 文字列の読み取り位置
+        self._done = False
+
+    def feed(self, chunk):
+        if self._done or not chunk:
+            return ""
+        self._buf += chunk
+        if self._mode is None:
+            head = self._buf.lstrip()
+            if not head:
+                return ""
+            self._mode = "json" if head[0] in "{`" else "plain"
+            if self._mode == "plain":
+                return self._buf
+        if self._mode == "plain":
+            return chunk
+        if self._pos is None:
+            m = _KEY_PATTERN.search(self._buf)
+            if not m:
+                return ""
+            self._pos = m.end()
+        return self._decode()
+
+    def _decode(self):
+        out = []
+        buf, i, n = self._buf, self._pos, len(self._buf)
+        while i < n:
+            ch = buf[i]
+            if ch == '"':
+                self._done = True
+                i += 1
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+            if i + 1 >= n:
+                break  # エスケープの途中: 次の断片を待つ
+            esc = buf[i + 1]
+            if esc == "u":
+                if i + 6 > n:
+                    break
+                try:
+                    out.append(chr(int(buf[i + 2:i + 6], 16)))
+                except ValueError:
+                    pass
+                i += 6
+            else:
+                out.append(_ESCAPES.get(esc, esc))
+                i += 2
+        self._pos = i
+        return "".join(out)
+
+
+def _isolate(text):
+    def url_isolate(match):
+        url = match.group(1)
+        clean_url = _URL_TRAILING.sub('', url)
+        trailing = url[len(clean_url):]
+        return f" {clean_url} {trailing} " if trailing else f" {clean_url} "
+    return _URL_PATTERN.sub(url_isolate, re.sub(r'\\+', ' ', text))
+
+
+class IncrementalUrlIsolator:
+    """
+    部分テキストに URL 隔離をかける。URL が途中で切れている可能性がある末尾
+    （最後の空白以降に http を含む部分、または "https://" の接頭辞で終わる部分）は次の断片まで保留する。
+    """
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, text):
+        if not text:
+            return ""
+        text = self._pending + text
+        cut = len(text)
+        tail_start = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t")) + 1
+        url_at = text.find("http", tail_start)
+        if url_at != -1:
+            cut = url_at
+        else:
+            for k in range(min(len(_URL_HEAD) - 1, len(text) - tail_start), 0, -1):
+                if text.endswith(_URL_HEAD[:k]):
+                    cut = len(text) - k
+                    break
+        self._pending = text[cut:]
+        return _isolate(text[:cut])
+
+    def flush(self):
+        text, self._pending = self._pending, ""
+        return _isolate(text) if text else ""
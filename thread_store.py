@@ -0,0 +1,138 @@
+"""
+Thread Store - parentId ごとのスレッド文脈をサーバー側で保持する。
+decision を記録するたびに（ユーザーの入力・Axiom の回答を）該当スレッドへ追記し、
+クライアントは thread_messages を毎回送らず parentId だけを送ればよい。
+スレッドごとに直近 max_messages 件のリングバッファ、溢れた分は冒頭メッセージ + 直近の要点のローリング要約に畳み込み、
+スレッド数が max_threads を超えたら最も長く使われていないスレッドから捨てる（LRU）。
+メモリにないスレッド（再起動後・LRU で捨てた後）は loader（decision 履歴から parentId のやり取りを引く）で組み立て直す。
+"""
+import threading
+from collections import OrderedDict, deque
+
+
+class _Thread:
+    __slots__ = ("messages", "opener", "digest", "folded", "rendered")
+
+    def __init__(self, max_messages, summary_lines):
+        self.messages = deque(maxlen=max_messages)  # (role, text)
+        self.opener = None  # スレッド最初のメッセージ（要約の先頭に常に残す）
+        self.digest = deque(maxlen=summary_lines)  # 溢れたメッセージの要点（新しいもの summary_lines 件）
+        self.folded = 0  # リングバッファから溢れた件数
+        self.rendered = None  # render() の結果（追記で無効化）
+
+
+class ThreadStore:
+    """
+    - add(parent_id, role, text): スレッドへ 1 件追記（text は message_chars 文字で切る）
+    - render(parent_id): プロンプト用の【スレッド文脈】（要約 + 直近メッセージ）。スレッドがなければ ""
+    - recent_texts(parent_id, n): 検索クエリ用の直近 n 件の本文
+    - seed(parent_id, messages): 未知のスレッドをクライアントが送った thread_messages で始める（既知なら何もしない）
+    loader(parent_id) はそのスレッドの [(role, text)]（古い順）を返す。add() の前に呼ばれるので、
+    追記しようとしている decision 自体は返さないこと（呼び出し側で索引へ入れる前に add する）。
+    """
+    def __init__(self, max_threads=5000, max_messages=10, message_chars=500, summary_lines=5, loader=None):
+        self.max_threads = max_threads
+        self.max_messages = max_messages
+        self.message_chars = message_chars
+        self.summary_lines = summary_lines
+        self.loader = loader
+        self._threads = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.loaded = 0
+
+    def __len__(self):
+        return len(self._threads)
+
+    def __contains__(self, parent_id):
+        if parent_id in (None, ""):
+            return False
+        with self._lock:
+            return self._get(str(parent_id), create=False) is not None
+
+    def _get(self, key, create):
+        thread = self._threads.get(key)
+        if thread is not None:
+            self._threads.move_to_end(key)
+            return thread
+        history = self.loader(key) if self.loader else None
+        if not create and not history:
+            return None
+        thread = _Thread(self.max_messages, self.summary_lines)
+        for role, text in history or ():
+            self._append(thread, role, text)
+        if history:
+            self.loaded += 1
+        self._threads[key] = thread
+        while len(self._threads) > self.max_threads:
+            self._threads.popitem(last=False)
+            self.evicted += 1
+        return thread
+
+    def _append(self, thread, role, text):
+        text = str(text or "").strip()[:self.message_chars]
+        if not text:
+            return
+        if thread.opener is None:
+            thread.opener = (role, text)
+        if len(thread.messages) == thread.messages.maxlen:
+            old_role, old_text = thread.messages[0]
+            thread.folded += 1
+            if thread.folded > 1:  # 最初に溢れるのは opener 自身
+                thread.digest.append(f"{old_role}: {' '.join(old_text.split())[:80]}")
+        thread.messages.append((role, text))
+        thread.rendered = None
+
+    def seed(self, parent_id, messages):
+        """messages: [(role, text)]。古い順。戻り値は新しく作ったかどうか。"""
+        if parent_id in (None, "") or not messages:
+            return False
+        with self._lock:
+            if self._get(str(parent_id), create=False) is not None:
+                return False
+            thread = self._get(str(parent_id), create=True)
+            for role, text in messages:
+                self._append(thread, role, text)
+            return True
+
+    def add(self, parent_id, role, text):
+        if parent_id in (None, ""):
+            return
+        key = str(parent_id)
+        with self._lock:
+            self._append(self._get(key, create=True), role, text)
+
+    def recent_texts(self, parent_id, n=3):
+        if parent_id in (None, ""):
+            return []
+        with self._lock:
+            thread = self._get(str(parent_id), create=False)
+            return [text for _role, text in list(thread.messages)[-n:]] if thread else []
+
+    def render(self, parent_id):
+        if parent_id in (None, ""):
+            return ""
+        with self._lock:
+            thread = self._get(str(parent_id), create=False)
+            if thread is None or not thread.messages:
+                return ""
+            if thread.rendered is None:
+                lines = ["【スレッド文脈】"]
+                if thread.folded:
+                    role, text = thread.opener
+                    lines.append(f"（これまでの要約）冒頭 {role}: {' '.join(text.split())[:160]}")
+                    skipped = thread.folded - 1 - len(thread.digest)
+                    if skipped > 0:
+                        lines.append(f"…（{skipped} 件省略）")
+                    lines.extend(thread.digest)
+                    lines.append("（直近のやり取り）")
+                lines.extend(f"{role}: {text}" for role, text in thread.messages)
+                thread.rendered = "\n".join(lines) + "\n\n"
+            return thread.rendered
+
+    def clear(self):
+        with self._lock:
+            self._threads.clear()
+
+    def stats(self):
+        return {"threads": len(self._threads), "evicted": self.evicted, "loaded": self.loaded}
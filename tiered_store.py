@@ -0,0 +1,253 @@
+"""
+Tiered Decision Store - decision 履歴をメモリ（直近 N 件）とディスク（それ以前）に分けて保持する。
+list と同じ読み方（len / [i] / [a:b] / 反復 / append）ができ、axiom_intelligence_storage をそのまま置き換える。
+ホット層は 1 件 = コンパクトな JSON bytes 1 個、コールド層はオフセット索引付きの JSONL セグメント。
+"""
+import json
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, deque
+
+
+def _encode(decision):
+    return json.dumps(decision, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _decode(blob):
+    return json.loads(blob)
+
+
+class SegmentColdTier:
+    """
+    dir_path/seg-<開始位置>.jsonl（1 行 1 件）と .idx（各行の開始オフセット、uint64 配列）。
+    segment_records 件ごとに新しいセグメントへ切り替える。参照時は .idx を LRU で数セグメント分だけ保持する。
+    """
+    def __init__(self, dir_path, segment_records=10000, cached_indexes=4):
+        self.dir_path = dir_path
+        self.segment_records = max(1, int(segment_records))
+        self.cached_indexes = max(1, int(cached_indexes))
+        os.makedirs(dir_path, exist_ok=True)
+        self._starts = sorted(int(n[4:-6]) for n in os.listdir(dir_path) if n.startswith("seg-") and n.endswith(".jsonl"))
+        self._idx_cache = OrderedDict()
+        self._writer = None  # (start, data_file, idx_file)
+        self.count = 0
+        if self._starts:
+            last = self._starts[-1]
+            self.count = last + len(self._offsets(last))
+
+    def _path(self, start, ext):
+        return os.path.join(self.dir_path, f"seg-{start:010d}.{ext}")
+
+    def _offsets(self, start):
+        offsets = self._idx_cache.get(start)
+        if offsets is None:
+            if self._writer and self._writer[0] == start:
+                self._writer[2].flush()
+            offsets = array("Q")
+            with open(self._path(start, "idx"), "rb") as f:
+                offsets.frombytes(f.read())
+            self._idx_cache[start] = offsets
+            while len(self._idx_cache) > self.cached_indexes:
+                self._idx_cache.popitem(last=False)
+        else:
+            self._idx_cache.move_to_end(start)
+        return offsets
+
+    def _close_writer(self):
+        if self._writer:
+            _, data_f, idx_f = self._writer
+            data_f.close()
+            idx_f.close()
+            self._writer = None
+
+    def append(self, blob):
+        if not self._starts or self.count - self._starts[-1] >= self.segment_records:
+            self._close_writer()
+            self._starts.append(self.count)
+            open(self._path(self.count, "jsonl"), "ab").close()
+            open(self._path(self.count, "idx"), "ab").close()
+        start = self._starts[-1]
+        if self._writer is None or self._writer[0] != start:
+            self._close_writer()
+            self._writer = (start, open(self._path(start, "jsonl"), "ab"), open(self._path(start, "idx"), "ab"))
+        _, data_f, idx_f = self._writer
+        offsets = self._offsets(start)  # idx へ書く前に読み込む（書いた後だと二重に載る）
+        offset = data_f.tell()
+        data_f.write(blob + b"\n")
+        idx_f.write(array("Q", [offset]).tobytes())
+        offsets.append(offset)
+        self.count += 1
+
+    def sync(self):
+        """スナップショット前に呼ぶ（ホット層から外れた分がディスクに確定していることを保証）。"""
+        if self._writer:
+            for f in self._writer[1:]:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def get(self, pos):
+        start = self._starts[bisect_right(self._starts, pos) - 1]
+        offset = self._offsets(start)[pos - start]
+        if self._writer and self._writer[0] == start:
+            self._writer[1].flush()
+        with open(self._path(start, "jsonl"), "rb") as f:
+            f.seek(offset)
+            return f.readline().rstrip(b"\n")
+
+    def iter_range(self, begin, end):
+        """位置 begin..end-1 を順に読む（セグメント単位の逐次読み込み）。"""
+        if self._writer:
+            self._writer[1].flush()
+        pos = begin
+        while pos < end:
+            i = bisect_right(self._starts, pos) - 1
+            start = self._starts[i]
+            stop = min(end, self._starts[i + 1] if i + 1 < len(self._starts) else self.count)
+            with open(self._path(start, "jsonl"), "rb") as f:
+                f.seek(self._offsets(start)[pos - start])
+                for _ in range(stop - pos):
+                    yield f.readline().rstrip(b"\n")
+            pos = stop
+
+    def truncate(self, count):
+        """count 件目以降を捨てる（スナップショットより後に書かれたセグメント末尾を巻き戻す）。"""
+        if count >= self.count:
+            return
+        self._close_writer()
+        self._idx_cache.clear()
+        while self._starts and self._starts[-1] >= count:
+            start = self._starts.pop()
+            os.remove(self._path(start, "jsonl"))
+            os.remove(self._path(start, "idx"))
+        if self._starts:
+            start = self._starts[-1]
+            keep = count - start
+            offsets = self._offsets(start)
+            if keep < len(offsets):
+                with open(self._path(start, "jsonl"), "r+b") as f:
+                    f.truncate(offsets[keep])
+                with open(self._path(start, "idx"), "r+b") as f:
+                    f.truncate(keep * offsets.itemsize)
+                del offsets[keep:]
+        self.count = count
+
+
+class ExternalColdTier:
+    """
+    古い decision が既に別の場所（共有 SQLite の decisions テーブル等）にある場合のコールド層。
+    append は件数を進めるだけで書き込まない。fetch(pos) / fetch_range(begin, end) で読み出す。
+    復元時は外部にある件数（スナップショットの開始位置）をそのまま count とする。
+    """
+    external = True
+
+    def __init__(self, fetch, fetch_range):
+        self._fetch = fetch
+        self._fetch_range = fetch_range
+        self.count = 0
+
+    def append(self, blob):
+        self.count += 1
+
+    def sync(self):
+        pass
+
+    def get(self, pos):
+        return self._fetch(pos)
+
+    def iter_range(self, begin, end):
+        return self._fetch_range(begin, end)
+
+    def truncate(self, count):
+        self.count = min(self.count, count)
+
+
+class TieredDecisionStore:
+    """
+    - append(decision): ホット層へ追加し、hot_size を超えた最古の 1 件をコールド層へ移す
+    - [i] / [a:b] / 反復: コールド層は必要な分だけ遅延読み込み（毎回デコードしたコピーを返す）
+    - hot_start / hot_items(): スナップショットにはホット層のみを書き、コールド層は件数（hot_start）で参照
+    - restore(start, decisions): スナップショット（位置 start からの decision 列）と既存のコールド層を突き合わせる
+    """
+    def __init__(self, hot_size, cold):
+        self.hot_size = max(1, int(hot_size))
+        self.cold = cold
+        self._hot = deque()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self.cold.count + len(self._hot)
+
+    @property
+    def hot_start(self):
+        return self.cold.count
+
+    def append(self, decision):
+        with self._lock:
+            self._hot.append(_encode(decision))
+            while len(self._hot) > self.hot_size:
+                self.cold.append(self._hot.popleft())
+
+    def extend(self, decisions):
+        for d in decisions:
+            self.append(d)
+
+    def clear(self):
+        with self._lock:
+            self._hot.clear()
+            self.cold.truncate(0)
+
+    def _blob(self, pos):
+        if pos >= self.cold.count:
+            return self._hot[pos - self.cold.count]
+        return self.cold.get(pos)
+
+    def __getitem__(self, key):
+        with self._lock:
+            n = len(self)
+            if isinstance(key, slice):
+                begin, end, step = key.indices(n)
+                if step != 1:
+                    return [self[i] for i in range(begin, end, step)]
+                return list(self._iter_range(begin, end))
+            if key < 0:
+                key += n
+            if not 0 <= key < n:
+                raise IndexError("decision index out of range")
+            return _decode(self._blob(key))
+
+    def _iter_range(self, begin, end):
+        boundary = self.cold.count
+        if begin < boundary:
+            for blob in self.cold.iter_range(begin, min(end, boundary)):
+                yield _decode(blob)
+        for i in range(max(begin, boundary), end):
+            yield _decode(self._hot[i - boundary])
+
+    def __iter__(self):
+        # 追記と並行しない場面（状態復元後の索引再構築など）向け
+        with self._lock:
+            n = len(self)
+        return self._iter_range(0, n)
+
+    def hot_items(self):
+        with self._lock:
+            return [_decode(b) for b in self._hot]
+
+    def sync(self):
+        with self._lock:
+            self.cold.sync()
+
+    def restore(self, start, decisions):
+        with self._lock:
+            self._hot.clear()
+            if self.cold.count < start and getattr(self.cold, "external", False):
+                self.cold.count = start
+            if self.cold.count < start:
+                print(f"⚠️ [Decisions] Cold segments end at {self.cold.count}, snapshot expects {start}")
+                start = self.cold.count
+            # スナップショット以降にコールド層へ移った分（sync 前で途中までしか書けていない可能性がある）は捨て、
+            # スナップショット側の内容で置き換える
+            self.cold.truncate(start)
+            self.extend(decisions)
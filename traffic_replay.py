@@ -0,0 +1,195 @@
+"""
+Traffic Replay - 本番の /api/logs・/api/ingest のペイロードを時刻付きで記録し、別のサーバーへ再送する。
+記録: サーバーを AXIOM_RECORD_FILE=traffic.jsonl.gz で起動（1 行 1 リクエストの JSON、.gz なら gzip）。
+再送: python traffic_replay.py traffic.jsonl.gz --base http://localhost:5000 --speed 10
+      --speed 1 で記録時と同じ間隔、N で N 倍速、0 で待ち時間なし（最速）。
+ingest は順序の境界として扱う（それまでの logs の完了を待ってから送り、完了後に次の logs を送る）。
+モデルは AXIOM_FAKE_GEMINI で起動したサーバーと組み合わせれば、朝の集中・CSV の一括再投入などの負荷の形を再現できる。
+"""
+import argparse
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# 記録対象（ingest 系は再送時に順序の境界になる）
+RECORDED_PATHS = ("/api/logs", "/api/logs/stream", "/api/logs/batch", "/api/ingest", "/api/ingest/upsert")
+BARRIER_PATHS = ("/api/ingest", "/api/ingest/upsert")
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class TrafficRecorder:
+    """
+    record(path, body) を JSONL（{"t": UNIX 秒, "path": ..., "body": ...}）で追記する。
+    認証ヘッダー等は記録しない。gzip の場合は close()（サーバー終了時）で末尾が確定する。
+    """
+    def __init__(self, path):
+        self.path = path
+        self._f = _open(path, "a")
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, path, body):
+        line = json.dumps({"t": round(time.time(), 3), "path": path, "body": body},
+                          ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._f is None:
+                return
+            self._f.write(line + "\n")
+            self._f.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+def load_recording(path):
+    """記録を時刻順に読む。壊れた行（書き込み途中で止まった末尾など）は読み飛ばす。"""
+    entries = []
+    with _open(path, "r") as f:
+        try:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("path") in RECORDED_PATHS:
+                    entries.append(entry)
+        except EOFError:
+            print(f"⚠️ [Replay] {path} ends mid-stream (recorder not closed), using {len(entries)} entries")
+    entries.sort(key=lambda e: e["t"])
+    return entries
+
+
+def _percentile_ms(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, min(len(values), int(round(q / 100 * len(values) + 0.5))))
+    return round(values[rank - 1] * 1000, 1)
+
+
+class ReplayDriver:
+    """
+    speed: 1 = 記録時と同じ間隔、N = N 倍速、0 = 間隔を無視して最速。
+    concurrency: 同時に送る logs の上限（ingest は常に単独で送る）。
+    """
+    def __init__(self, base_url, token=None, speed=1.0, concurrency=16, timeout=180):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.speed = speed
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+        self._local = threading.local()
+        self._headers = {"Content-Type": "application/json"}
+        if token:
+            self._headers["Authorization"] = f"Bearer {token}"
+        self._requests = requests
+        self._results = []
+        self._lock = threading.Lock()
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = self._requests.Session()
+            self._local.session.headers.update(self._headers)
+        return self._local.session
+
+    def _send(self, entry, lag):
+        path = entry["path"]
+        t0 = time.perf_counter()
+        try:
+            res = self._session().post(self.base_url + path, data=json.dumps(entry["body"], ensure_ascii=False).encode("utf-8"),
+                                       timeout=self.timeout, stream=path.endswith("/stream"))
+            if path.endswith("/stream"):
+                for _ in res.iter_content(chunk_size=None):
+                    pass
+            status = res.status_code
+        except Exception as e:
+            print(f"⚠️ [Replay] {path}: {e}")
+            status = 0
+        with self._lock:
+            self._results.append((path, status, time.perf_counter() - t0, lag))
+
+    def run(self, entries):
+        if not entries:
+            return self.report(0.0)
+        start_rec, start = entries[0]["t"], time.monotonic()
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for entry in entries:
+                if entry["path"] in BARRIER_PATHS and in_flight:
+                    wait(in_flight)
+                    in_flight.clear()
+                due = start + (entry["t"] - start_rec) / self.speed if self.speed > 0 else time.monotonic()
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                lag = max(0.0, -delay)
+                if entry["path"] in BARRIER_PATHS:
+                    self._send(entry, lag)
+                    continue
+                while len(in_flight) >= self.concurrency:
+                    done, _ = wait(in_flight, return_when="FIRST_COMPLETED")
+                    in_flight -= done
+                in_flight.add(pool.submit(self._send, entry, lag))
+            wait(in_flight)
+        return self.report(time.monotonic() - start)
+
+    def report(self, wall):
+        by_path = {}
+        for path in sorted({r[0] for r in self._results}):
+            rows = [r for r in self._results if r[0] == path]
+            statuses = {}
+            for r in rows:
+                statuses[str(r[1])] = statuses.get(str(r[1]), 0) + 1
+            latencies = [r[2] for r in rows if r[1] == 200]
+            by_path[path] = {"count": len(rows), "status": statuses,
+                             **{f"p{q}_ms": _percentile_ms(latencies, q) for q in (50, 95, 99)}}
+        lags = [r[3] for r in self._results]
+        return {"requests": len(self._results), "wall_sec": round(wall, 3), "speed": self.speed,
+                "throughput_rps": round(len(self._results) / wall, 2) if wall else None,
+                "schedule_lag_p95_ms": _percentile_ms(lags, 95), "by_path": by_path}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded Axiom traffic against a server")
+    parser.add_argument("recording", help="AXIOM_RECORD_FILE で記録したファイル（.jsonl / .jsonl.gz）")
+    parser.add_argument("--base", default="http://localhost:5000", help="再送先のサーバー")
+    parser.add_argument("--token", default=os.getenv("AXIOM_TOKEN", ""), help="Bearer トークン（既定: AXIOM_TOKEN）")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = 記録時の間隔、N = N 倍速、0 = 最速")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--paths", default=",".join(RECORDED_PATHS), help="再送するパス（カンマ区切り）")
+    parser.add_argument("--limit", type=int, default=0, help="先頭から N 件だけ再送")
+    parser.add_argument("--json", help="結果を JSON で書き出すパス")
+    args = parser.parse_args(argv)
+
+    paths = {p.strip() for p in args.paths.split(",") if p.strip()}
+    entries = [e for e in load_recording(args.recording) if e["path"] in paths]
+    if args.limit:
+        entries = entries[:args.limit]
+    span_sec = entries[-1]["t"] - entries[0]["t"] if entries else 0
+    print(f"▶️ [Replay] {len(entries)} requests spanning {span_sec:.1f}s → {args.base} (speed {args.speed or 'max'})")
+    driver = ReplayDriver(args.base, token=args.token, speed=args.speed, concurrency=args.concurrency)
+    report = driver.run(entries)
+    print(f"✅ [Replay] {report['requests']} sent in {report['wall_sec']}s ({report['throughput_rps']} req/s), "
+          f"schedule lag p95 {report['schedule_lag_p95_ms']}ms")
+    for path, s in report["by_path"].items():
+        print(f"   {path:<18} n={s['count']:<6} status {s['status']}  p50 {s['p50_ms']}ms  p95 {s['p95_ms']}ms  p99 {s['p99_ms']}ms")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()